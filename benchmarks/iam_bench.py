@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+# Benchmarks the main krux_iam workflows offline, against a MemoryBackend with
+# a configurable per call latency, across account sizes and concurrency levels.
+# Results are written as JSON, so runs of different versions can be compared:
+#
+#     python benchmarks/iam_bench.py --sizes 10 1000 100000 --latency 0.01 --output before.json
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no tracemalloc; peak memory is not reported there
+    tracemalloc = None
+
+#
+# Internal libraries
+#
+
+from krux_iam.iam import IAM, UserSpec
+from krux_iam.memory import MemoryBackend
+from krux_iam.throttle import TokenBucket
+
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+DEFAULT_CONCURRENCY = [1, 10]
+DEFAULT_SAMPLE = 100
+DEFAULT_GROUPS = 100
+DEFAULT_GROUPS_PER_USER = 5
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values fall.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def get_groups(iam, usernames, concurrency):
+    return _run_each(iam.get_groups, usernames, concurrency)
+
+
+def delete_user(iam, usernames, concurrency):
+    return _run_each(iam.delete_user, usernames, concurrency)
+
+
+def create_users(iam, usernames, concurrency):
+    specs = [UserSpec('new-' + username, groups=['group00000', 'group00001'], create_access_key=True) for username in usernames]
+    return _run_batch(iam, '_create_user_from_spec', lambda: list(iam.create_users(specs)))
+
+
+def delete_users(iam, usernames, concurrency):
+    return _run_batch(iam, '_delete_user_sequentially', lambda: list(iam.delete_users(usernames)))
+
+
+def snapshot(iam, usernames, concurrency):
+    start = time.time()
+    iam.snapshot(page_size=1000)
+    return [time.time() - start]
+
+
+# Each workflow runs on a sample of usernames and returns the latency of each operation
+WORKFLOWS = {
+    'get_groups': get_groups,
+    'delete_user': delete_user,
+    'create_users': create_users,
+    'delete_users': delete_users,
+    'snapshot': snapshot,
+}
+
+
+def _run_each(func, usernames, concurrency):
+    def timed(username):
+        start = time.time()
+        func(username)
+        return time.time() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(timed, usernames))
+
+
+def _run_batch(iam, worker, run):
+    # Times the per user worker of a batch method, which runs once per user
+    latencies = []
+    func = getattr(iam, worker)
+
+    def timed(*args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            latencies.append(time.time() - start)
+
+    setattr(iam, worker, timed)
+    run()
+    return latencies
+
+
+def run_benchmark(workflow, size, concurrency, latency, sample):
+    """
+    Runs one workflow on a freshly populated account and returns its measurements.
+    """
+    backend = MemoryBackend(seed=0)
+    usernames = backend.populate(
+        users=size,
+        groups=DEFAULT_GROUPS,
+        groups_per_user=DEFAULT_GROUPS_PER_USER,
+        keys_per_user=1,
+    )
+    # Latency only applies once the account is set up
+    backend.latency = latency
+    iam = IAM(
+        boto=None,
+        logger=logging.getLogger('iam-bench'),
+        max_workers=concurrency,
+        rate_limiter=TokenBucket(rate=None),
+        negative_cache_ttl=0,
+        client=backend,
+    )
+    sample_usernames = usernames[:sample]
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+
+    start = time.time()
+    latencies = WORKFLOWS[workflow](iam, sample_usernames, concurrency)
+    elapsed = time.time() - start
+
+    peak_memory = None
+    if tracemalloc is not None:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'workflow': workflow,
+        'users': size,
+        'concurrency': concurrency,
+        'latency': latency,
+        'operations': len(latencies),
+        'seconds': elapsed,
+        'throughput': len(latencies) / elapsed if elapsed else None,
+        'p50': percentile(latencies, 0.5),
+        'p99': percentile(latencies, 0.99),
+        'api_calls': sum(backend.calls.values()),
+        'api_calls_by_operation': dict(backend.calls),
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks krux_iam workflows against an in-memory IAM.')
+    parser.add_argument(
+        '--workflows',
+        nargs='+',
+        choices=sorted(WORKFLOWS),
+        default=sorted(WORKFLOWS),
+        help='Workflows to run. (default: all)',
+    )
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=int,
+        default=DEFAULT_SIZES,
+        help='Numbers of users in the account. (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--concurrency',
+        nargs='+',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Numbers of worker threads. (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.0,
+        help='Seconds every API call takes. (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--sample',
+        type=int,
+        default=DEFAULT_SAMPLE,
+        help='Number of users each per user workflow acts on. (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='File to write the JSON results to. (default: stdout)',
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    for workflow in args.workflows:
+        for size in args.sizes:
+            for concurrency in args.concurrency:
+                result = run_benchmark(workflow, size, concurrency, args.latency, args.sample)
+                results.append(result)
+                sys.stderr.write('{workflow} users={users} concurrency={concurrency}: {throughput:.1f} ops/s, '
+                                 'p99 {p99:.4f}s, {api_calls} calls\n'.format(**result))
+
+    report = {
+        'python': platform.python_version(),
+        'timestamp': int(time.time()),
+        'parameters': vars(args),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+# Measures the cold start cost of krux_iam: the wall time of importing its modules
+# in a fresh interpreter, net of the interpreter's own startup, and which of the
+# heavy dependencies each import drags in. Results are written as JSON, so runs of
+# different versions can be compared:
+#
+#     python benchmarks/import_bench.py --repeat 20 --output before.json
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import, division
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+
+DEFAULT_MODULES = ['krux_iam.iam', 'krux_iam.cli']
+DEFAULT_REPEAT = 10
+
+# Dependencies which should only be imported once they are actually needed
+HEAVY_MODULES = ['argparse', 'boto3', 'botocore.config', 'krux.cli', 'krux.logging', 'krux.stats', 'krux_boto.boto']
+
+_PROBE = '''
+import json, sys, time
+start = time.time()
+import {module}
+elapsed = time.time() - start
+json.dump({{'seconds': elapsed, 'loaded': [name for name in {heavy!r} if name in sys.modules]}}, sys.stdout)
+'''
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values fall.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure(module, repeat):
+    """
+    Imports the given module in repeat fresh interpreters and returns its measurements.
+    """
+    import_times = []
+    process_times = []
+    loaded = []
+
+    for _ in range(repeat):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)])
+        process_times.append(time.time() - start)
+
+        probe = json.loads(output.decode('utf-8'))
+        import_times.append(probe['seconds'])
+        loaded = probe['loaded']
+
+    return {
+        'module': module,
+        'repeat': repeat,
+        'import_p50': percentile(import_times, 0.5),
+        'import_min': min(import_times),
+        'process_p50': percentile(process_times, 0.5),
+        'heavy_modules_loaded': loaded,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measures the import time of krux_iam modules.')
+    parser.add_argument(
+        '--modules',
+        nargs='+',
+        default=DEFAULT_MODULES,
+        help='Modules to import. (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help='Number of fresh interpreters to import each module in. (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='File to write the JSON results to. (default: stdout)',
+    )
+    args = parser.parse_args(argv)
+
+    results = []
+    for module in args.modules:
+        result = measure(module, args.repeat)
+        results.append(result)
+        sys.stderr.write('{module}: {import_ms:.1f}ms import, loads {loaded}\n'.format(
+            module=module,
+            import_ms=result['import_p50'] * 1000,
+            loaded=', '.join(result['heavy_modules_loaded']) or 'no heavy module',
+        ))
+
+    report = {
+        'python': platform.python_version(),
+        'timestamp': int(time.time()),
+        'parameters': vars(args),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+# GOTCHA: This module uses async generators and asyncio.get_running_loop() and therefore
+# requires Python 3.7 or later.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+#
+# Internal libraries
+#
+
+from krux_iam.iam import get_iam, _add_user_to_group, _remove_user_from_group, _to_user_spec, UserResult
+
+
+# Number of IAM calls an AsyncIAM runs at the same time
+DEFAULT_CONCURRENCY = 50
+
+_DONE = object()
+
+
+def get_async_iam(args=None, logger=None, stats=None, concurrency=DEFAULT_CONCURRENCY):
+    """
+    The asyncio counterpart of get_iam(): returns an AsyncIAM wrapped around the
+    IAM object get_iam() builds from the same arguments.
+    """
+    return AsyncIAM(get_iam(args=args, logger=logger, stats=stats), concurrency=concurrency)
+
+
+class AsyncIAM(object):
+    """
+    An asyncio manager with the same methods as IAM, as coroutines. The blocking
+    botocore calls are run on a thread pool, and a semaphore bounds how many of
+    them are in flight, so that hundreds of users can be handled at once without
+    blocking the event loop. The rate limiting and retries of the wrapped IAM
+    object still apply.
+    """
+
+    def __init__(self, iam, concurrency=DEFAULT_CONCURRENCY):
+        self._iam = iam
+        self._concurrency = concurrency
+        # Created in the event loop running the calls, see _get_semaphore()
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # Waiting for the calls in flight must not block the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """
+        Shuts down the thread pool once the calls in flight are done. This blocks;
+        from a coroutine, leave an "async with" block instead.
+        """
+        self._executor.shutdown(wait=True)
+
+    async def create_access_keys(self, username):
+        return await self._run(self._iam.create_access_keys, username)
+
+    async def get_access_keys(self, username, page_size=None, snapshot=None, compact=False):
+        return await self._run(
+            self._iam.get_access_keys, username, page_size=page_size, snapshot=snapshot, compact=compact
+        )
+
+    async def delete_access_key(self, username, key_id):
+        return await self._run(self._iam.delete_access_key, username, key_id)
+
+    async def create_user(self, username):
+        return await self._run(self._iam.create_user, username)
+
+    async def delete_user(self, username):
+        return await self._run(self._iam.delete_user, username)
+
+    async def get_user(self, username, snapshot=None):
+        return await self._run(self._iam.get_user, username, snapshot=snapshot)
+
+    async def add_user_to_group(self, username, group):
+        return await self._run(self._iam.add_user_to_group, username, group)
+
+    async def delete_user_from_group(self, username, group_name):
+        return await self._run(self._iam.delete_user_from_group, username, group_name)
+
+    async def get_groups(self, username, page_size=None, snapshot=None, compact=False):
+        return await self._run(self._iam.get_groups, username, page_size=page_size, snapshot=snapshot, compact=compact)
+
+    async def get_group_members(self, group_name, page_size=None, snapshot=None):
+        return await self._run(self._iam.get_group_members, group_name, page_size=page_size, snapshot=snapshot)
+
+    async def snapshot(self, include_access_keys=False, page_size=None):
+        return await self._run(self._iam.snapshot, include_access_keys=include_access_keys, page_size=page_size)
+
+    async def iter_access_keys(self, username, page_size=None, compact=False):
+        """
+        Asynchronously iterates over the access keys of the given user, fetching
+        each page only when it is reached.
+        """
+        async for key in self._iterate(self._iam.iter_access_keys(username, page_size=page_size, compact=compact)):
+            yield key
+
+    async def iter_groups(self, username, page_size=None, compact=False):
+        """
+        Asynchronously iterates over the groups of the given user, fetching each
+        page only when it is reached.
+        """
+        async for group in self._iterate(self._iam.iter_groups(username, page_size=page_size, compact=compact)):
+            yield group
+
+    async def iter_users(self, page_size=None, compact=False):
+        """
+        Asynchronously iterates over every user of the account, fetching each page
+        only when it is reached.
+        """
+        async for user in self._iterate(self._iam.iter_users(page_size=page_size, compact=compact)):
+            yield user
+
+    async def iter_group_members(self, group_name, page_size=None, compact=False):
+        """
+        Asynchronously iterates over the users in the given group, fetching each
+        page only when it is reached.
+        """
+        async for user in self._iterate(self._iam.iter_group_members(group_name, page_size=page_size, compact=compact)):
+            yield user
+
+    async def add_users_to_group(self, group_name, usernames):
+        """
+        The asynchronous add_users_to_group: yields a UserResult per user as it completes.
+        """
+        add = functools.partial(_add_user_to_group, self._iam, group_name)
+
+        async for result in self._as_completed([(username, add, username) for username in usernames]):
+            yield result
+
+    async def remove_users_from_group(self, group_name, usernames):
+        """
+        The asynchronous remove_users_from_group: yields a UserResult per user as it completes.
+        """
+        remove = functools.partial(_remove_user_from_group, self._iam, group_name)
+
+        async for result in self._as_completed([(username, remove, username) for username in usernames]):
+            yield result
+
+    async def create_users(self, specs):
+        """
+        The asynchronous create_users: yields a UserResult per user as it completes.
+        """
+        specs = [_to_user_spec(spec) for spec in specs]
+        calls = [(spec.username, self._iam._create_user_from_spec, spec) for spec in specs]
+
+        async for result in self._as_completed(calls):
+            yield result
+
+    async def delete_users(self, usernames):
+        """
+        The asynchronous delete_users: yields a UserResult per user as it completes.
+        """
+        calls = [(username, self._iam._delete_user_sequentially, username) for username in usernames]
+
+        async for result in self._as_completed(calls):
+            yield result
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        async with self._get_semaphore(loop):
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def _get_semaphore(self, loop):
+        """
+        Returns the semaphore of the given running loop. Before Python 3.10, a semaphore
+        is bound to the event loop current when it is made, so it cannot be made in
+        __init__, which may run before asyncio.run() starts the loop.
+        """
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def _iterate(self, iterator):
+        while True:
+            item = await self._run(next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    async def _as_completed(self, calls):
+        async def call(username, func, arg):
+            try:
+                return UserResult(username, await self._run(func, arg), None)
+            except Exception as error:
+                return UserResult(username, None, error)
+
+        for future in asyncio.as_completed([call(*args) for args in calls]):
+            yield await future
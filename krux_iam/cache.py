@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import OrderedDict
+import threading
+import time
+
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 60
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+class TTLCache(object):
+    """
+    A thread safe mapping whose entries expire ttl seconds after being set and
+    which holds at most maxsize entries, evicting the least recently used one
+    when full.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under key, or default if there is none or it has expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+
+            expires, value = entry
+            if expires <= _monotonic():
+                return default
+
+            # Re-inserting moves the entry to the most recently used end
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (_monotonic() + self._ttl, value)
+
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """
+        Removes the entry stored under key, if any.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        with self._lock:
+            self._entries.clear()
@@ -8,8 +8,10 @@
 #
 
 from __future__ import absolute_import
-import os
-from pprint import pprint
+import argparse
+import datetime
+import json
+import sys
 
 #
 # Internal libraries
@@ -17,16 +19,28 @@ from pprint import pprint
 
 from krux.cli import get_group
 import krux_boto.cli
-from krux_iam.iam import add_iam_cli_arguments, get_iam, NAME, IAM
+from krux_iam.iam import add_iam_cli_arguments, get_iam, NAME, IAM, DEFAULT_MAX_WORKERS
+from krux_iam.journal import Journal
 
 
 class Application(krux_boto.cli.Application):
+    """
+    Bulk command line interface to IAM. Every command takes usernames as arguments,
+    from a file given with --file, or one per line on stdin, runs with --concurrency
+    calls in flight and writes one JSON object per user to stdout as soon as that
+    user is done, so that large lists can be piped through it.
+    """
 
     def __init__(self, name=NAME):
         # Call to the superclass to bootstrap.
         super(Application, self).__init__(name=name)
 
-        self.iam = get_iam(self.args, self.logger, self.stats)
+        self.iam = get_iam(
+            self.args,
+            self.logger,
+            self.stats,
+            max_workers=getattr(self.args, 'concurrency', DEFAULT_MAX_WORKERS),
+        )
 
     def add_cli_arguments(self, parser):
         # Call to the superclass
@@ -34,9 +48,204 @@ class Application(krux_boto.cli.Application):
 
         add_iam_cli_arguments(parser, include_boto_arguments=False)
 
+        # Options shared by every command, so they can follow it on the command line
+        common = argparse.ArgumentParser(add_help=False)
+        common.add_argument(
+            'names',
+            nargs='*',
+            help='Usernames to act on. If none are given, they are read from --file or stdin, one per line.',
+        )
+        common.add_argument(
+            '--file',
+            default=None,
+            help='File to read the usernames from, one per line. Use - for stdin.',
+        )
+        common.add_argument(
+            '--concurrency',
+            type=int,
+            default=DEFAULT_MAX_WORKERS,
+            help='Number of users to work on at once. (default: %(default)s)',
+        )
+
+        commands = parser.add_subparsers(dest='command', title='commands')
+
+        users = commands.add_parser('users', help='List, get, create or delete users.')
+        users_commands = users.add_subparsers(dest='users_command', title='users commands')
+        users_list = users_commands.add_parser('list', help='List every user of the account.')
+        users_list.add_argument(
+            '--page-size',
+            type=int,
+            default=None,
+            help='Number of users to fetch per request.',
+        )
+        users_commands.add_parser('get', parents=[common], help='Get the given users.')
+        users_create = users_commands.add_parser('create', parents=[common], help='Create the given users.')
+        users_create.add_argument(
+            '--group',
+            action='append',
+            default=[],
+            dest='groups',
+            help='Group to add the created users to. May be repeated.',
+        )
+        users_create.add_argument(
+            '--create-access-key',
+            action='store_true',
+            default=False,
+            help='Issue an access key for each created user.',
+        )
+        users_delete = users_commands.add_parser('delete', parents=[common], help='Delete the given users.')
+        users_delete.add_argument(
+            '--journal',
+            default=None,
+            help='File recording the completed steps, so that a restarted run skips them.',
+        )
+
+        commands.add_parser('groups', parents=[common], help='List the groups of the given users.')
+        commands.add_parser('keys', parents=[common], help='List the access keys of the given users.')
+        commands.add_parser('rotate', parents=[common], help='Replace the access keys of the given users.')
+
     def run(self):
-        # Basic check to get user
-        pprint(self.iam.get_user('phan'))
+        command = getattr(self.args, 'command', None)
+        if command == 'users':
+            command = 'users_{0}'.format(getattr(self.args, 'users_command', None))
+
+        handler = getattr(self, '_run_{0}'.format(command), None)
+        if handler is None:
+            self.parser.print_help()
+            return
+
+        for record in handler():
+            self._write(record)
+
+    def _run_users_list(self):
+        return self.iam.iter_users(page_size=self.args.page_size)
+
+    def _run_users_get(self):
+        return self._map(lambda username: {'UserName': username, 'User': self.iam.get_user(username)})
+
+    def _run_users_create(self):
+        specs = (
+            {'username': username, 'groups': self.args.groups, 'create_access_key': self.args.create_access_key}
+            for username in self._names()
+        )
+
+        for result in self.iam.create_users(specs):
+            if result.error is not None:
+                yield _error_record(result.username, result.error)
+                continue
+
+            record = {'UserName': result.username, 'User': result.result['User'], 'Groups': result.result['Groups']}
+            if result.result['AccessKey'] is not None:
+                record['AccessKeyId'], record['SecretAccessKey'] = result.result['AccessKey']
+            yield record
+
+    def _run_users_delete(self):
+        if not getattr(self.args, 'journal', None):
+            return self._delete_users(None)
+        return self._delete_users_journaled()
+
+    def _delete_users_journaled(self):
+        with Journal(self.args.journal) as journal:
+            for record in self._delete_users(journal):
+                yield record
+
+    def _delete_users(self, journal):
+        for result in self.iam.delete_users(self._names(), journal=journal):
+            if result.error is not None:
+                yield _error_record(result.username, result.error)
+            else:
+                yield {'UserName': result.username, 'Deleted': True}
+
+    def _run_groups(self):
+        return self._map(lambda username: {
+            'UserName': username,
+            'Groups': [group['GroupName'] for group in self.iam.get_groups(username)],
+        })
+
+    def _run_keys(self):
+        return self._map(lambda username: {'UserName': username, 'AccessKeys': self.iam.get_access_keys(username)})
+
+    def _run_rotate(self):
+        return self._map(self._rotate)
+
+    def _rotate(self, username):
+        """
+        Issues a new access key for the user and then deletes their old ones. A user
+        who already has the maximum of two keys is left alone. The new key is always
+        part of the record, as its secret cannot be retrieved again; the old keys which
+        failed to be deleted are reported in it alongside.
+        """
+        old_keys = self.iam.get_access_keys(username)
+        if len(old_keys) >= 2:
+            raise ValueError('User {0} already has two access keys'.format(username))
+
+        key_id, secret_key = self.iam.create_access_keys(username)
+        record = {
+            'UserName': username,
+            'AccessKeyId': key_id,
+            'SecretAccessKey': secret_key,
+            'DeletedAccessKeyIds': [],
+        }
+
+        errors = []
+        for key in old_keys:
+            try:
+                self.iam.delete_access_key(username, key['AccessKeyId'])
+            except Exception as error:
+                errors.append('Failed to delete access key {0}: {1}'.format(key['AccessKeyId'], error))
+            else:
+                record['DeletedAccessKeyIds'].append(key['AccessKeyId'])
+
+        if errors:
+            record['Error'] = '; '.join(errors)
+        return record
+
+    def _map(self, func):
+        """
+        Calls func on every username concurrently and yields the records it returns,
+        or an error record, as the users complete.
+        """
+        for result in self.iam.map_users(func, self._names()):
+            yield _error_record(result.username, result.error) if result.error is not None else result.result
+
+    def _names(self):
+        """
+        Yields the usernames given on the command line, or else read from --file or stdin.
+        """
+        if self.args.names:
+            for name in self.args.names:
+                yield name
+            return
+
+        if self.args.file and self.args.file != '-':
+            with open(self.args.file) as names:
+                for name in _read_names(names):
+                    yield name
+        else:
+            for name in _read_names(sys.stdin):
+                yield name
+
+    def _write(self, record):
+        sys.stdout.write(json.dumps(record, default=_json_default, sort_keys=True))
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+
+def _read_names(lines):
+    for line in lines:
+        name = line.strip()
+        if name:
+            yield name
+
+
+def _error_record(username, error):
+    return {'UserName': username, 'Error': str(error)}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError('{0!r} is not JSON serializable'.format(value))
 
 
 def main():
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import threading
+
+
+# Size of the HTTP connection pool of each client; botocore's own default is 10,
+# which threaded callers quickly exhaust.
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+
+
+class ClientRegistry(object):
+    """
+    A process wide, thread safe registry of boto clients, so that IAM objects
+    built with the same credentials and region share one client and its HTTP
+    connection pool instead of each paying for a new client and TLS handshakes.
+
+    Clients are never shared across processes: after a fork, the child starts
+    with an empty registry, as the pooled connections belong to the parent.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, key, factory):
+        """
+        Returns the client registered under key, creating and registering it
+        with factory() if there is none yet.
+        """
+        if self._pid != os.getpid():
+            self._reset()
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = factory()
+            return client
+
+    def clear(self):
+        """
+        Forgets every registered client.
+        """
+        with self._lock:
+            self._clients.clear()
+
+
+_registry = ClientRegistry()
+
+# A lock held by another thread at fork time would stay locked forever in the child
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_registry._reset)
+
+
+def get_client_registry():
+    """
+    Returns the process wide ClientRegistry.
+    """
+    return _registry
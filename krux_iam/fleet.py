@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from argparse import Namespace
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+try:
+    import queue
+except ImportError:
+    # Python 2
+    import Queue as queue
+
+#
+# Internal libraries
+#
+
+from krux_iam.client import DEFAULT_MAX_POOL_CONNECTIONS
+from krux_iam.iam import get_iam
+from krux_iam.keys import KeyIndex, to_key_info
+from krux_iam.throttle import DEFAULT_BURST, DEFAULT_RATE, TokenBucket
+
+
+# Number of accounts queried at once
+DEFAULT_MAX_ACCOUNTS = 10
+
+# Number of results buffered between the accounts being queried and the consumer
+DEFAULT_BUFFER = 1000
+
+DEFAULT_BOTO_LOG_LEVEL = 'warning'
+
+# An account of a Fleet: a name to tell it by and the credentials and region its
+# Boto3 object is built with, as get_iam() would from the command line.
+Account = namedtuple('Account', ['name', 'access_key', 'secret_key', 'region'])
+
+# One result of a query run across a Fleet: the name of the account it comes from
+# and either the result or the error the query raised in that account.
+FleetResult = namedtuple('FleetResult', ['account', 'result', 'error'])
+
+# Marks the end of the results of one account
+_DONE = object()
+
+
+class Fleet(object):
+    """
+    Holds an IAM object per account and runs queries across the accounts in parallel,
+    at most max_accounts at once, merging their results into a single stream as they
+    come in. Every account gets its own TokenBucket of the given rate and burst, so
+    one account being throttled does not slow the others down.
+    """
+
+    def __init__(
+        self,
+        accounts=(),
+        logger=None,
+        stats=None,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        max_accounts=DEFAULT_MAX_ACCOUNTS,
+        buffer_size=DEFAULT_BUFFER,
+        boto_log_level=DEFAULT_BOTO_LOG_LEVEL,
+        **kwargs
+    ):
+        """
+        accounts is an iterable of Accounts. Any other keyword arguments are passed on
+        to get_iam() for every account.
+        """
+        self._logger = logger
+        self._stats = stats
+        self._rate = rate
+        self._burst = burst
+        self._max_accounts = max_accounts
+        self._buffer_size = buffer_size
+        self._boto_log_level = boto_log_level
+        self._iam_kwargs = kwargs
+        self._iams = OrderedDict()
+
+        for account in accounts:
+            self.add(account)
+
+    def __len__(self):
+        return len(self._iams)
+
+    def __getitem__(self, name):
+        return self._iams[name]
+
+    def names(self):
+        """
+        Returns the names of the accounts, in the order they were added.
+        """
+        return list(self._iams)
+
+    def add(self, account, iam=None):
+        """
+        Adds the given Account, with an IAM object built by get_iam() from its credentials
+        unless one is given, e.g. for credentials get_iam() cannot build a client from.
+        """
+        if iam is None:
+            args = Namespace(
+                boto_access_key=account.access_key,
+                boto_secret_key=account.secret_key,
+                boto_region=account.region,
+                boto_log_level=self._boto_log_level,
+                iam_max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+            )
+            iam = get_iam(
+                args=args,
+                logger=self._logger,
+                stats=self._stats,
+                rate_limiter=TokenBucket(rate=self._rate, burst=self._burst),
+                **self._iam_kwargs
+            )
+
+        self._iams[account.name] = iam
+
+    def map(self, func, accounts=None):
+        """
+        Calls func(iam) for each of the given account names, or every account, and
+        yields a FleetResult per account as they complete.
+        """
+        return self.stream(lambda iam: [func(iam)], accounts=accounts)
+
+    def stream(self, func, accounts=None):
+        """
+        Calls func(iam), which returns an iterable, for each of the given account names,
+        or every account, and yields a FleetResult for each item as soon as any account
+        produces it. An error raised by func is yielded as the last FleetResult of that
+        account.
+
+        Stopping the iteration early stops the queries as they produce their next item,
+        and the accounts not started yet are not queried; it returns once the running
+        queries have stopped. A func doing all of its work before producing its first
+        item, as a map() query does, is therefore waited for.
+        """
+        names = list(accounts) if accounts is not None else self.names()
+        if not names:
+            return
+
+        results = queue.Queue(maxsize=self._buffer_size)
+        stopped = threading.Event()
+
+        def produce(name):
+            if stopped.is_set():
+                return
+            try:
+                for item in func(self._iams[name]):
+                    if not _put(results, stopped, FleetResult(name, item, None)):
+                        return
+            except Exception as error:
+                _put(results, stopped, FleetResult(name, None, error))
+            finally:
+                _put(results, stopped, _DONE)
+
+        executor = ThreadPoolExecutor(max_workers=min(self._max_accounts, len(names)))
+        try:
+            for name in names:
+                executor.submit(produce, name)
+
+            remaining = len(names)
+            while remaining:
+                result = results.get()
+                if result is _DONE:
+                    remaining -= 1
+                else:
+                    yield result
+        finally:
+            stopped.set()
+            executor.shutdown(wait=True)
+
+    def find_user(self, username):
+        """
+        Yields a FleetResult holding the user's attributes for every account the user
+        exists in, and one for every account that could not be queried.
+        """
+        for result in self.map(lambda iam: iam.get_user(username)):
+            if result.error is not None or result.result is not None:
+                yield result
+
+    def stale_keys(self, max_age, now=None):
+        """
+        Yields a FleetResult holding a KeyInfo for every active access key, across all
+        accounts, created more than max_age seconds ago. The keys of each account are
+        listed user by user, max_workers users at a time, and yielded as each listing
+        completes, oldest first per user, so stopping the iteration early stops them.
+        """
+        return self.stream(lambda iam: _iter_stale_keys(iam, max_age, now))
+
+
+def _iter_stale_keys(iam, max_age, now):
+    usernames = (user['UserName'] for user in iam.iter_users())
+    for result in iam.map_users(iam.get_access_keys, usernames):
+        if result.error is not None:
+            raise result.error
+
+        keys = KeyIndex(to_key_info(result.username, key) for key in result.result)
+        for key in keys.older_than(max_age, now=now):
+            yield key
+
+
+def _put(results, stopped, item):
+    # Waits for room in the queue, unless the consumer is gone; returns whether the item was put
+    while not stopped.is_set():
+        try:
+            results.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
@@ -8,27 +8,71 @@
 #
 
 from __future__ import absolute_import
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+import functools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 #
 # Third party libraries
 #
 
-import botocore
+from botocore.exceptions import BotoCoreError, ClientError
 
 #
 # Internal libraries
 #
 
-from krux.logging import get_logger
-from krux.stats import get_stats
-from krux.cli import get_parser, get_group
-from krux_boto.boto import Boto3, add_boto_cli_arguments
+# GOTCHA: krux.cli, krux.logging, krux.stats, krux_boto and botocore.config are imported
+# where they are used rather than here. Between them they pull in argparse, boto3 and
+# most of botocore, which short lived processes using IAM as a library may never need.
+from krux_iam.keys import ACTIVE, INACTIVE, MAX_KEYS_PER_USER, KeyIndex, KeyInfo, RotationResult, to_epoch
+from krux_iam.policy import PolicyCache, PolicyEvaluator
+from krux_iam.records import AccessKey, Group, User
+from krux_iam.report import CredentialReport, CredentialReportTimeout
+from krux_iam.singleflight import SingleFlight
+from krux_iam.snapshot import Snapshot
+from krux_iam.cache import TTLCache
+from krux_iam.client import DEFAULT_MAX_POOL_CONNECTIONS, get_client_registry
+from krux_iam.throttle import DecorrelatedJitter, get_error_code, get_rate_limiter, is_not_found_error, \
+    is_retryable_error, is_throttling_error
+from krux_iam.watch import Watcher
 
 
 NAME = 'krux-iam'
 
+# Number of threads used to fan out independent calls, e.g. the group removals and
+# key deletions of delete_user.
+DEFAULT_MAX_WORKERS = 10
 
-def get_iam(args=None, logger=None, stats=None):
+# Number of times a throttled or transiently failing call is retried before giving up
+DEFAULT_MAX_RETRIES = 8
+
+# botocore's own retries of throttling and transient errors are turned off: IAM._call
+# retries those itself, taking a token from the rate limiter for every attempt. With
+# both layers, every attempt of _call would be up to five requests of botocore's.
+NO_BOTOCORE_RETRIES = {'max_attempts': 0}
+
+# Number of seconds get_user remembers that a user does not exist
+DEFAULT_NEGATIVE_CACHE_TTL = 10
+
+# Number of seconds get_credential_report waits for IAM to generate the report, and
+# waits between checks
+DEFAULT_REPORT_TIMEOUT = 300
+DEFAULT_REPORT_POLL_INTERVAL = 2
+
+# Number of seconds between the polls of watch
+DEFAULT_WATCH_INTERVAL = 60
+
+# Marks a cache miss, as None is a valid cached value
+_MISSING = object()
+
+
+def get_iam(args=None, logger=None, stats=None, **kwargs):
     """
     Return a usable IAM object without creating a class around it.
     In the context of a krux.cli (or similar) interface the 'args', 'logger'
@@ -38,30 +82,57 @@ def get_iam(args=None, logger=None, stats=None):
     the Boto object will still work, but its cli options won't show up in
     --help output)
     (This also handles instantiating a Boto3 object on its own.)
+
+    The Boto3 object and its IAM client are only created on the first API call of
+    the IAM object. They are kept in a process wide registry keyed by the credentials,
+    region and connection pool size, so later calls with the same arguments reuse
+    them, along with their open connections.
+    Any other keyword arguments are passed on to IAM.
     """
     if not args:
+        from krux.cli import get_parser
+
         parser = get_parser(description=NAME)
         add_iam_cli_arguments(parser)
         args = parser.parse_args()
 
     if not logger:
+        from krux.logging import get_logger
+
         logger = get_logger(name=NAME)
 
     if not stats:
+        from krux.stats import get_stats
+
         stats = get_stats(prefix=NAME)
 
-    boto = Boto3(
-        log_level=args.boto_log_level,
-        access_key=args.boto_access_key,
-        secret_key=args.boto_secret_key,
-        region=args.boto_region,
-        logger=logger,
-        stats=stats,
-    )
+    max_pool_connections = getattr(args, 'iam_max_pool_connections', DEFAULT_MAX_POOL_CONNECTIONS)
+    key = (args.boto_access_key, args.boto_secret_key, args.boto_region, max_pool_connections)
+
+    def create_client():
+        from botocore.config import Config
+        from krux_boto.boto import Boto3
+
+        boto = Boto3(
+            log_level=args.boto_log_level,
+            access_key=args.boto_access_key,
+            secret_key=args.boto_secret_key,
+            region=args.boto_region,
+            logger=logger,
+            stats=stats,
+        )
+        config = Config(max_pool_connections=max_pool_connections, retries=NO_BOTOCORE_RETRIES)
+        return boto, boto.client(IAM._IAM_STR, config=config)
+
+    def get_client():
+        return get_client_registry().get(key, create_client)[1]
+
     return IAM(
-        boto=boto,
+        boto=None,
         logger=logger,
         stats=stats,
+        client_factory=get_client,
+        **kwargs
     )
 
 
@@ -69,7 +140,11 @@ def add_iam_cli_arguments(parser, include_boto_arguments=True):
     """
     Utility function for adding IAM specific CLI arguments.
     """
+    from krux.cli import get_group
+
     if include_boto_arguments:
+        from krux_boto.boto import add_boto_cli_arguments
+
         # GOTCHA: Since many modules use krux_boto, the krux_boto's CLI arguments can be included twice,
         # causing an error. This creates a way to circumvent that.
 
@@ -79,12 +154,107 @@ def add_iam_cli_arguments(parser, include_boto_arguments=True):
     # Add those specific to the application
     group = get_group(parser, NAME)
 
+    group.add_argument(
+        '--iam-max-pool-connections',
+        type=int,
+        default=DEFAULT_MAX_POOL_CONNECTIONS,
+        help='Maximum number of HTTP connections kept open to IAM. (default: %(default)s)',
+    )
+
+
+# A user to provision with create_users: the groups to add them to and whether
+# to issue an access key for them.
+UserSpec = namedtuple('UserSpec', ['username', 'groups', 'create_access_key'])
+UserSpec.__new__.__defaults__ = ((), False)
+
+# The outcome of one user of create_users / delete_users. Either result or error is set.
+UserResult = namedtuple('UserResult', ['username', 'result', 'error'])
+
+
+def _instrumented(func):
+    """
+    Decorator for the public methods of IAM: times and counts every call through
+    the stats object, tagging failures with their AWS error code.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._measure('method.{0}'.format(func.__name__)):
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+def _instrumented_iterator(func):
+    """
+    Decorator for the public generator methods of IAM: counts every call and the
+    items it yielded under <name>.results, and times the iteration until it is
+    exhausted, fails or is closed by the caller, time spent by the caller included.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        stat = 'method.{0}'.format(func.__name__)
+        results = 0
+        try:
+            with self._measure(stat):
+                for item in func(self, *args, **kwargs):
+                    results += 1
+                    yield item
+        finally:
+            self._stats.incr('{0}.results'.format(stat), results)
+
+    return wrapper
+
+
+class BatchError(Exception):
+    """
+    Raised when one or more of a set of calls dispatched together failed.
+    The exceptions raised by the failed calls are available as errors.
+    """
+
+    def __init__(self, message, errors):
+        super(BatchError, self).__init__('{0}: {1}'.format(message, '; '.join(str(error) for error in errors)))
+        self.errors = errors
+
 
 class IAM(object):
     """
     A manager to handle all IAM related functions.
+
+    The IAM client, unless one is given, is created on the first API call, by
+    client_factory if given or else from the boto object. Only the clients of
+    get_iam() are shared through the ClientRegistry: each IAM object built directly
+    from a boto object creates a client, and connection pool, of its own. A client
+    created by the IAM object is created again in a forked child process, while a
+    given one is used as it is.
+
+    Every client call is paced by a TokenBucket rate limiter, shared by all IAM
+    objects of the process unless one is passed in, and is retried with
+    decorrelated jitter backoff on throttling and transient errors.
+
+    If a cache (e.g. a krux_iam.cache.TTLCache) is given, get_user, get_groups,
+    get_group_members and get_access_keys are served from it, and the writes
+    invalidate the entries of the users they affect. The cached members of a
+    group are updated in place by membership changes instead. The attached and
+    inline policies of users and groups are cached the same way.
+
+    Managed policy documents are kept by version in a PolicyCache, which may be
+    shared between IAM objects, and stored once per distinct content.
+
+    Concurrent identical lookups, cached or not, share a single in flight call and
+    its result or exception; each caller served that way is counted under
+    singleflight.shared.<kind>.
+
+    Independently of that cache, get_user remembers for negative_cache_ttl seconds
+    that a user does not exist, so repeated existence checks for missing users do
+    not reach the API. A negative_cache_ttl of 0 turns this off.
+
+    Every public method call (method.<name>) and every client call (client.<operation>)
+    is timed and counted through stats, with errors counted under <stat>.error.<code>
+    and the pages of paginated calls under pages.<operation>. The methods yielding
+    their results also count those under method.<name>.results, and are timed over
+    the whole iteration. With log_latency, the latency of each of them is also logged
+    at debug level.
     """
-    ### TODO: Error handling for methods
 
     _IAM_STR = 'iam'
 
@@ -93,109 +263,1127 @@ class IAM(object):
         boto,
         logger=None,
         stats=None,
+        max_workers=DEFAULT_MAX_WORKERS,
+        rate_limiter=None,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff=None,
+        cache=None,
+        negative_cache_ttl=DEFAULT_NEGATIVE_CACHE_TTL,
+        log_latency=False,
+        client=None,
+        client_factory=None,
+        policy_cache=None,
     ):
         # Private variables, not to be used outside this module
         self._name = NAME
-        self._logger = logger or get_logger(self._name)
-        self._stats = stats or get_stats(prefix=self._name)
+        if logger is None:
+            from krux.logging import get_logger
+
+            logger = get_logger(self._name)
+        self._logger = logger
+        if stats is None:
+            from krux.stats import get_stats
+
+            stats = get_stats(prefix=self._name)
+        self._stats = stats
+        self._max_workers = max_workers
+        self._rate_limiter = rate_limiter or get_rate_limiter()
+        self._max_retries = max_retries
+        self._backoff = backoff or DecorrelatedJitter()
+        self._cache = cache
+        self._negative_cache = TTLCache(ttl=negative_cache_ttl) if negative_cache_ttl else None
+        self._log_latency = log_latency
+        self._flights = SingleFlight()
+        self._policy_cache = policy_cache if policy_cache is not None else PolicyCache()
+        # Serializes the read-modify-write updates of the cached group member lists
+        self._members_lock = threading.Lock()
+        # Cache key -> number of writes which made it outdated, so a fetch started
+        # before one of them does not cache what it read
+        self._generations = {}
+        self._generations_lock = threading.Lock()
 
-        # Private client representing IAM
-        self._client = boto.client(IAM._IAM_STR)
+        # Private client representing IAM, unless a shared one is given. It is created
+        # on the first API call, by client_factory if given, and again in a forked child.
+        self._client_lock = threading.Lock()
+        self._lazy_client = client
+        # The process which created the client, None for a given one
+        self._client_pid = None
+        self._client_factory = client_factory or (lambda: _create_client(boto))
 
+    @property
+    def _client(self):
+        pid = os.getpid()
+        if self._lazy_client is None or self._client_pid not in (None, pid):
+            if self._client_pid not in (None, pid):
+                # Created before a fork: the pooled connections, and a lock held by
+                # another thread at the time, belong to the parent
+                self._client_lock = threading.Lock()
+            with self._client_lock:
+                if self._lazy_client is None or self._client_pid not in (None, pid):
+                    self._lazy_client = self._client_factory()
+                    self._client_pid = pid
+        return self._lazy_client
+
+    @_client.setter
+    def _client(self, client):
+        self._lazy_client = client
+        self._client_pid = None
+
+    @_instrumented
     def create_access_keys(self, username):
         """
         Creates and returns an AWS access key and secret key for the given user.
         """
-        response = self._client.create_access_key(
+        response = self._call(
+            'create_access_key',
             UserName=username
         )
+        self._invalidate(('access_keys', username))
         key = response['AccessKey']
 
         return key['AccessKeyId'], key['SecretAccessKey']
 
-    def get_access_keys(self, username):
+    @_instrumented_iterator
+    def iter_access_keys(self, username, page_size=None, compact=False):
         """
-        Gets all access keys for a given user. Returns a list of dicts representing access keys.
+        Lazily yields the access keys of the given user as dicts, or as AccessKey
+        records with compact, following the pagination markers one page at a time.
         """
-        response = self._client.list_access_keys(
+        keys = self._paginate(
+            'list_access_keys',
+            'AccessKeyMetadata',
+            page_size=page_size,
             UserName=username
         )
 
-        return response['AccessKeyMetadata']
+        return _compacted(keys, AccessKey) if compact else keys
+
+    @_instrumented
+    def get_access_keys(self, username, page_size=None, snapshot=None, compact=False):
+        """
+        Gets all access keys for a given user. Returns a list of dicts representing access keys,
+        or of AccessKey records with compact.
+        If a Snapshot taken with include_access_keys is given, the keys are read from it instead.
+        """
+        if snapshot is not None:
+            keys = snapshot.get_access_keys(username)
+        else:
+            keys = self._cached(
+                ('access_keys', username),
+                lambda: list(self.iter_access_keys(username, page_size=page_size))
+            )
+
+        return list(_compacted(keys, AccessKey) if compact else keys)
 
+    @_instrumented
     def delete_access_key(self, username, key_id):
         """
         Deletes the access key associated with the given user.
         """
-        self._client.delete_access_key(
+        self._call(
+            'delete_access_key',
+            UserName=username,
+            AccessKeyId=key_id
+        )
+        self._invalidate(('access_keys', username))
+
+    @_instrumented
+    def update_access_key_status(self, username, key_id, status):
+        """
+        Sets the status of the given access key of the user to 'Active' or 'Inactive'.
+        """
+        self._call(
+            'update_access_key',
             UserName=username,
+            AccessKeyId=key_id,
+            Status=status
+        )
+        self._invalidate(('access_keys', username))
+
+    @_instrumented
+    def get_access_key_last_used(self, key_id):
+        """
+        Returns a dict describing when and where the given access key was last used.
+        LastUsedDate is missing if the key was never used.
+        """
+        response = self._call(
+            'get_access_key_last_used',
             AccessKeyId=key_id
         )
 
+        return response['AccessKeyLastUsed']
+
+    @_instrumented
+    def get_credential_report(self, timeout=DEFAULT_REPORT_TIMEOUT, poll_interval=DEFAULT_REPORT_POLL_INTERVAL):
+        """
+        Returns the CredentialReport of the account. IAM is asked to generate a report,
+        which it skips if it has one less than four hours old, and is polled every
+        poll_interval seconds until the report is ready; a CredentialReportTimeout is
+        raised if that takes longer than timeout seconds.
+        """
+        deadline = time.time() + timeout
+
+        while self._call('generate_credential_report')['State'] != 'COMPLETE':
+            if time.time() + poll_interval > deadline:
+                raise CredentialReportTimeout('Credential report not ready after {0} seconds'.format(timeout))
+            time.sleep(poll_interval)
+
+        response = self._call('get_credential_report')
+        content = response['Content']
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+
+        return CredentialReport.from_csv(content.splitlines(), generated_at=to_epoch(response.get('GeneratedTime')))
+
+    @_instrumented
+    def rotate_keys(self, max_age, sink, usernames=None, index=None, delete_old_keys=False, now=None):
+        """
+        Replaces every active access key older than max_age seconds (as of now, in epoch
+        seconds, defaulting to the current time), of the given users or of the whole
+        account, in phases:
+
+        1. For each user with old keys, a new key is created, concurrently across users,
+           and handed to sink(username, access_key_id, secret_access_key). A user at the
+           limit of two keys first has their oldest inactive key deleted; a user with two
+           active keys is skipped.
+        2. The old keys of every user whose new key reached the sink are deactivated.
+        3. With delete_old_keys, the deactivated keys are deleted. Otherwise they are left
+           inactive, to be deleted by a later run once the new keys are known to work.
+
+        The keys are looked up once, through a KeyIndex built from paginated listings
+        unless one is given, and the index is kept up to date with the changes made.
+        Returns a RotationResult per user with old keys.
+        """
+        if usernames is not None:
+            # Read twice, by the listings and to pick the keys of the index
+            usernames = list(usernames)
+        if index is None:
+            index = KeyIndex.from_listings(self, usernames)
+
+        wanted = None if usernames is None else set(usernames)
+        old_keys = defaultdict(list)
+        for key in index.older_than(max_age, now=now):
+            if wanted is None or key.username in wanted:
+                old_keys[key.username].append(key.access_key_id)
+
+        results = {}
+
+        def replace(username):
+            self._make_room_for_key(username, index)
+            key_id, secret_key = self.create_access_keys(username)
+            try:
+                sink(username, key_id, secret_key)
+            except Exception:
+                # The secret is lost, so the new key is of no use
+                self.delete_access_key(username, key_id)
+                raise
+
+            index.add(KeyInfo(username, key_id, ACTIVE, int(now if now is not None else time.time()), None))
+            return key_id
+
+        for username, future in self._imap_unordered(replace, list(old_keys)):
+            error = future.exception()
+            new_key_id = future.result() if error is None else None
+            results[username] = RotationResult(username, new_key_id, old_keys[username], error)
+
+        rotated = [
+            (result.username, key_id)
+            for result in results.values() if result.error is None
+            for key_id in result.old_access_key_ids
+        ]
+
+        def deactivate(user_key):
+            username, key_id = user_key
+            self.update_access_key_status(username, key_id, INACTIVE)
+            index.add(index.get(key_id)._replace(status=INACTIVE))
+
+        def delete(user_key):
+            username, key_id = user_key
+            self.delete_access_key(username, key_id)
+            index.remove(key_id)
+
+        phases = [deactivate, delete] if delete_old_keys else [deactivate]
+
+        for phase in phases:
+            for user_key, future in self._imap_unordered(phase, rotated):
+                if future.exception() is not None:
+                    username = user_key[0]
+                    results[username] = results[username]._replace(error=future.exception())
+            rotated = [user_key for user_key in rotated if results[user_key[0]].error is None]
+
+        return list(results.values())
+
+    def _make_room_for_key(self, username, index):
+        """
+        Deletes the oldest inactive key of a user who has reached the key limit, or
+        raises a ValueError if all their keys are active.
+        """
+        keys = index.keys_for(username)
+        if len(keys) < MAX_KEYS_PER_USER:
+            return
+
+        inactive = [key for key in keys if key.status != ACTIVE]
+        if not inactive:
+            raise ValueError('User {0} already has {1} active access keys'.format(username, len(keys)))
+
+        self.delete_access_key(username, inactive[0].access_key_id)
+        index.remove(inactive[0].access_key_id)
+
+    @_instrumented
     def create_user(self, username):
         """
         Creates user and returns the user as a dict of their attributes.
         """
-        response = self._client.create_user(
+        response = self._call(
+            'create_user',
             UserName=username
         )
+        self._invalidate_user(username)
+        if self._negative_cache is not None:
+            self._negative_cache.invalidate(username)
 
         return response['User']
 
+    @_instrumented_iterator
+    def create_users(self, specs):
+        """
+        Creates the users described by the given UserSpecs (plain usernames and dicts
+        of UserSpec fields are accepted too), adds them to their groups and issues
+        their access keys, with at most max_workers users being worked on at once.
+
+        Yields a UserResult per user as soon as that user is done, in completion order.
+        The result is a dict with the created 'User', the names of the 'Groups' they
+        were added to and the 'AccessKey' as an (access key, secret key) tuple or None.
+        """
+        specs = (_to_user_spec(spec) for spec in specs)
+
+        for spec, future in self._imap_unordered(self._create_user_from_spec, specs):
+            yield _to_user_result(spec.username, future)
+
+    @_instrumented_iterator
+    def delete_users(self, usernames, journal=None):
+        """
+        Deletes the given users as delete_user does, with at most max_workers users
+        being worked on at once. Yields a UserResult per user as soon as that user
+        is done, in completion order.
+
+        With a krux_iam.journal.Journal, each step (listing a user's groups and keys,
+        each removal and deletion) is recorded as it completes, and a run restarted
+        with the same journal skips the recorded steps without calling AWS. Progress
+        is reported to stats as journal.done (users done so far) and journal.rate
+        (users per second).
+        """
+        if journal is None:
+            for username, future in self._imap_unordered(self._delete_user_sequentially, usernames):
+                yield _to_user_result(username, future)
+            return
+
+        delete = functools.partial(self._delete_user_journaled, journal)
+        start = time.time()
+        done = 0
+
+        try:
+            for username, future in self._imap_unordered(delete, usernames):
+                done += 1
+                self._stats.gauge('journal.done', done)
+                self._stats.gauge('journal.rate', done / max(time.time() - start, 1e-6))
+                yield _to_user_result(username, future)
+        finally:
+            journal.flush()
+
+    @_instrumented
     def delete_user(self, username):
         """
         Deletes user and removes user from any groups they belong to and deletes
-        all their access keys.
+        all their access keys. The group removals and key deletions are run
+        concurrently; if any of them fails, a BatchError listing every failure is
+        raised and the user itself is not deleted.
         """
-        for group in self.get_groups(username):
-            self.delete_user_from_group(username, group['GroupName'])
+        self._delete_user(username, max_workers=self._max_workers)
+
+    def _delete_user_sequentially(self, username):
+        # Used by delete_users, whose pool already bounds the number of calls in flight
+        self._delete_user(username, max_workers=1)
 
-        for key in self.get_access_keys(username):
-            self.delete_access_key(username, key['AccessKeyId'])
+    def _delete_user(self, username, max_workers):
+        # The dependents must be listed fresh; a stale cached listing would make delete_user fail
+        self._invalidate_user(username)
 
-        self._client.delete_user(
+        calls = [
+            (self.delete_user_from_group, (username, group['GroupName']))
+            for group in self.get_groups(username)
+        ]
+        calls.extend(
+            (self.delete_access_key, (username, key['AccessKeyId']))
+            for key in self.get_access_keys(username)
+        )
+        self._run_concurrently(calls, 'Failed to clean up user {0}'.format(username), max_workers=max_workers)
+        self._delete_user_entity(username)
+
+    def _delete_user_entity(self, username):
+        # Deletes the user alone, once they have no groups and keys left
+        self._call(
+            'delete_user',
             UserName=username
         )
+        self._invalidate_user(username)
+        self._remember_missing(username)
+
+    def _delete_user_journaled(self, journal, username):
+        """
+        Deletes the user one step at a time, recording each step in the journal and
+        skipping the steps it already holds. The groups and keys to remove are listed
+        once and recorded as the user's plan.
+        """
+        if ('delete_user', username) in journal:
+            self._stats.incr('journal.skipped.delete_user')
+            return
+
+        plan = journal.get(('plan', username))
+        if plan is None:
+            self._invalidate_user(username)
+            try:
+                plan = {
+                    'groups': [group['GroupName'] for group in self.get_groups(username)],
+                    'access_keys': [key['AccessKeyId'] for key in self.get_access_keys(username)],
+                }
+            except ClientError as error:
+                if not is_not_found_error(error):
+                    raise
+
+                # Deleted by a run which crashed before its plan and deletion were flushed
+                journal.record(('delete_user', username))
+                self._stats.incr('journal.recorded.delete_user')
+                return
+            journal.record(('plan', username), plan)
+
+        for group_name in plan['groups']:
+            self._journaled(journal, self.delete_user_from_group, username, group_name)
+        for key_id in plan['access_keys']:
+            self._journaled(journal, self.delete_access_key, username, key_id)
+        self._journaled(journal, self._delete_user_entity, username, name='delete_user')
 
-    def get_user(self, username):
+    def _journaled(self, journal, func, *args, **kwargs):
         """
-        Gets the given user and upon failure returns None. Otherwise returns
-        a dict of the user's attributes.
+        Calls func with the given arguments unless the journal holds the step, then
+        records it. An entity found gone counts as done, as the call may have been
+        made by a run which crashed before recording it.
         """
+        name = kwargs.get('name', func.__name__)
+        step = (name,) + args
+        if step in journal:
+            self._stats.incr('journal.skipped.{0}'.format(name))
+            return
+
         try:
-            response = self._client.get_user(
+            func(*args)
+        except ClientError as error:
+            if not is_not_found_error(error):
+                raise
+
+        journal.record(step)
+        self._stats.incr('journal.recorded.{0}'.format(name))
+
+    @_instrumented_iterator
+    def iter_users(self, page_size=None, compact=False):
+        """
+        Lazily yields every user of the account as a dict of their attributes, or
+        as a User record with compact, following the pagination markers one page
+        at a time.
+        """
+        users = self._paginate(
+            'list_users',
+            'Users',
+            page_size=page_size
+        )
+
+        return _compacted(users, User) if compact else users
+
+    @_instrumented
+    def get_user(self, username, snapshot=None):
+        """
+        Gets the given user and returns None if the user doesn't exist. Otherwise
+        returns a dict of the user's attributes. Any other error, e.g. throttling
+        that persists through the retries, is raised. If a Snapshot is given, the
+        user is read from it instead.
+        """
+        if snapshot is not None:
+            return snapshot.get_user(username)
+
+        if self._negative_cache is not None and self._negative_cache.get(username, False):
+            self._stats.incr('cache.hit.missing_user')
+            return None
+
+        generation = self._get_generation(('user', username))
+        return self._cached(('user', username), lambda: self._get_user(username, generation))
+
+    def _get_user(self, username, generation=None):
+        try:
+            response = self._call(
+                'get_user',
                 UserName=username
             )
             return response['User']
-        except botocore.exceptions.ClientError:
+        except ClientError as error:
+            if not is_not_found_error(error):
+                raise
+
+            self._remember_missing(username, generation)
             return None
 
+    def _remember_missing(self, username, generation=None):
+        """
+        Remembers that the user does not exist, unless the given generation of the user,
+        that read before looking them up, was outdated by a write since.
+        """
+        if self._negative_cache is not None:
+            with self._generations_lock:
+                if generation is None or self._generations.get(('user', username), 0) == generation:
+                    self._negative_cache.set(username, True)
+
+    @_instrumented
     def add_user_to_group(self, username, group):
         """
         Adds given user to the given group. Throws a botocore.exceptions.ClientError
         exception if the given group doesn't exist.
         """
-        self._client.add_user_to_group(
+        self._call(
+            'add_user_to_group',
             GroupName=group,
             UserName=username
         )
+        self._invalidate(('groups', username))
+        self._update_group_members(group, username, is_member=True)
 
+    @_instrumented
     def delete_user_from_group(self, username, group_name):
         """
         Deletes the user from the given group.
         """
-        self._client.remove_user_from_group(
+        self._call(
+            'remove_user_from_group',
             GroupName=group_name,
             UserName=username
         )
+        self._invalidate(('groups', username))
+        self._update_group_members(group_name, username, is_member=False)
 
-    def get_groups(self, username):
+    @_instrumented_iterator
+    def map_users(self, func, usernames):
         """
-        Gets all the groups the current user belongs to.
-        Returns a list of dicts representing each group.
+        Calls func(username) for each of the given users, with at most max_workers
+        calls in flight at once. Yields a UserResult per user, holding what func
+        returned or raised, as soon as that user is done, in completion order.
+        """
+        for username, future in self._imap_unordered(func, usernames):
+            yield _to_user_result(username, future)
+
+    @_instrumented_iterator
+    def add_users_to_group(self, group_name, usernames):
+        """
+        Adds the given users to the given group, with at most max_workers calls in
+        flight at once. Yields a UserResult per user as soon as that user is done,
+        in completion order.
+        """
+        add = functools.partial(_add_user_to_group, self, group_name)
+
+        for username, future in self._imap_unordered(add, usernames):
+            yield _to_user_result(username, future)
+
+    @_instrumented_iterator
+    def remove_users_from_group(self, group_name, usernames):
+        """
+        Removes the given users from the given group, with at most max_workers calls
+        in flight at once. Yields a UserResult per user as soon as that user is done,
+        in completion order.
+        """
+        remove = functools.partial(_remove_user_from_group, self, group_name)
+
+        for username, future in self._imap_unordered(remove, usernames):
+            yield _to_user_result(username, future)
+
+    @_instrumented_iterator
+    def iter_group_members(self, group_name, page_size=None, compact=False):
+        """
+        Lazily yields the users in the given group as dicts of their attributes, or
+        as User records with compact, following the pagination markers of get_group
+        one page at a time.
+        """
+        users = self._paginate(
+            'get_group',
+            'Users',
+            page_size=page_size,
+            GroupName=group_name
+        )
+
+        return _compacted(users, User) if compact else users
+
+    @_instrumented
+    def get_group_members(self, group_name, page_size=None, snapshot=None):
         """
-        response = self._client.list_groups_for_user(
+        Returns a list of the names of the users in the given group. The list is cached
+        as a group to members index, which the membership changes made through this
+        object keep up to date. If a Snapshot is given, the members are read from it instead.
+        """
+        if snapshot is not None:
+            return snapshot.get_group_members(group_name)
+
+        members = self._cached(
+            ('group_members', group_name),
+            lambda: [user['UserName'] for user in self.iter_group_members(group_name, page_size=page_size)]
+        )
+
+        return list(members)
+
+    @_instrumented_iterator
+    def iter_groups(self, username, page_size=None, compact=False):
+        """
+        Lazily yields the groups the given user belongs to as dicts, or as Group
+        records with compact, following the pagination markers one page at a time.
+        """
+        groups = self._paginate(
+            'list_groups_for_user',
+            'Groups',
+            page_size=page_size,
             UserName=username
         )
 
-        return response['Groups']
+        return _compacted(groups, Group) if compact else groups
+
+    @_instrumented
+    def get_groups(self, username, page_size=None, snapshot=None, compact=False):
+        """
+        Gets all the groups the current user belongs to.
+        Returns a list of dicts representing each group, or of Group records with compact.
+        If a Snapshot is given, the groups are read from it instead.
+        """
+        if snapshot is not None:
+            groups = snapshot.get_groups(username)
+        else:
+            groups = self._cached(
+                ('groups', username),
+                lambda: list(self.iter_groups(username, page_size=page_size))
+            )
+
+        return list(_compacted(groups, Group) if compact else groups)
+
+    @_instrumented
+    def attach_user_policy(self, username, policy_arn):
+        """
+        Attaches the given managed policy to the user.
+        """
+        self._call(
+            'attach_user_policy',
+            UserName=username,
+            PolicyArn=policy_arn
+        )
+        self._invalidate(('attached_user_policies', username))
+
+    @_instrumented
+    def detach_user_policy(self, username, policy_arn):
+        """
+        Detaches the given managed policy from the user.
+        """
+        self._call(
+            'detach_user_policy',
+            UserName=username,
+            PolicyArn=policy_arn
+        )
+        self._invalidate(('attached_user_policies', username))
+
+    @_instrumented
+    def get_attached_user_policies(self, username, page_size=None):
+        """
+        Returns a list of dicts, with PolicyName and PolicyArn, of the managed policies
+        attached to the given user.
+        """
+        policies = self._cached(
+            ('attached_user_policies', username),
+            lambda: list(self._paginate(
+                'list_attached_user_policies', 'AttachedPolicies', page_size=page_size, UserName=username
+            ))
+        )
+
+        return list(policies)
+
+    @_instrumented
+    def put_user_policy(self, username, policy_name, document):
+        """
+        Adds or replaces the inline policy of the given name of the user. The document
+        may be given as a dict or as a JSON string.
+        """
+        self._call(
+            'put_user_policy',
+            UserName=username,
+            PolicyName=policy_name,
+            PolicyDocument=_to_json(document)
+        )
+        self._invalidate(('user_policies', username))
+
+    @_instrumented
+    def delete_user_policy(self, username, policy_name):
+        """
+        Deletes the inline policy of the given name of the user.
+        """
+        self._call(
+            'delete_user_policy',
+            UserName=username,
+            PolicyName=policy_name
+        )
+        self._invalidate(('user_policies', username))
+
+    @_instrumented
+    def get_user_policies(self, username, page_size=None):
+        """
+        Returns a dict of the inline policies of the given user, their documents as
+        dicts by policy name.
+        """
+        policies = self._cached(
+            ('user_policies', username),
+            lambda: self._get_inline_policies('user', 'UserName', username, page_size)
+        )
+
+        return dict(policies)
+
+    @_instrumented
+    def attach_group_policy(self, group_name, policy_arn):
+        """
+        Attaches the given managed policy to the group.
+        """
+        self._call(
+            'attach_group_policy',
+            GroupName=group_name,
+            PolicyArn=policy_arn
+        )
+        self._invalidate(('attached_group_policies', group_name))
+
+    @_instrumented
+    def detach_group_policy(self, group_name, policy_arn):
+        """
+        Detaches the given managed policy from the group.
+        """
+        self._call(
+            'detach_group_policy',
+            GroupName=group_name,
+            PolicyArn=policy_arn
+        )
+        self._invalidate(('attached_group_policies', group_name))
+
+    @_instrumented
+    def get_attached_group_policies(self, group_name, page_size=None):
+        """
+        Returns a list of dicts, with PolicyName and PolicyArn, of the managed policies
+        attached to the given group.
+        """
+        policies = self._cached(
+            ('attached_group_policies', group_name),
+            lambda: list(self._paginate(
+                'list_attached_group_policies', 'AttachedPolicies', page_size=page_size, GroupName=group_name
+            ))
+        )
+
+        return list(policies)
+
+    @_instrumented
+    def put_group_policy(self, group_name, policy_name, document):
+        """
+        Adds or replaces the inline policy of the given name of the group. The document
+        may be given as a dict or as a JSON string.
+        """
+        self._call(
+            'put_group_policy',
+            GroupName=group_name,
+            PolicyName=policy_name,
+            PolicyDocument=_to_json(document)
+        )
+        self._invalidate(('group_policies', group_name))
+
+    @_instrumented
+    def get_group_policies(self, group_name, page_size=None):
+        """
+        Returns a dict of the inline policies of the given group, their documents as
+        dicts by policy name.
+        """
+        policies = self._cached(
+            ('group_policies', group_name),
+            lambda: self._get_inline_policies('group', 'GroupName', group_name, page_size)
+        )
+
+        return dict(policies)
+
+    @_instrumented
+    def get_policy_document(self, policy_arn, version_id=None):
+        """
+        Returns the document, as a dict, of the given version of the managed policy,
+        or of its default version. Policy versions are immutable, so their documents
+        are kept in the PolicyCache for the life of this object and fetched only once;
+        the default version of a policy is cached like any other lookup.
+        """
+        return self._policy_cache.get(self._get_policy_digest(policy_arn, version_id))
+
+    @_instrumented_iterator
+    def evaluate_permissions(self, usernames=None, page_size=None):
+        """
+        Yields a UserResult per user holding the effective Permissions of the given
+        users, or of every user of the account, granted by their own and their groups'
+        policies. See PolicyEvaluator.
+        """
+        return PolicyEvaluator(self).evaluate(usernames, page_size=page_size)
+
+    def _get_policy_digest(self, policy_arn, version_id=None):
+        """
+        Returns the digest, in the PolicyCache, of the document of the given version of
+        the managed policy, or of its default version, fetching it if need be.
+        """
+        if version_id is None:
+            version_id = self._cached(
+                ('default_policy_version', policy_arn),
+                lambda: self._call('get_policy', PolicyArn=policy_arn)['Policy']['DefaultVersionId']
+            )
+
+        key = self._policy_cache.get_version(policy_arn, version_id)
+        if key is not None:
+            self._stats.incr('cache.hit.policy_version')
+            return key
+
+        self._stats.incr('cache.miss.policy_version')
+        document, _ = self._flights.do(
+            ('policy_version', policy_arn, version_id),
+            lambda: self._call(
+                'get_policy_version', PolicyArn=policy_arn, VersionId=version_id
+            )['PolicyVersion']['Document']
+        )
+        return self._policy_cache.set_version(policy_arn, version_id, document)
+
+    def _get_inline_policies(self, kind, name_key, name, page_size):
+        # One list call per page of names, then one get call per policy
+        names = list(self._paginate(
+            'list_{0}_policies'.format(kind), 'PolicyNames', page_size=page_size, **{name_key: name}
+        ))
+
+        return dict(
+            (policy_name, self._call(
+                'get_{0}_policy'.format(kind), PolicyName=policy_name, **{name_key: name}
+            )['PolicyDocument'])
+            for policy_name in names
+        )
+
+    @_instrumented
+    def snapshot(self, include_access_keys=False, page_size=None):
+        """
+        Returns a Snapshot of all users, groups and group memberships of the account,
+        fetched with paginated get_account_authorization_details calls rather than
+        per user lookups. Access keys are not part of the authorization details, so
+        include_access_keys costs one list_access_keys call per user, max_workers at a
+        time; the first of those calls to fail is raised.
+        """
+        details = self._paginate(
+            'get_account_authorization_details',
+            ('UserDetailList', 'GroupDetailList'),
+            page_size=page_size,
+            Filter=['User', 'Group']
+        )
+        snapshot = Snapshot.from_authorization_details(details)
+
+        if include_access_keys:
+            def list_keys(username):
+                return self.get_access_keys(username, page_size=page_size)
+
+            snapshot.access_keys = dict(
+                (username, future.result()) for username, future in self._imap_unordered(list_keys, snapshot.users)
+            )
+
+        return snapshot
+
+    @_instrumented_iterator
+    def watch(self, interval=DEFAULT_WATCH_INTERVAL, include_access_keys=False, page_size=None, initial=False):
+        """
+        Polls the account every interval seconds and yields a Change for every user or
+        group added or removed, group membership changed and, with include_access_keys,
+        access key created, deleted or (de)activated since the previous poll. Runs until
+        the caller stops iterating. See Watcher for what a poll costs.
+
+        A poll which fails, e.g. on throttling outlasting the retries, is logged and
+        counted under method.watch.poll.error.<code>; the changes it would have seen
+        are reported by the next poll which succeeds.
+        """
+        watcher = Watcher(self, include_access_keys=include_access_keys, page_size=page_size, initial=initial)
+
+        while True:
+            start = time.time()
+            try:
+                with self._measure('method.watch.poll'):
+                    changes = watcher.poll()
+            except Exception as error:
+                self._logger.warning('Failed to poll the account for changes: %s', error)
+                changes = []
+
+            for change in changes:
+                yield change
+
+            time.sleep(max(0, start + interval - time.time()))
+
+    def _cached(self, key, fetch):
+        """
+        Returns the value cached under key, or calls fetch and caches its result.
+        A None result (e.g. a user that does not exist) is not cached. Concurrent
+        fetches of the same key, cached or not, are made once and shared.
+
+        A result is only cached if no write invalidated the key while it was being
+        fetched, as it may predate the write; it is still returned.
+        """
+        generation = self._get_generation(key)
+        if self._cache is not None:
+            value = self._cache.get(key, _MISSING)
+            if value is not _MISSING:
+                self._stats.incr('cache.hit.{0}'.format(key[0]))
+                return value
+
+            self._stats.incr('cache.miss.{0}'.format(key[0]))
+
+        value, shared = self._flights.do(key, fetch)
+        if shared:
+            self._stats.incr('singleflight.shared.{0}'.format(key[0]))
+        elif value is not None and self._cache is not None:
+            with self._generations_lock:
+                current = self._generations.get(key, 0) == generation
+                if current:
+                    self._cache.set(key, value)
+            if not current:
+                self._stats.incr('cache.outdated.{0}'.format(key[0]))
+        return value
+
+    def _get_generation(self, key):
+        with self._generations_lock:
+            return self._generations.get(key, 0)
+
+    def _outdate(self, key):
+        """
+        Marks what a fetch of the key in flight reads as outdated, see _cached, and
+        detaches it so that the reads made after the write do not share it.
+        """
+        with self._generations_lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+        self._flights.forget(key)
+
+    def _invalidate(self, *keys):
+        for key in keys:
+            self._outdate(key)
+            if self._cache is not None:
+                self._cache.invalidate(key)
+
+    def _update_group_members(self, group_name, username, is_member):
+        """
+        Adds the user to, or removes them from, the cached members of the group, if cached.
+        """
+        key = ('group_members', group_name)
+        self._outdate(key)
+        if self._cache is None:
+            return
+
+        with self._members_lock:
+            members = self._cache.get(key, _MISSING)
+            if members is _MISSING:
+                return
+
+            members = [name for name in members if name != username]
+            if is_member:
+                members.append(username)
+            self._cache.set(key, members)
+
+    def _invalidate_user(self, username):
+        self._invalidate(
+            ('user', username),
+            ('groups', username),
+            ('access_keys', username),
+            ('attached_user_policies', username),
+            ('user_policies', username),
+        )
+
+    def _create_user_from_spec(self, spec):
+        # Runs as a single worker of create_users, so the calls are made one after the other
+        user = self.create_user(spec.username)
+
+        for group in spec.groups:
+            self.add_user_to_group(spec.username, group)
+
+        access_key = self.create_access_keys(spec.username) if spec.create_access_key else None
+
+        return {'User': user, 'Groups': list(spec.groups), 'AccessKey': access_key}
+
+    def _run_concurrently(self, calls, message, max_workers=None):
+        """
+        Runs the given (function, args) pairs on a pool of at most max_workers threads
+        (defaulting to that of the instance) and waits for all of them to finish.
+        Returns the results in the order of calls, or raises a BatchError with the
+        given message holding every exception raised.
+        """
+        if not calls:
+            return []
+
+        max_workers = min(max_workers or self._max_workers, len(calls))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(func, *args) for func, args in calls]
+
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise BatchError(message, errors)
+
+        return [future.result() for future in futures]
+
+    def _imap_unordered(self, func, items):
+        """
+        Calls func on each of the given items on a pool of max_workers threads, taking
+        items from the iterable only as workers free up, and yields (item, future) pairs
+        as the calls complete. Stopping the iteration early cancels the calls which have
+        not started yet.
+        """
+        executor = ThreadPoolExecutor(max_workers=self._max_workers)
+        pending = {}
+
+        try:
+            for item in items:
+                if len(pending) >= self._max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield pending.pop(future), future
+
+                pending[executor.submit(func, item)] = item
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _call(self, operation, **kwargs):
+        """
+        Calls the given operation of the client, first taking a token from the rate
+        limiter. Throttling and transient errors are retried up to max_retries times
+        with decorrelated jitter backoff; any other error, or the last one, is raised.
+        Retry counts and the time spent backing off are reported to stats.
+        The clients IAM creates have botocore's own retries turned off, so that every
+        request is paced; a client or client_factory passed in should do the same.
+        """
+        delays = self._backoff.delays()
+        retries = 0
+
+        while True:
+            self._rate_limiter.acquire()
+
+            try:
+                with self._measure('client.{0}'.format(operation)):
+                    response = getattr(self._client, operation)(**kwargs)
+            except (ClientError, BotoCoreError) as error:
+                if retries >= self._max_retries or not is_retryable_error(error):
+                    raise
+
+                if is_throttling_error(error):
+                    self._rate_limiter.on_throttle()
+
+                retries += 1
+                delay = next(delays)
+                self._stats.incr('retry.{0}'.format(operation))
+                self._stats.timing('retry_sleep.{0}'.format(operation), delay * 1000)
+                self._logger.debug(
+                    'Retrying %s in %.2fs after %s (attempt %d of %d)',
+                    operation, delay, get_error_code(error) or type(error).__name__, retries, self._max_retries
+                )
+                time.sleep(delay)
+            else:
+                self._rate_limiter.on_success()
+                return response
+
+    @contextmanager
+    def _measure(self, stat):
+        """
+        Times and counts the enclosed block under the given stat name, counting an
+        exception under <stat>.error.<code> before letting it through.
+        """
+        start = time.time()
+        try:
+            yield
+        except Exception as error:
+            self._stats.incr('{0}.error.{1}'.format(stat, get_error_code(error) or type(error).__name__))
+            raise
+        finally:
+            elapsed = (time.time() - start) * 1000
+            self._stats.incr('{0}.calls'.format(stat))
+            self._stats.timing(stat, elapsed)
+            if self._log_latency:
+                self._logger.debug('%s took %.1fms', stat, elapsed)
+
+    def _iter_pages(self, operation, page_size=None, **kwargs):
+        """
+        Calls the given client operation repeatedly, passing along the Marker of the
+        previous response while it is truncated, and yields each response.
+        Pages are only requested as the caller consumes them.
+        """
+        if page_size:
+            kwargs['MaxItems'] = page_size
+
+        while True:
+            response = self._call(operation, **kwargs)
+            self._stats.incr('pages.{0}'.format(operation))
+
+            yield response
+
+            if not response.get('IsTruncated'):
+                break
+
+            kwargs['Marker'] = response['Marker']
+
+    def _paginate(self, operation, result_key, page_size=None, **kwargs):
+        """
+        Yields each item under result_key of every page of the given client operation.
+        result_key may also be a tuple of keys, in which case the items under each of
+        them are yielded in turn.
+        """
+        result_keys = result_key if isinstance(result_key, tuple) else (result_key,)
+
+        for response in self._iter_pages(operation, page_size=page_size, **kwargs):
+            for key in result_keys:
+                for item in response.get(key, []):
+                    yield item
+
+
+def _create_client(boto):
+    from botocore.config import Config
+
+    return boto.client(IAM._IAM_STR, config=Config(retries=NO_BOTOCORE_RETRIES))
+
+
+def _to_json(document):
+    return json.dumps(document) if isinstance(document, dict) else document
+
+
+def _compacted(items, record_type):
+    return (record_type.from_dict(item) for item in items)
+
+
+def _add_user_to_group(iam, group_name, username):
+    iam.add_user_to_group(username, group_name)
+
+
+def _remove_user_from_group(iam, group_name, username):
+    iam.delete_user_from_group(username, group_name)
+
+
+def _to_user_spec(spec):
+    if isinstance(spec, UserSpec):
+        return spec
+    if isinstance(spec, dict):
+        return UserSpec(**spec)
+    if isinstance(spec, (tuple, list)):
+        return UserSpec(*spec)
+    return UserSpec(spec)
+
+
+def _to_user_result(username, future):
+    error = future.exception()
+    if error is not None:
+        return UserResult(username, None, error)
+    return UserResult(username, future.result(), None)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import threading
+import time
+
+
+# Number of steps recorded before the journal is written out and synced to disk
+DEFAULT_FLUSH_EVERY = 100
+
+
+class Journal(object):
+    """
+    An append-only log of the completed steps of a bulk job, such as IAM.delete_users,
+    kept in a local file of one JSON object per line. A job restarted with the same
+    journal skips the steps recorded in it, and reuses their results, without asking
+    AWS again.
+
+    A step is a tuple of strings naming an operation and what it applies to, e.g.
+    ('delete_access_key', username, key_id). Records are written out in batches of
+    flush_every; steps done after the last flush of a crashed job are done again on
+    restart, so the jobs using a journal treat an entity already gone as done.
+    """
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY):
+        self._path = path
+        self._flush_every = flush_every
+        self._lock = threading.Lock()
+        self._results = {}
+        self._pending = []
+
+        if os.path.exists(path):
+            with open(path) as lines:
+                self._replay(lines)
+
+        self._file = open(path, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
+
+    def __contains__(self, step):
+        with self._lock:
+            return tuple(step) in self._results
+
+    def get(self, step, default=None):
+        """
+        Returns the result recorded for the given step, or default if it is not done.
+        """
+        with self._lock:
+            return self._results.get(tuple(step), default)
+
+    def record(self, step, result=None):
+        """
+        Records the given step as done, with its result, which must be JSON serializable.
+        """
+        line = json.dumps({'step': list(step), 'result': result, 'time': time.time()}, sort_keys=True)
+
+        with self._lock:
+            self._results[tuple(step)] = result
+            self._pending.append(line)
+            if len(self._pending) >= self._flush_every:
+                self._flush()
+
+    def flush(self):
+        """
+        Writes the pending records out and syncs them to disk.
+        """
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        self._file.write(''.join(line + '\n' for line in self._pending))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = []
+
+    def _replay(self, lines):
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line of a journal whose job crashed while writing it
+                continue
+            self._results[tuple(record['step'])] = record['result']
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import defaultdict, namedtuple
+import calendar
+import time
+
+
+# IAM allows no more than this many access keys per user
+MAX_KEYS_PER_USER = 2
+
+ACTIVE = 'Active'
+INACTIVE = 'Inactive'
+
+# An access key as kept by KeyIndex; create_date and last_used are epoch seconds,
+# last_used being None when unknown or never used.
+KeyInfo = namedtuple('KeyInfo', ['username', 'access_key_id', 'status', 'create_date', 'last_used'])
+
+# The outcome of rotating the keys of one user with IAM.rotate_keys. new_access_key_id
+# is None if the user was skipped or failed, in which case error says why.
+RotationResult = namedtuple('RotationResult', ['username', 'new_access_key_id', 'old_access_key_ids', 'error'])
+
+
+def to_epoch(value):
+    """
+    Converts a datetime as returned by botocore (timezone aware, or naive UTC) to
+    integer epoch seconds. None is passed through.
+    """
+    if value is None:
+        return None
+    return calendar.timegm(value.utctimetuple())
+
+
+def to_key_info(username, key, last_used=None):
+    """
+    Returns the KeyInfo of the given key of the user, a dict as listed by list_access_keys.
+    """
+    return KeyInfo(
+        username=username,
+        access_key_id=key['AccessKeyId'],
+        status=key.get('Status', ACTIVE),
+        create_date=to_epoch(key.get('CreateDate')),
+        last_used=last_used,
+    )
+
+
+class KeyIndex(object):
+    """
+    An index of the access keys of many users by user and by age, used to plan
+    bulk key rotation without looking keys up again.
+    """
+
+    def __init__(self, keys=()):
+        self._keys = {}
+        self._by_user = defaultdict(list)
+
+        for key in keys:
+            self.add(key)
+
+    @classmethod
+    def from_listings(cls, iam, usernames=None, include_last_used=False, report=None):
+        """
+        Builds the index with paginated listings: the given users, or every user of the
+        account, and their access keys, listed concurrently. With include_last_used,
+        get_access_key_last_used is called for every key as well. If a CredentialReport
+        is given, the last use of each key is read from it instead, matching the keys
+        by their creation time as the report carries no key ids.
+        """
+        if usernames is None:
+            usernames = (user['UserName'] for user in iam.iter_users())
+
+        index = cls()
+        for username, future in iam._imap_unordered(iam.get_access_keys, usernames):
+            entry = report.get(username) if report is not None else None
+            # Keys created in the same second are told apart by their order, that of their slots
+            report_keys = list(entry.access_keys) if entry is not None else []
+
+            for key in future.result():
+                create_date = to_epoch(key.get('CreateDate'))
+                report_key = next((candidate for candidate in report_keys if candidate.last_rotated == create_date), None)
+                if report_key is not None:
+                    report_keys.remove(report_key)
+                index.add(to_key_info(username, key, last_used=report_key.last_used if report_key is not None else None))
+
+        if include_last_used and report is None:
+            key_ids = list(index._keys)
+            for key_id, future in iam._imap_unordered(iam.get_access_key_last_used, key_ids):
+                last_used = to_epoch(future.result().get('LastUsedDate'))
+                index._keys[key_id] = index._keys[key_id]._replace(last_used=last_used)
+
+        return index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys.values())
+
+    def add(self, key):
+        """
+        Adds or replaces the given KeyInfo.
+        """
+        if key.access_key_id not in self._keys:
+            self._by_user[key.username].append(key.access_key_id)
+        self._keys[key.access_key_id] = key
+
+    def remove(self, access_key_id):
+        """
+        Removes the key with the given id, if indexed.
+        """
+        key = self._keys.pop(access_key_id, None)
+        if key is not None:
+            self._by_user[key.username].remove(access_key_id)
+
+    def get(self, access_key_id):
+        """
+        Returns the KeyInfo of the given key id, or None.
+        """
+        return self._keys.get(access_key_id)
+
+    def usernames(self):
+        """
+        Returns the names of the users with at least one indexed key.
+        """
+        return [username for username, key_ids in self._by_user.items() if key_ids]
+
+    def keys_for(self, username):
+        """
+        Returns the KeyInfos of the given user, oldest first.
+        """
+        return sorted((self._keys[key_id] for key_id in self._by_user.get(username, [])), key=_age_key)
+
+    def older_than(self, max_age, now=None, status=ACTIVE):
+        """
+        Returns the keys with the given status (any, if None) created more than max_age
+        seconds ago, oldest first.
+        """
+        cutoff = (now if now is not None else time.time()) - max_age
+
+        return sorted(
+            (
+                key for key in self._keys.values()
+                if key.create_date is not None and key.create_date < cutoff and (status is None or key.status == status)
+            ),
+            key=_age_key,
+        )
+
+    def unused_since(self, max_idle, now=None):
+        """
+        Returns the active keys which have not been used for max_idle seconds, or
+        were never used and are older than that, oldest first.
+        """
+        cutoff = (now if now is not None else time.time()) - max_idle
+
+        return sorted(
+            (
+                key for key in self._keys.values()
+                if key.status == ACTIVE and (key.last_used or key.create_date or cutoff) < cutoff
+            ),
+            key=_age_key,
+        )
+
+
+def _age_key(key):
+    return key.create_date or 0
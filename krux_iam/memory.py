@@ -0,0 +1,682 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from bisect import bisect_left, insort
+from collections import Counter
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+from botocore.exceptions import ClientError
+from dateutil.tz import tzutc
+
+#
+# Internal libraries
+#
+
+from krux_iam.keys import ACTIVE, MAX_KEYS_PER_USER
+
+
+ACCOUNT_ID = '123456789012'
+
+# Page size IAM uses when MaxItems is not given
+DEFAULT_MAX_ITEMS = 100
+
+# Age after which IAM generates a new credential report rather than reusing the last one
+_REPORT_MAX_AGE = datetime.timedelta(hours=4)
+
+
+class MemoryBackend(object):
+    """
+    An in-process stand-in for the botocore IAM client, which IAM can be built with
+    in its place (IAM(boto=None, client=MemoryBackend())). It keeps users, groups,
+    memberships and access keys in memory and answers with the same response shapes,
+    pagination markers and error codes as IAM, so tests and benchmarks run offline
+    against realistic behavior.
+
+    latency is the number of seconds every call takes. throttle_rate is the share of
+    calls, between 0 and 1, that fail with a Throttling error instead. calls counts
+    the calls made per operation.
+    """
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, seed=None, clock=None):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+
+        self._random = random.Random(seed)
+        self._clock = clock or (lambda: datetime.datetime.now(tzutc()))
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+        self._users = {}
+        self._user_names = []
+        self._groups = {}
+        self._group_names = []
+        # username -> sorted group names, group name -> sorted usernames
+        self._user_groups = {}
+        self._group_users = {}
+        # username -> list of key dicts in creation order, key id -> secret, owner and last use
+        self._user_keys = {}
+        self._key_details = {}
+        # Managed policies by ARN with their documents by version id, and the sorted ARNs
+        # attached to and the inline documents by policy name of each user and group
+        self._policies = {}
+        self._policy_versions = {}
+        self._attached = {'user': {}, 'group': {}}
+        self._inline = {'user': {}, 'group': {}}
+        self._created = self._clock()
+        # The CSV content and generation time of the credential report, and whether it is ready
+        self._report = None
+        self._report_ready = False
+
+    #
+    # Helpers to set up state without going through the API
+    #
+
+    def populate(self, users=0, groups=0, groups_per_user=0, keys_per_user=0, prefix='user'):
+        """
+        Quickly adds the given number of users and groups, puts each user in
+        groups_per_user groups and gives them keys_per_user access keys. Suited to
+        building accounts of 100k users for benchmarks. Returns the usernames added.
+        """
+        keys_per_user = min(keys_per_user, MAX_KEYS_PER_USER)
+
+        with self._lock:
+            group_names = ['group{0:05d}'.format(i) for i in range(groups)]
+            for name in group_names:
+                if name not in self._groups:
+                    self._add_group(name, sort=False)
+            self._group_names.sort()
+
+            usernames = ['{0}{1:07d}'.format(prefix, i) for i in range(users)]
+            for i, username in enumerate(usernames):
+                if username in self._users:
+                    continue
+                self._add_user(username, sort=False)
+                for j in range(min(groups_per_user, len(group_names))):
+                    group_name = group_names[(i + j) % len(group_names)]
+                    self._user_groups[username].append(group_name)
+                    self._group_users[group_name].append(username)
+                for _ in range(keys_per_user):
+                    self._add_key(username)
+
+            self._user_names.sort()
+            for names in itertools.chain(self._user_groups.values(), self._group_users.values()):
+                names.sort()
+
+        return usernames
+
+    def record_key_use(self, key_id, when=None, service_name='iam', region='us-east-1'):
+        """
+        Marks the given access key as used, by default now.
+        """
+        with self._lock:
+            self._key_details[key_id]['LastUsed'].update({
+                'LastUsedDate': when or self._clock(),
+                'ServiceName': service_name,
+                'Region': region,
+            })
+
+    #
+    # Users
+    #
+
+    def create_user(self, UserName, Path='/'):
+        with self._request('create_user'):
+            if UserName in self._users:
+                raise _error('EntityAlreadyExists', 'User with name {0} already exists.'.format(UserName), 409, 'CreateUser')
+            return {'User': dict(self._add_user(UserName, path=Path))}
+
+    def get_user(self, UserName):
+        with self._request('get_user'):
+            return {'User': dict(self._get_user(UserName, 'GetUser'))}
+
+    def delete_user(self, UserName):
+        with self._request('delete_user'):
+            self._get_user(UserName, 'DeleteUser')
+            if self._user_groups[UserName] or self._user_keys[UserName]:
+                raise _error('DeleteConflict', 'Cannot delete entity, must remove dependents first.', 409, 'DeleteUser')
+
+            del self._users[UserName]
+            del self._user_groups[UserName]
+            del self._user_keys[UserName]
+            self._attached['user'].pop(UserName, None)
+            self._inline['user'].pop(UserName, None)
+            _remove_sorted(self._user_names, UserName)
+            return {}
+
+    def list_users(self, Marker=None, MaxItems=DEFAULT_MAX_ITEMS, PathPrefix='/'):
+        with self._request('list_users'):
+            names, response = _page(self._user_names, Marker, MaxItems)
+            response['Users'] = [dict(self._users[name]) for name in names]
+            return response
+
+    #
+    # Groups
+    #
+
+    def create_group(self, GroupName, Path='/'):
+        with self._request('create_group'):
+            if GroupName in self._groups:
+                raise _error('EntityAlreadyExists', 'Group with name {0} already exists.'.format(GroupName), 409, 'CreateGroup')
+            return {'Group': dict(self._add_group(GroupName, path=Path))}
+
+    def get_group(self, GroupName, Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('get_group'):
+            group = self._get_group(GroupName, 'GetGroup')
+            names, response = _page(self._group_users[GroupName], Marker, MaxItems)
+            response['Group'] = dict(group)
+            response['Users'] = [dict(self._users[name]) for name in names]
+            return response
+
+    def delete_group(self, GroupName):
+        with self._request('delete_group'):
+            self._get_group(GroupName, 'DeleteGroup')
+            if self._group_users[GroupName]:
+                raise _error('DeleteConflict', 'Cannot delete entity, must remove users from group first.', 409, 'DeleteGroup')
+
+            del self._groups[GroupName]
+            del self._group_users[GroupName]
+            self._attached['group'].pop(GroupName, None)
+            self._inline['group'].pop(GroupName, None)
+            _remove_sorted(self._group_names, GroupName)
+            return {}
+
+    def list_groups(self, Marker=None, MaxItems=DEFAULT_MAX_ITEMS, PathPrefix='/'):
+        with self._request('list_groups'):
+            names, response = _page(self._group_names, Marker, MaxItems)
+            response['Groups'] = [dict(self._groups[name]) for name in names]
+            return response
+
+    def add_user_to_group(self, GroupName, UserName):
+        with self._request('add_user_to_group'):
+            self._get_group(GroupName, 'AddUserToGroup')
+            self._get_user(UserName, 'AddUserToGroup')
+            if GroupName not in self._user_groups[UserName]:
+                insort(self._user_groups[UserName], GroupName)
+                insort(self._group_users[GroupName], UserName)
+            return {}
+
+    def remove_user_from_group(self, GroupName, UserName):
+        with self._request('remove_user_from_group'):
+            self._get_group(GroupName, 'RemoveUserFromGroup')
+            self._get_user(UserName, 'RemoveUserFromGroup')
+            if GroupName not in self._user_groups[UserName]:
+                raise _error(
+                    'NoSuchEntity', 'User {0} is not in group {1}.'.format(UserName, GroupName), 404, 'RemoveUserFromGroup'
+                )
+            _remove_sorted(self._user_groups[UserName], GroupName)
+            _remove_sorted(self._group_users[GroupName], UserName)
+            return {}
+
+    def list_groups_for_user(self, UserName, Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('list_groups_for_user'):
+            self._get_user(UserName, 'ListGroupsForUser')
+            names, response = _page(self._user_groups[UserName], Marker, MaxItems)
+            response['Groups'] = [dict(self._groups[name]) for name in names]
+            return response
+
+    #
+    # Access keys
+    #
+
+    def create_access_key(self, UserName):
+        with self._request('create_access_key'):
+            self._get_user(UserName, 'CreateAccessKey')
+            if len(self._user_keys[UserName]) >= MAX_KEYS_PER_USER:
+                raise _error(
+                    'LimitExceeded', 'Cannot exceed quota for AccessKeysPerUser: {0}'.format(MAX_KEYS_PER_USER),
+                    409, 'CreateAccessKey'
+                )
+            key = self._add_key(UserName)
+            return {'AccessKey': dict(key, SecretAccessKey=self._key_details[key['AccessKeyId']]['SecretAccessKey'])}
+
+    def list_access_keys(self, UserName, Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('list_access_keys'):
+            self._get_user(UserName, 'ListAccessKeys')
+            keys = self._user_keys[UserName]
+            start = int(Marker) if Marker else 0
+            end = start + MaxItems
+            response = {'AccessKeyMetadata': [dict(key) for key in keys[start:end]], 'IsTruncated': end < len(keys)}
+            if response['IsTruncated']:
+                response['Marker'] = str(end)
+            return response
+
+    def update_access_key(self, UserName, AccessKeyId, Status):
+        with self._request('update_access_key'):
+            self._get_key(UserName, AccessKeyId, 'UpdateAccessKey')['Status'] = Status
+            return {}
+
+    def delete_access_key(self, UserName, AccessKeyId):
+        with self._request('delete_access_key'):
+            key = self._get_key(UserName, AccessKeyId, 'DeleteAccessKey')
+            self._user_keys[UserName].remove(key)
+            del self._key_details[AccessKeyId]
+            return {}
+
+    def get_access_key_last_used(self, AccessKeyId):
+        with self._request('get_access_key_last_used'):
+            details = self._key_details.get(AccessKeyId)
+            if details is None:
+                raise _error('AccessDenied', 'Access key {0} not found.'.format(AccessKeyId), 403, 'GetAccessKeyLastUsed')
+            return {'UserName': details['UserName'], 'AccessKeyLastUsed': dict(details['LastUsed'])}
+
+    #
+    # Policies
+    #
+
+    def create_policy(self, PolicyName, PolicyDocument, Path='/', Description=''):
+        with self._request('create_policy'):
+            arn = 'arn:aws:iam::{0}:policy{1}{2}'.format(ACCOUNT_ID, Path, PolicyName)
+            if arn in self._policies:
+                raise _error('EntityAlreadyExists', 'A policy called {0} already exists.'.format(PolicyName), 409, 'CreatePolicy')
+            self._policies[arn] = {
+                'PolicyName': PolicyName,
+                'PolicyId': 'ANPA{0:016X}'.format(next(self._ids)),
+                'Arn': arn,
+                'Path': Path,
+                'DefaultVersionId': 'v1',
+                'CreateDate': self._clock(),
+            }
+            self._policy_versions[arn] = {'v1': json.loads(PolicyDocument)}
+            return {'Policy': dict(self._policies[arn])}
+
+    def create_policy_version(self, PolicyArn, PolicyDocument, SetAsDefault=False):
+        with self._request('create_policy_version'):
+            policy = self._get_policy(PolicyArn, 'CreatePolicyVersion')
+            versions = self._policy_versions[PolicyArn]
+            version_id = 'v{0}'.format(len(versions) + 1)
+            versions[version_id] = json.loads(PolicyDocument)
+            if SetAsDefault:
+                policy['DefaultVersionId'] = version_id
+            return {'PolicyVersion': {'VersionId': version_id, 'IsDefaultVersion': SetAsDefault}}
+
+    def get_policy(self, PolicyArn):
+        with self._request('get_policy'):
+            return {'Policy': dict(self._get_policy(PolicyArn, 'GetPolicy'))}
+
+    def get_policy_version(self, PolicyArn, VersionId):
+        with self._request('get_policy_version'):
+            policy = self._get_policy(PolicyArn, 'GetPolicyVersion')
+            document = self._policy_versions[PolicyArn].get(VersionId)
+            if document is None:
+                raise _error('NoSuchEntity', 'Policy version {0} not found.'.format(VersionId), 404, 'GetPolicyVersion')
+            return {'PolicyVersion': {
+                'Document': json.loads(json.dumps(document)),
+                'VersionId': VersionId,
+                'IsDefaultVersion': VersionId == policy['DefaultVersionId'],
+            }}
+
+    def attach_user_policy(self, UserName, PolicyArn):
+        with self._request('attach_user_policy'):
+            self._get_user(UserName, 'AttachUserPolicy')
+            self._attach('user', UserName, PolicyArn, 'AttachUserPolicy')
+            return {}
+
+    def detach_user_policy(self, UserName, PolicyArn):
+        with self._request('detach_user_policy'):
+            self._get_user(UserName, 'DetachUserPolicy')
+            self._detach('user', UserName, PolicyArn, 'DetachUserPolicy')
+            return {}
+
+    def list_attached_user_policies(self, UserName, Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('list_attached_user_policies'):
+            self._get_user(UserName, 'ListAttachedUserPolicies')
+            return self._attached_page('user', UserName, Marker, MaxItems)
+
+    def attach_group_policy(self, GroupName, PolicyArn):
+        with self._request('attach_group_policy'):
+            self._get_group(GroupName, 'AttachGroupPolicy')
+            self._attach('group', GroupName, PolicyArn, 'AttachGroupPolicy')
+            return {}
+
+    def detach_group_policy(self, GroupName, PolicyArn):
+        with self._request('detach_group_policy'):
+            self._get_group(GroupName, 'DetachGroupPolicy')
+            self._detach('group', GroupName, PolicyArn, 'DetachGroupPolicy')
+            return {}
+
+    def list_attached_group_policies(self, GroupName, Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('list_attached_group_policies'):
+            self._get_group(GroupName, 'ListAttachedGroupPolicies')
+            return self._attached_page('group', GroupName, Marker, MaxItems)
+
+    def put_user_policy(self, UserName, PolicyName, PolicyDocument):
+        with self._request('put_user_policy'):
+            self._get_user(UserName, 'PutUserPolicy')
+            self._inline['user'].setdefault(UserName, {})[PolicyName] = json.loads(PolicyDocument)
+            return {}
+
+    def get_user_policy(self, UserName, PolicyName):
+        with self._request('get_user_policy'):
+            self._get_user(UserName, 'GetUserPolicy')
+            document = self._get_inline('user', UserName, PolicyName, 'GetUserPolicy')
+            return {'UserName': UserName, 'PolicyName': PolicyName, 'PolicyDocument': document}
+
+    def delete_user_policy(self, UserName, PolicyName):
+        with self._request('delete_user_policy'):
+            self._get_user(UserName, 'DeleteUserPolicy')
+            self._get_inline('user', UserName, PolicyName, 'DeleteUserPolicy')
+            del self._inline['user'][UserName][PolicyName]
+            return {}
+
+    def list_user_policies(self, UserName, Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('list_user_policies'):
+            self._get_user(UserName, 'ListUserPolicies')
+            names, response = _page(sorted(self._inline['user'].get(UserName, {})), Marker, MaxItems)
+            response['PolicyNames'] = names
+            return response
+
+    def put_group_policy(self, GroupName, PolicyName, PolicyDocument):
+        with self._request('put_group_policy'):
+            self._get_group(GroupName, 'PutGroupPolicy')
+            self._inline['group'].setdefault(GroupName, {})[PolicyName] = json.loads(PolicyDocument)
+            return {}
+
+    def get_group_policy(self, GroupName, PolicyName):
+        with self._request('get_group_policy'):
+            self._get_group(GroupName, 'GetGroupPolicy')
+            document = self._get_inline('group', GroupName, PolicyName, 'GetGroupPolicy')
+            return {'GroupName': GroupName, 'PolicyName': PolicyName, 'PolicyDocument': document}
+
+    def list_group_policies(self, GroupName, Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('list_group_policies'):
+            self._get_group(GroupName, 'ListGroupPolicies')
+            names, response = _page(sorted(self._inline['group'].get(GroupName, {})), Marker, MaxItems)
+            response['PolicyNames'] = names
+            return response
+
+    #
+    # Bulk
+    #
+
+    def get_account_authorization_details(self, Filter=('User', 'Group'), Marker=None, MaxItems=DEFAULT_MAX_ITEMS):
+        with self._request('get_account_authorization_details'):
+            # Users come first, then groups; the marker records which list and where in it
+            lists = []
+            if 'User' in Filter:
+                lists.append(('User', self._user_names))
+            if 'Group' in Filter:
+                lists.append(('Group', self._group_names))
+
+            position, name = (int(Marker.split(':', 1)[0]), Marker.split(':', 1)[1]) if Marker else (0, None)
+            response = {'UserDetailList': [], 'GroupDetailList': [], 'IsTruncated': False}
+            remaining = MaxItems
+
+            for current, (kind, names) in enumerate(lists):
+                if current < position:
+                    continue
+                start = bisect_left(names, name) if current == position and name is not None else 0
+                for i in range(start, len(names)):
+                    if not remaining:
+                        response['IsTruncated'] = True
+                        response['Marker'] = '{0}:{1}'.format(current, names[i])
+                        return response
+                    if kind == 'User':
+                        response['UserDetailList'].append(dict(
+                            self._users[names[i]],
+                            GroupList=list(self._user_groups[names[i]]),
+                            UserPolicyList=self._inline_details('user', names[i]),
+                            AttachedManagedPolicies=self._attached_details('user', names[i]),
+                        ))
+                    else:
+                        response['GroupDetailList'].append(dict(
+                            self._groups[names[i]],
+                            GroupPolicyList=self._inline_details('group', names[i]),
+                            AttachedManagedPolicies=self._attached_details('group', names[i]),
+                        ))
+                    remaining -= 1
+
+            return response
+
+    #
+    # Reports
+    #
+
+    def generate_credential_report(self):
+        # Like IAM, the first call starts generating the report and a later one finds it complete
+        with self._request('generate_credential_report'):
+            if self._report is None or self._clock() - self._report[1] > _REPORT_MAX_AGE:
+                self._report = (self._credential_report(), self._clock())
+                self._report_ready = False
+                return {'State': 'STARTED', 'Description': 'No report exists. Starting a new report generation task'}
+
+            self._report_ready = True
+            return {'State': 'COMPLETE'}
+
+    def get_credential_report(self):
+        with self._request('get_credential_report'):
+            if not self._report_ready:
+                raise _error('ReportNotPresent', 'Credential report is not present.', 410, 'GetCredentialReport')
+            content, generated_time = self._report
+            return {'Content': content, 'ReportFormat': 'text/csv', 'GeneratedTime': generated_time}
+
+    def _credential_report(self):
+        rows = [_REPORT_COLUMNS, _report_row(
+            '<root_account>', 'arn:aws:iam::{0}:root'.format(ACCOUNT_ID), self._created, [], {},
+        )]
+        for username in self._user_names:
+            user = self._users[username]
+            rows.append(_report_row(
+                username, user['Arn'], user['CreateDate'], self._user_keys[username], self._key_details,
+            ))
+
+        return ''.join(','.join(row) + '\n' for row in rows).encode('utf-8')
+
+    #
+    # Internals
+    #
+
+    def _request(self, operation):
+        """
+        Counts the call, applies the configured latency and throttling and holds the
+        lock for the duration of the call.
+        """
+        return _Request(self, operation)
+
+    def _add_user(self, username, path='/', sort=True):
+        user = {
+            'Path': path,
+            'UserName': username,
+            'UserId': 'AIDA{0:016X}'.format(next(self._ids)),
+            'Arn': 'arn:aws:iam::{0}:user{1}{2}'.format(ACCOUNT_ID, path, username),
+            'CreateDate': self._clock(),
+        }
+        self._users[username] = user
+        self._user_groups[username] = []
+        self._user_keys[username] = []
+        if sort:
+            insort(self._user_names, username)
+        else:
+            self._user_names.append(username)
+        return user
+
+    def _add_group(self, group_name, path='/', sort=True):
+        group = {
+            'Path': path,
+            'GroupName': group_name,
+            'GroupId': 'AGPA{0:016X}'.format(next(self._ids)),
+            'Arn': 'arn:aws:iam::{0}:group{1}{2}'.format(ACCOUNT_ID, path, group_name),
+            'CreateDate': self._clock(),
+        }
+        self._groups[group_name] = group
+        self._group_users[group_name] = []
+        if sort:
+            insort(self._group_names, group_name)
+        else:
+            self._group_names.append(group_name)
+        return group
+
+    def _add_key(self, username):
+        key_id = 'AKIA{0:016X}'.format(next(self._ids))
+        key = {'UserName': username, 'AccessKeyId': key_id, 'Status': ACTIVE, 'CreateDate': self._clock()}
+        self._user_keys[username].append(key)
+        self._key_details[key_id] = {
+            'UserName': username,
+            'SecretAccessKey': '{0:040x}'.format(self._random.getrandbits(160)),
+            'LastUsed': {'ServiceName': 'N/A', 'Region': 'N/A'},
+        }
+        return key
+
+    def _get_user(self, username, operation):
+        user = self._users.get(username)
+        if user is None:
+            raise _error('NoSuchEntity', 'The user with name {0} cannot be found.'.format(username), 404, operation)
+        return user
+
+    def _get_group(self, group_name, operation):
+        group = self._groups.get(group_name)
+        if group is None:
+            raise _error('NoSuchEntity', 'The group with name {0} cannot be found.'.format(group_name), 404, operation)
+        return group
+
+    def _get_policy(self, arn, operation):
+        policy = self._policies.get(arn)
+        if policy is None:
+            raise _error('NoSuchEntity', 'Policy {0} was not found.'.format(arn), 404, operation)
+        return policy
+
+    def _attach(self, kind, name, arn, operation):
+        self._get_policy(arn, operation)
+        arns = self._attached[kind].setdefault(name, [])
+        if arn not in arns:
+            insort(arns, arn)
+
+    def _detach(self, kind, name, arn, operation):
+        arns = self._attached[kind].get(name, [])
+        if arn not in arns:
+            raise _error('NoSuchEntity', 'Policy {0} was not found.'.format(arn), 404, operation)
+        _remove_sorted(arns, arn)
+
+    def _attached_page(self, kind, name, marker, max_items):
+        arns, response = _page(self._attached[kind].get(name, []), marker, max_items)
+        response['AttachedPolicies'] = [
+            {'PolicyName': self._policies[arn]['PolicyName'], 'PolicyArn': arn} for arn in arns
+        ]
+        return response
+
+    def _attached_details(self, kind, name):
+        return [
+            {'PolicyName': self._policies[arn]['PolicyName'], 'PolicyArn': arn}
+            for arn in self._attached[kind].get(name, [])
+        ]
+
+    def _inline_details(self, kind, name):
+        # Copies, as botocore hands out documents decoded from each response
+        return [
+            {'PolicyName': policy_name, 'PolicyDocument': json.loads(json.dumps(document))}
+            for policy_name, document in sorted(self._inline[kind].get(name, {}).items())
+        ]
+
+    def _get_inline(self, kind, name, policy_name, operation):
+        document = self._inline[kind].get(name, {}).get(policy_name)
+        if document is None:
+            raise _error('NoSuchEntity', 'The policy {0} cannot be found.'.format(policy_name), 404, operation)
+        return json.loads(json.dumps(document))
+
+    def _get_key(self, username, key_id, operation):
+        self._get_user(username, operation)
+        for key in self._user_keys[username]:
+            if key['AccessKeyId'] == key_id:
+                return key
+        raise _error('NoSuchEntity', 'The Access Key with id {0} cannot be found.'.format(key_id), 404, operation)
+
+
+class _Request(object):
+
+    def __init__(self, backend, operation):
+        self._backend = backend
+        self._operation = operation
+
+    def __enter__(self):
+        backend = self._backend
+        # The latency is spent outside the lock, so concurrent callers overlap as they would against AWS
+        if backend.latency:
+            time.sleep(backend.latency)
+
+        backend._lock.acquire()
+        backend.calls[self._operation] += 1
+        if backend.throttle_rate and backend._random.random() < backend.throttle_rate:
+            backend._lock.release()
+            raise _error('Throttling', 'Rate exceeded', 400, self._operation)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._backend._lock.release()
+
+
+_REPORT_COLUMNS = [
+    'user', 'arn', 'user_creation_time', 'password_enabled', 'password_last_used', 'password_last_changed',
+    'password_next_rotation', 'mfa_active',
+    'access_key_1_active', 'access_key_1_last_rotated', 'access_key_1_last_used_date',
+    'access_key_1_last_used_region', 'access_key_1_last_used_service',
+    'access_key_2_active', 'access_key_2_last_rotated', 'access_key_2_last_used_date',
+    'access_key_2_last_used_region', 'access_key_2_last_used_service',
+    'cert_1_active', 'cert_1_last_rotated', 'cert_2_active', 'cert_2_last_rotated',
+]
+
+
+def _report_row(username, arn, created, keys, key_details):
+    # MemoryBackend users have no password, MFA device or certificate
+    row = [username, arn, _report_date(created), 'false', 'N/A', 'N/A', 'N/A', 'false']
+
+    for slot in range(MAX_KEYS_PER_USER):
+        if slot < len(keys):
+            key = keys[slot]
+            last_used = key_details[key['AccessKeyId']]['LastUsed']
+            row.extend([
+                'true' if key['Status'] == ACTIVE else 'false',
+                _report_date(key['CreateDate']),
+                _report_date(last_used.get('LastUsedDate')),
+                last_used['Region'],
+                last_used['ServiceName'],
+            ])
+        else:
+            row.extend(['false', 'N/A', 'N/A', 'N/A', 'N/A'])
+
+    row.extend(['false', 'N/A', 'false', 'N/A'])
+    return row
+
+
+def _report_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S+00:00') if value is not None else 'N/A'
+
+
+def _page(names, marker, max_items):
+    """
+    Returns the slice of the sorted list of names starting at marker, and a response
+    dict with the truncation flag and, if truncated, the marker of the next page.
+    """
+    start = bisect_left(names, marker) if marker else 0
+    end = start + max_items
+    response = {'IsTruncated': end < len(names)}
+    if response['IsTruncated']:
+        response['Marker'] = names[end]
+    return names[start:end], response
+
+
+def _remove_sorted(names, name):
+    index = bisect_left(names, name)
+    if index < len(names) and names[index] == name:
+        del names[index]
+
+
+def _error(code, message, status, operation):
+    return ClientError(
+        {'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}},
+        operation,
+    )
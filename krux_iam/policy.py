@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import namedtuple
+from fnmatch import fnmatchcase
+import hashlib
+import json
+import threading
+
+#
+# Third party libraries
+#
+
+from botocore.exceptions import ClientError
+
+#
+# Internal libraries
+#
+
+from krux_iam.throttle import NOT_FOUND_ERROR_CODE
+
+
+ALLOW = 'Allow'
+DENY = 'Deny'
+
+# A statement of a policy document, reduced to what decides which actions it covers.
+# actions are lower case patterns (IAM actions are case insensitive); with negated,
+# the statement covers every action but those (NotAction). unconditional is set when
+# the statement applies to every resource without a condition.
+Statement = namedtuple('Statement', ['effect', 'actions', 'negated', 'unconditional'])
+
+
+def digest(document):
+    """
+    Returns the content address of a policy document: the SHA-256 of its canonical JSON.
+    """
+    canonical = json.dumps(document, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def parse_statements(document):
+    """
+    Returns the Statements of the given policy document, a dict as returned by botocore.
+    """
+    statements = document.get('Statement', [])
+    if isinstance(statements, dict):
+        statements = [statements]
+
+    parsed = []
+    for statement in statements:
+        negated = 'NotAction' in statement
+        actions = statement.get('NotAction' if negated else 'Action', [])
+        if not isinstance(actions, list):
+            actions = [actions]
+        resources = statement.get('Resource', [])
+        if not isinstance(resources, list):
+            resources = [resources]
+
+        parsed.append(Statement(
+            effect=statement.get('Effect'),
+            actions=tuple(sorted(set(action.lower() for action in actions))),
+            negated=negated,
+            unconditional='*' in resources and 'Condition' not in statement,
+        ))
+
+    return tuple(parsed)
+
+
+class PolicyCache(object):
+    """
+    A content addressed store of policy documents: each distinct document is kept, and
+    parsed, once however many policy versions and inline policies share it. Managed
+    policy versions never change, so they are kept without expiry, keyed by ARN and
+    version id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._statements = {}
+        self._versions = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._documents)
+
+    def add(self, document):
+        """
+        Stores the given document and returns its digest.
+        """
+        key = digest(document)
+        with self._lock:
+            if key not in self._documents:
+                self._documents[key] = document
+                self._statements[key] = parse_statements(document)
+        return key
+
+    def get(self, key):
+        """
+        Returns the document with the given digest, or None.
+        """
+        with self._lock:
+            return self._documents.get(key)
+
+    def get_statements(self, key):
+        """
+        Returns the parsed Statements of the document with the given digest, or None.
+        """
+        with self._lock:
+            return self._statements.get(key)
+
+    def get_version(self, policy_arn, version_id):
+        """
+        Returns the digest of the document of the given policy version, or None if not stored.
+        """
+        with self._lock:
+            return self._versions.get((policy_arn, version_id))
+
+    def set_version(self, policy_arn, version_id, document):
+        """
+        Stores the document of the given policy version and returns its digest.
+        """
+        key = self.add(document)
+        with self._lock:
+            self._versions[(policy_arn, version_id)] = key
+        return key
+
+
+class Permissions(object):
+    """
+    The effective permissions granted by a set of policy Statements, at the level of
+    actions: an action is allowed when an Allow statement covers it and no Deny
+    statement applying to every resource unconditionally does. Resource and condition
+    scoped statements are taken to allow the action for some requests, and their
+    denials to leave it allowed for others.
+    """
+
+    def __init__(self, statements):
+        self._allows = [statement for statement in statements if statement.effect == ALLOW]
+        self._denies = [statement for statement in statements if statement.effect == DENY and statement.unconditional]
+
+    def allows(self, action):
+        """
+        Returns whether the given action, e.g. 's3:GetObject', is allowed.
+        """
+        action = action.lower()
+        return any(_covers(statement, action) for statement in self._allows) and \
+            not any(_covers(statement, action) for statement in self._denies)
+
+    @property
+    def allowed_actions(self):
+        """
+        The sorted action patterns the Allow statements grant and no unconditional Deny
+        statement entirely takes back. Patterns granted through NotAction are given as
+        '*' with the exceptions of the statement left out; use allows() to check those.
+        """
+        patterns = set()
+        for statement in self._allows:
+            patterns.update(('*',) if statement.negated else statement.actions)
+
+        return sorted(
+            pattern for pattern in patterns
+            if not any(_covers(statement, pattern) for statement in self._denies)
+        )
+
+
+class PolicyEvaluator(object):
+    """
+    Computes the effective Permissions of many users at once: their attached and inline
+    policies plus those of their groups. The users, groups and their policies are read
+    from paginated get_account_authorization_details calls, which carry the inline
+    policy documents and the attached policy ARNs, rather than with per user lookups.
+    Only the documents of the attached managed policies are fetched on top of that,
+    max_workers at a time and once per policy, through the PolicyCache of the IAM
+    object, however many users and groups share them.
+    """
+
+    def __init__(self, iam):
+        self._iam = iam
+
+    def evaluate(self, usernames=None, page_size=None):
+        """
+        Yields a UserResult holding the Permissions of each of the given users, or every
+        user of the account. A user which the listing does not hold gets a NoSuchEntity
+        error, and one whose managed policies could not be fetched the error raised.
+        """
+        from krux_iam.iam import UserResult
+
+        if usernames is not None:
+            usernames = list(usernames)
+        wanted = set(usernames) if usernames is not None else None
+        # username -> (attached policy ARNs, inline policy digests, group names),
+        # group name -> (attached policy ARNs, inline policy digests)
+        users = {}
+        groups = {}
+
+        responses = self._iam._iter_pages(
+            'get_account_authorization_details',
+            page_size=page_size,
+            Filter=['User', 'Group']
+        )
+        for response in responses:
+            for user in response.get('UserDetailList', []):
+                if wanted is None or user['UserName'] in wanted:
+                    arns, keys = self._read_policies(user, 'UserPolicyList')
+                    users[user['UserName']] = (arns, keys, user.get('GroupList', []))
+            for group in response.get('GroupDetailList', []):
+                groups[group['GroupName']] = self._read_policies(group, 'GroupPolicyList')
+
+        # Only the groups of the evaluated users matter
+        arns = set()
+        for user_arns, _, group_names in users.values():
+            arns.update(user_arns)
+            for group_name in group_names:
+                arns.update(groups.get(group_name, ((), ()))[0])
+
+        policies = dict(self._iam._imap_unordered(self._iam._get_policy_digest, sorted(arns)))
+
+        for username in (usernames if usernames is not None else sorted(users)):
+            if username not in users:
+                yield UserResult(username, None, _not_found(username))
+                continue
+
+            user_arns, keys, group_names = users[username]
+            arns = list(user_arns)
+            keys = list(keys)
+            for group_name in group_names:
+                group_arns, group_keys = groups.get(group_name, ((), ()))
+                arns.extend(group_arns)
+                keys.extend(group_keys)
+
+            failed = [arn for arn in arns if policies[arn].exception() is not None]
+            if failed:
+                yield UserResult(username, None, policies[failed[0]].exception())
+                continue
+
+            keys.extend(policies[arn].result() for arn in arns)
+            statements = []
+            for key in set(keys):
+                statements.extend(self._iam._policy_cache.get_statements(key))
+            yield UserResult(username, Permissions(statements), None)
+
+    def _read_policies(self, entity, inline_key):
+        """
+        Returns the attached policy ARNs of the given user or group details and the
+        digests of their inline policy documents, adding those to the PolicyCache.
+        """
+        arns = tuple(policy['PolicyArn'] for policy in entity.get('AttachedManagedPolicies', []))
+        keys = tuple(self._iam._policy_cache.add(policy['PolicyDocument']) for policy in entity.get(inline_key, []))
+        return arns, keys
+
+
+def _not_found(username):
+    return ClientError(
+        {
+            'Error': {'Code': NOT_FOUND_ERROR_CODE, 'Message': 'The user with name {0} cannot be found.'.format(username)},
+            'ResponseMetadata': {'HTTPStatusCode': 404},
+        },
+        'GetAccountAuthorizationDetails',
+    )
+
+
+def _covers(statement, action):
+    matched = any(fnmatchcase(action, pattern) for pattern in statement.actions)
+    return matched != statement.negated
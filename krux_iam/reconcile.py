@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import namedtuple
+import json
+import sys
+
+#
+# Internal libraries
+#
+
+from krux_iam.keys import MAX_KEYS_PER_USER
+
+
+# One mutation of a plan: the IAM method to call, the user and the group name or
+# access key id it applies to, if any.
+Action = namedtuple('Action', ['operation', 'username', 'argument'])
+
+
+def load_manifest(path):
+    """
+    Loads a desired state manifest from a JSON file, or a YAML file if the path
+    ends in .yaml or .yml (which requires PyYAML). The manifest maps usernames to
+    their desired state:
+
+        {"users": {"jdoe": {"groups": ["admins"], "access_keys": 1}}}
+
+    access_keys may be left out to leave the user's keys alone; it may be at most
+    MAX_KEYS_PER_USER.
+    """
+    with open(path) as manifest:
+        if path.endswith(('.yaml', '.yml')):
+            # PyYAML is only needed for YAML manifests
+            import yaml
+            return yaml.safe_load(manifest)
+
+        return json.load(manifest)
+
+
+class Plan(object):
+    """
+    The mutations needed to bring the account to a desired state, grouped into
+    phases that must run one after the other: creating users, then changing
+    memberships and keys, then deleting users. The actions within a phase are
+    independent of each other.
+    """
+
+    def __init__(self, creates=(), changes=(), deletes=()):
+        self.phases = [list(creates), list(changes), list(deletes)]
+
+    def __iter__(self):
+        for phase in self.phases:
+            for action in phase:
+                yield action
+
+    def __len__(self):
+        return sum(len(phase) for phase in self.phases)
+
+    def format(self):
+        """
+        Returns the plan as text, one action per line.
+        """
+        return '\n'.join(
+            ' '.join(str(part) for part in action if part is not None)
+            for action in self
+        )
+
+
+class Reconciler(object):
+    """
+    Brings the users, group memberships and access key counts of an account in
+    line with a desired state manifest, issuing only the writes that are needed.
+    The current state is loaded in bulk with IAM.snapshot(); only the key counts
+    of managed users need per user calls. Users missing from the manifest are only
+    deleted with prune.
+    """
+
+    def __init__(self, iam, prune=False):
+        self._iam = iam
+        self._prune = prune
+
+    def plan(self, manifest):
+        """
+        Returns the Plan for the given manifest, as loaded by load_manifest().
+        """
+        desired = manifest.get('users', {})
+        for username, state in desired.items():
+            if (_key_count(state) or 0) > MAX_KEYS_PER_USER:
+                raise ValueError('User {0} cannot have more than {1} access keys'.format(username, MAX_KEYS_PER_USER))
+
+        snapshot = self._iam.snapshot()
+        current_keys = self._load_key_ids(
+            [username for username, state in desired.items() if username in snapshot.users and _key_count(state) is not None]
+        )
+
+        creates = []
+        changes = []
+        deletes = []
+
+        for username in sorted(desired):
+            state = desired[username] or {}
+            exists = username in snapshot.users
+            if not exists:
+                creates.append(Action('create_user', username, None))
+
+            current_groups = set(snapshot.user_groups.get(username, [])) if exists else set()
+            desired_groups = set(state.get('groups', []))
+            changes.extend(Action('add_user_to_group', username, group) for group in sorted(desired_groups - current_groups))
+            changes.extend(Action('delete_user_from_group', username, group) for group in sorted(current_groups - desired_groups))
+
+            key_count = _key_count(state)
+            if key_count is not None:
+                key_ids = current_keys.get(username, [])
+                changes.extend(Action('create_access_keys', username, None) for _ in range(key_count - len(key_ids)))
+                # The oldest keys go first
+                changes.extend(Action('delete_access_key', username, key_id) for key_id in key_ids[:len(key_ids) - key_count])
+
+        if self._prune:
+            deletes.extend(Action('delete_user', username, None) for username in sorted(set(snapshot.users) - set(desired)))
+
+        return Plan(creates, changes, deletes)
+
+    def apply(self, plan, sink=None):
+        """
+        Runs the actions of the plan, each phase concurrently, and returns a list of
+        (action, result) pairs. If any action of a phase fails, the later phases are
+        not run and a BatchError is raised.
+
+        The key of each create_access_keys action is handed to sink(username,
+        access_key_id, secret_access_key) as soon as it is created, so that it is not
+        lost to a failure elsewhere in the plan; a key whose secret the sink fails to
+        take is deleted again. Without a sink, the keys are only part of the results.
+        """
+        results = []
+
+        for phase in plan.phases:
+            calls = [self._to_call(action, sink) for action in phase]
+            phase_results = self._iam._run_concurrently(calls, 'Failed to reconcile')
+            results.extend(zip(phase, phase_results))
+
+        return results
+
+    def reconcile(self, manifest, dry_run=False, out=None, sink=None):
+        """
+        Plans and applies the given manifest. With dry_run, the plan is only
+        written to out, sys.stdout by default. Returns the plan.
+
+        The secrets of the access keys the plan creates are handed to sink, as
+        apply() does; a plan creating keys is refused without one, as their
+        secrets would be lost.
+        """
+        plan = self.plan(manifest)
+
+        if dry_run:
+            if len(plan):
+                (out if out is not None else sys.stdout).write(plan.format() + '\n')
+            return plan
+
+        if sink is None and any(action.operation == 'create_access_keys' for action in plan):
+            raise ValueError('The plan creates access keys; a sink is needed to receive their secrets')
+        self.apply(plan, sink=sink)
+
+        return plan
+
+    def _to_call(self, action, sink):
+        if action.operation == 'create_access_keys' and sink is not None:
+            return _create_access_key, (self._iam, sink, action.username)
+        return getattr(self._iam, action.operation), _call_args(action)
+
+    def _load_key_ids(self, usernames):
+        """
+        Returns a dict of username to the ids of their access keys, oldest first.
+        """
+        calls = [(self._iam.get_access_keys, (username,)) for username in usernames]
+        keys = self._iam._run_concurrently(calls, 'Failed to list access keys')
+
+        return dict(
+            (username, [key['AccessKeyId'] for key in sorted(user_keys, key=lambda key: key.get('CreateDate'))])
+            for username, user_keys in zip(usernames, keys)
+        )
+
+
+def _key_count(state):
+    return (state or {}).get('access_keys')
+
+
+def _create_access_key(iam, sink, username):
+    key_id, secret_key = iam.create_access_keys(username)
+    try:
+        sink(username, key_id, secret_key)
+    except Exception:
+        # The secret is lost, so the new key is of no use
+        iam.delete_access_key(username, key_id)
+        raise
+
+    return key_id, secret_key
+
+
+def _call_args(action):
+    if action.argument is None:
+        return (action.username,)
+    return (action.username, action.argument)
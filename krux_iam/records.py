@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import OrderedDict
+import sys
+
+#
+# Internal libraries
+#
+
+from krux_iam.keys import to_epoch
+
+
+# Names, paths and statuses repeat across millions of records; interning keeps one copy of each
+_intern_str = getattr(sys, 'intern', None) or intern  # noqa: F821 (the builtin on Python 2)
+
+
+def _intern(value):
+    # Only native strings can be interned: on Python 2, botocore returns unicode, which
+    # is kept as it is
+    return _intern_str(value) if type(value) is str else value
+
+
+def _intern_optional(value):
+    return _intern(value) if value is not None else None
+
+
+class _Record(object):
+    """
+    Base of the compact record types: fixed attributes in __slots__, interned strings
+    and timestamps as integer epoch seconds, instead of a botocore response dict with
+    datetime objects per entity.
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        # Python 3 drops the inherited __hash__ of a class defining __eq__
+        return hash((type(self),) + tuple(getattr(self, name) for name in self.__slots__))
+
+    def __repr__(self):
+        return '{0}({1})'.format(
+            type(self).__name__,
+            ', '.join('{0}={1!r}'.format(name, getattr(self, name)) for name in self.__slots__),
+        )
+
+    def to_dict(self):
+        """
+        Returns the record as a dict of its attributes.
+        """
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+class User(_Record):
+    __slots__ = ('name', 'user_id', 'account_id', 'path', 'create_date', 'password_last_used')
+
+    def __init__(self, name, user_id, account_id, path, create_date, password_last_used=None):
+        self.name = _intern(name)
+        self.user_id = user_id
+        self.account_id = _intern_optional(account_id)
+        self.path = _intern_optional(path)
+        self.create_date = create_date
+        self.password_last_used = password_last_used
+
+    @classmethod
+    def from_dict(cls, user):
+        """
+        Builds a User from a user dict as returned by the IAM API.
+        """
+        return cls(
+            name=user['UserName'],
+            user_id=user.get('UserId'),
+            account_id=_account_id(user.get('Arn')),
+            path=user.get('Path'),
+            create_date=to_epoch(user.get('CreateDate')),
+            password_last_used=to_epoch(user.get('PasswordLastUsed')),
+        )
+
+    @property
+    def arn(self):
+        return 'arn:aws:iam::{0}:user{1}{2}'.format(self.account_id, self.path or '/', self.name)
+
+
+class Group(_Record):
+    __slots__ = ('name', 'group_id', 'account_id', 'path', 'create_date')
+
+    def __init__(self, name, group_id, account_id, path, create_date):
+        self.name = _intern(name)
+        self.group_id = group_id
+        self.account_id = _intern_optional(account_id)
+        self.path = _intern_optional(path)
+        self.create_date = create_date
+
+    @classmethod
+    def from_dict(cls, group):
+        """
+        Builds a Group from a group dict as returned by the IAM API.
+        """
+        return cls(
+            name=group['GroupName'],
+            group_id=group.get('GroupId'),
+            account_id=_account_id(group.get('Arn')),
+            path=group.get('Path'),
+            create_date=to_epoch(group.get('CreateDate')),
+        )
+
+    @property
+    def arn(self):
+        return 'arn:aws:iam::{0}:group{1}{2}'.format(self.account_id, self.path or '/', self.name)
+
+
+class AccessKey(_Record):
+    __slots__ = ('username', 'access_key_id', 'status', 'create_date')
+
+    def __init__(self, username, access_key_id, status, create_date):
+        self.username = _intern_optional(username)
+        self.access_key_id = access_key_id
+        self.status = _intern_optional(status)
+        self.create_date = create_date
+
+    @classmethod
+    def from_dict(cls, key):
+        """
+        Builds an AccessKey from an access key dict as returned by the IAM API.
+        """
+        return cls(
+            username=key.get('UserName'),
+            access_key_id=key['AccessKeyId'],
+            status=key.get('Status'),
+            create_date=to_epoch(key.get('CreateDate')),
+        )
+
+
+def to_columns(records):
+    """
+    Returns the given records, all of the same type, in columnar form: an ordered
+    dict of attribute name to the list of that attribute's values, ready to be
+    loaded into a data frame or written out for analytics jobs.
+    """
+    columns = None
+
+    for record in records:
+        if columns is None:
+            columns = OrderedDict((name, []) for name in record.__slots__)
+        for name, column in columns.items():
+            column.append(getattr(record, name))
+
+    return columns if columns is not None else OrderedDict()
+
+
+def _account_id(arn):
+    # arn:aws:iam::123456789012:user/path/name
+    if not arn:
+        return None
+    return arn.split(':')[4]
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import namedtuple
+import calendar
+import csv
+import time
+
+#
+# Internal libraries
+#
+
+from krux_iam.keys import MAX_KEYS_PER_USER
+
+
+# Name of the credential report row describing the root user of the account
+ROOT_ACCOUNT = '<root_account>'
+
+# Values the credential report uses instead of a date when there is none
+_NO_DATE = frozenset(['', 'N/A', 'no_information', 'not_supported'])
+
+_MISSING = object()
+
+# An access key slot of a credential report row. The report does not carry key ids:
+# a key is identified by its user and its last_rotated time, which is its creation
+# time. Dates are epoch seconds, None when there is none.
+ReportKey = namedtuple('ReportKey', [
+    'slot', 'active', 'last_rotated', 'last_used', 'last_used_service', 'last_used_region',
+])
+
+# A user of a credential report. access_keys holds the ReportKeys of the used slots.
+CredentialEntry = namedtuple('CredentialEntry', [
+    'username', 'arn', 'created', 'password_enabled', 'password_last_used', 'password_last_changed',
+    'mfa_active', 'access_keys',
+])
+
+
+class CredentialReportTimeout(Exception):
+    """
+    Raised when IAM takes too long to generate the credential report.
+    """
+
+
+class CredentialReport(object):
+    """
+    The parsed credential report of an account: every user with their password, MFA
+    and access key usage, as returned by IAM.get_credential_report(). One report
+    answers account wide usage questions which would otherwise take a listing and a
+    get_access_key_last_used call per key.
+    """
+
+    def __init__(self, entries=(), generated_at=None):
+        self.generated_at = generated_at
+        self.root = None
+        self._entries = {}
+
+        for entry in entries:
+            if entry.username == ROOT_ACCOUNT:
+                self.root = entry
+            else:
+                self._entries[entry.username] = entry
+
+    @classmethod
+    def from_csv(cls, lines, generated_at=None):
+        """
+        Builds a report from the lines of the credential report CSV, parsed one row at
+        a time, so lines can be any iterable such as an open file.
+        """
+        return cls(_parse(lines), generated_at=generated_at)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def usernames(self):
+        """
+        Returns the names of the users in the report, the root user excluded.
+        """
+        return list(self._entries)
+
+    def get(self, username):
+        """
+        Returns the CredentialEntry of the given user, or None.
+        """
+        return self._entries.get(username)
+
+    def find_key(self, username, create_date):
+        """
+        Returns the ReportKey of the user's access key created at the given epoch time,
+        or None.
+        """
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+
+        for key in entry.access_keys:
+            if key.last_rotated == create_date:
+                return key
+        return None
+
+    def stale_keys(self, max_idle, now=None):
+        """
+        Returns (username, ReportKey) pairs of the active keys which have not been used
+        for max_idle seconds, or were never used and are older than that, oldest first.
+        """
+        cutoff = (now if now is not None else time.time()) - max_idle
+
+        return sorted(
+            (
+                (entry.username, key)
+                for entry in self._entries.values()
+                for key in entry.access_keys
+                if key.active and (key.last_used or key.last_rotated or cutoff) < cutoff
+            ),
+            key=lambda pair: pair[1].last_rotated or 0,
+        )
+
+    def inactive_users(self, max_idle, now=None):
+        """
+        Returns the names of the users created more than max_idle seconds ago who have
+        used neither their password nor any access key since, sorted.
+        """
+        cutoff = (now if now is not None else time.time()) - max_idle
+
+        return sorted(
+            entry.username
+            for entry in self._entries.values()
+            if (entry.created or cutoff) < cutoff and all(
+                last_used is None or last_used < cutoff
+                for last_used in [entry.password_last_used] + [key.last_used for key in entry.access_keys]
+            )
+        )
+
+
+def _parse(lines):
+    reader = csv.reader(lines)
+    columns = dict((name, i) for i, name in enumerate(next(reader)))
+
+    def column(name):
+        return columns[name]
+
+    user, arn, created = column('user'), column('arn'), column('user_creation_time')
+    password_enabled = column('password_enabled')
+    password_last_used = column('password_last_used')
+    password_last_changed = column('password_last_changed')
+    mfa_active = column('mfa_active')
+    slots = [
+        (
+            slot,
+            column('access_key_{0}_active'.format(slot)),
+            column('access_key_{0}_last_rotated'.format(slot)),
+            column('access_key_{0}_last_used_date'.format(slot)),
+            column('access_key_{0}_last_used_service'.format(slot)),
+            column('access_key_{0}_last_used_region'.format(slot)),
+        )
+        for slot in range(1, MAX_KEYS_PER_USER + 1)
+    ]
+
+    # Many users and keys share timestamps, e.g. those created by the same provisioning run
+    dates = {}
+
+    def to_epoch(value):
+        epoch = dates.get(value, _MISSING)
+        if epoch is _MISSING:
+            epoch = dates[value] = _to_epoch(value)
+        return epoch
+
+    for row in reader:
+        if not row:
+            continue
+
+        access_keys = []
+        for slot, active, last_rotated, last_used, service, region in slots:
+            rotated = to_epoch(row[last_rotated])
+            if rotated is None and row[active] != 'true':
+                # An unused slot
+                continue
+            access_keys.append(ReportKey(
+                slot,
+                row[active] == 'true',
+                rotated,
+                to_epoch(row[last_used]),
+                _or_none(row[service]),
+                _or_none(row[region]),
+            ))
+
+        yield CredentialEntry(
+            row[user],
+            row[arn],
+            to_epoch(row[created]),
+            row[password_enabled] == 'true',
+            to_epoch(row[password_last_used]),
+            to_epoch(row[password_last_changed]),
+            row[mfa_active] == 'true',
+            tuple(access_keys),
+        )
+
+
+def _to_epoch(value):
+    # The report's dates are ISO 8601 in UTC, e.g. 2016-05-04T12:34:56+00:00; slicing
+    # them is much faster than a general date parser on reports of many users
+    if value in _NO_DATE:
+        return None
+    return calendar.timegm((
+        int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13]), int(value[14:16]), int(value[17:19]),
+        0, 0, 0,
+    ))
+
+
+def _or_none(value):
+    return None if value in _NO_DATE else value
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import threading
+
+
+class SingleFlight(object):
+    """
+    Deduplicates concurrent calls: while a call for a key is in flight, other threads
+    asking for the same key wait for it and share its result or exception instead of
+    making their own call. Nothing is remembered once the call returns, and a call
+    can be forgotten before it does, e.g. when a write makes its result outdated.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key, func):
+        """
+        Returns a (result, shared) tuple: the result of func(), called unless a call
+        for the same key is already in flight, in which case the result of that call
+        is returned with shared set. An exception raised by the call is raised in
+        every thread waiting on it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value = func()
+            return call.value, False
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                # Unless forgotten, and maybe replaced by a later call
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def forget(self, key):
+        """
+        Detaches the call in flight for the given key, if any: the threads already
+        waiting on it still get its result, while those asking after this make a new
+        call.
+        """
+        with self._lock:
+            self._calls.pop(key, None)
+
+
+class _Call(object):
+    __slots__ = ('done', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
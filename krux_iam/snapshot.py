@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import defaultdict
+
+
+# Keys of a UserDetailList / GroupDetailList entry which are not part of the
+# plain user / group attributes returned by get_user / list_groups_for_user.
+_USER_DETAIL_KEYS = frozenset(['GroupList', 'UserPolicyList', 'AttachedManagedPolicies', 'Tags', 'PermissionsBoundary'])
+_GROUP_DETAIL_KEYS = frozenset(['GroupPolicyList', 'AttachedManagedPolicies'])
+
+
+class Snapshot(object):
+    """
+    An in-memory, indexed copy of the users, groups and group memberships of an
+    account, as returned by IAM.snapshot(). The lookup methods mirror those of
+    IAM so that a snapshot can be handed to IAM.get_user, IAM.get_groups and
+    IAM.get_access_keys in place of an API call.
+    """
+
+    def __init__(self, users, groups, memberships, access_keys=None):
+        """
+        users and groups are lists of attribute dicts, memberships is an iterable
+        of (username, group_name) pairs and access_keys, if loaded, is a dict of
+        username to the list of that user's access key dicts.
+        """
+        self.users = dict((user['UserName'], user) for user in users)
+        self.groups = dict((group['GroupName'], group) for group in groups)
+        self.user_groups = defaultdict(list)
+        self.group_users = defaultdict(list)
+        self.access_keys = access_keys
+
+        for username, group_name in memberships:
+            self.user_groups[username].append(group_name)
+            self.group_users[group_name].append(username)
+
+    @classmethod
+    def from_authorization_details(cls, details, access_keys=None):
+        """
+        Builds a snapshot from the UserDetailList and GroupDetailList entries yielded
+        by get_account_authorization_details. details is an iterable of those entries.
+        """
+        users = []
+        groups = []
+        memberships = []
+
+        for detail in details:
+            if 'UserName' in detail:
+                users.append(_strip(detail, _USER_DETAIL_KEYS))
+                memberships.extend((detail['UserName'], name) for name in detail.get('GroupList', []))
+            elif 'GroupName' in detail:
+                groups.append(_strip(detail, _GROUP_DETAIL_KEYS))
+
+        return cls(users, groups, memberships, access_keys=access_keys)
+
+    def get_user(self, username):
+        """
+        Returns a dict of the user's attributes or None if the user is not in the snapshot.
+        """
+        return self.users.get(username)
+
+    def get_groups(self, username):
+        """
+        Returns a list of dicts representing each group the user belongs to.
+        """
+        return [self.groups[name] for name in self.user_groups.get(username, []) if name in self.groups]
+
+    def get_group_members(self, group_name):
+        """
+        Returns a list of the names of the users in the given group.
+        """
+        return list(self.group_users.get(group_name, []))
+
+    def get_access_keys(self, username):
+        """
+        Returns a list of dicts representing the user's access keys. Raises a ValueError
+        if the snapshot was taken without access keys.
+        """
+        if self.access_keys is None:
+            raise ValueError('Snapshot was taken without access keys')
+
+        return list(self.access_keys.get(username, []))
+
+
+def _strip(detail, keys):
+    return dict((key, value) for key, value in detail.items() if key not in keys)
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import namedtuple
+import json
+import sqlite3
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+from dateutil.parser import parse as parse_date
+
+#
+# Internal libraries
+#
+
+from krux_iam.keys import to_epoch
+from krux_iam.snapshot import Snapshot
+
+
+# Number of seconds after which a refresh lists the account again, and after which
+# the access keys of a user are listed again
+DEFAULT_TTL = 3600
+
+# Bumped whenever the schema changes; a store with another version is rebuilt
+SCHEMA_VERSION = 1
+
+_SCHEMA = [
+    'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+    'CREATE TABLE users ('
+    ' name TEXT PRIMARY KEY, user_id TEXT, create_date INTEGER, data TEXT NOT NULL, keys_fetched_at REAL)',
+    'CREATE TABLE groups (name TEXT PRIMARY KEY, group_id TEXT, create_date INTEGER, data TEXT NOT NULL)',
+    'CREATE TABLE memberships (username TEXT NOT NULL, group_name TEXT NOT NULL, PRIMARY KEY (username, group_name))',
+    'CREATE INDEX memberships_by_group ON memberships (group_name)',
+    'CREATE TABLE access_keys (access_key_id TEXT PRIMARY KEY, username TEXT NOT NULL, data TEXT NOT NULL)',
+    'CREATE INDEX access_keys_by_user ON access_keys (username)',
+]
+
+# The tables of _SCHEMA, the only ones a migration drops
+_TABLES = ('meta', 'users', 'groups', 'memberships', 'access_keys')
+
+# Attributes of users, groups and keys holding datetimes, stored as ISO 8601 strings
+_DATE_KEYS = frozenset(['CreateDate', 'PasswordLastUsed'])
+
+# What StateStore.refresh did: the number of users and groups written because they
+# were new or changed, of those removed because they are gone from the account, and
+# of users whose access keys were listed.
+RefreshResult = namedtuple('RefreshResult', ['changed', 'removed', 'key_listings'])
+
+
+class StateStore(object):
+    """
+    A persistent copy of the users, groups, group memberships and access key metadata
+    of an account, kept in an SQLite database so that it survives between runs. Like
+    a Snapshot, it can be handed to IAM.get_user, IAM.get_groups and IAM.get_access_keys
+    in place of an API call, its lookups being served by indexed queries.
+
+    refresh() brings it up to date incrementally: the account is listed again only once
+    the last listing is older than ttl seconds, only new or changed entities are written,
+    and the access keys of a user are only listed again when the user is new, was
+    recreated (their UserId or CreateDate changed) or their listing is older than ttl.
+    Changes made through IAM after a refresh show up on the next one.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, clock=time.time):
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        try:
+            with self._lock, self._db:
+                self._migrate()
+        except Exception:
+            self._db.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    @property
+    def refreshed_at(self):
+        """
+        The epoch time of the last listing of the account, or None if it was never listed.
+        """
+        with self._lock:
+            value = self._get_meta('refreshed_at')
+        return float(value) if value is not None else None
+
+    def is_stale(self):
+        """
+        Returns whether the last listing of the account is missing or older than ttl.
+        """
+        refreshed_at = self.refreshed_at
+        return refreshed_at is None or self._clock() - refreshed_at >= self._ttl
+
+    def refresh(self, iam, include_access_keys=True, page_size=None, force=False):
+        """
+        Brings the store up to date with the account through the given IAM object, unless
+        it is still fresh and force is not set. Returns a RefreshResult.
+        """
+        if not force and not self.is_stale():
+            return RefreshResult(0, 0, 0)
+
+        now = self._clock()
+        details = iam._paginate(
+            'get_account_authorization_details',
+            ('UserDetailList', 'GroupDetailList'),
+            page_size=page_size,
+            Filter=['User', 'Group']
+        )
+        listing = Snapshot.from_authorization_details(details)
+
+        with self._lock, self._db:
+            changed, removed, stale_keys = self._merge(listing, now)
+
+        listings = []
+        if include_access_keys:
+            listings = [
+                (username, future.result())
+                for username, future in iam._imap_unordered(iam.get_access_keys, stale_keys)
+            ]
+
+        # Written in a single transaction, as committing each listing would dominate the refresh
+        with self._lock, self._db:
+            for username, keys in listings:
+                self._db.execute('DELETE FROM access_keys WHERE username = ?', (username,))
+                self._db.executemany(
+                    'INSERT INTO access_keys (access_key_id, username, data) VALUES (?, ?, ?)',
+                    [(key['AccessKeyId'], username, _dumps(key)) for key in keys]
+                )
+                self._db.execute('UPDATE users SET keys_fetched_at = ? WHERE name = ?', (now, username))
+            self._set_meta('refreshed_at', repr(now))
+
+        return RefreshResult(changed, removed, len(listings))
+
+    def usernames(self):
+        """
+        Returns the names of every user in the store.
+        """
+        return [row[0] for row in self._query('SELECT name FROM users ORDER BY name')]
+
+    def get_user(self, username):
+        """
+        Returns a dict of the user's attributes or None if the user is not in the store.
+        """
+        rows = self._query('SELECT data FROM users WHERE name = ?', (username,))
+        return _loads(rows[0][0]) if rows else None
+
+    def get_groups(self, username):
+        """
+        Returns a list of dicts representing each group the user belongs to.
+        """
+        rows = self._query(
+            'SELECT groups.data FROM memberships JOIN groups ON groups.name = memberships.group_name'
+            ' WHERE memberships.username = ? ORDER BY groups.name',
+            (username,)
+        )
+        return [_loads(row[0]) for row in rows]
+
+    def get_group_members(self, group_name):
+        """
+        Returns a list of the names of the users in the given group.
+        """
+        rows = self._query('SELECT username FROM memberships WHERE group_name = ? ORDER BY username', (group_name,))
+        return [row[0] for row in rows]
+
+    def get_access_keys(self, username):
+        """
+        Returns a list of dicts representing the user's access keys. Raises a ValueError
+        if the keys of the user were never listed.
+        """
+        rows = self._query('SELECT keys_fetched_at FROM users WHERE name = ?', (username,))
+        if not rows or rows[0][0] is None:
+            raise ValueError('Access keys of {0} are not in the store'.format(username))
+
+        rows = self._query('SELECT data FROM access_keys WHERE username = ? ORDER BY access_key_id', (username,))
+        return [_loads(row[0]) for row in rows]
+
+    def snapshot(self):
+        """
+        Returns the content of the store as a Snapshot. Access keys are included when
+        the keys of every user have been listed.
+        """
+        users = [_loads(row[0]) for row in self._query('SELECT data FROM users')]
+        groups = [_loads(row[0]) for row in self._query('SELECT data FROM groups')]
+        memberships = self._query('SELECT username, group_name FROM memberships')
+
+        access_keys = None
+        if not self._query('SELECT 1 FROM users WHERE keys_fetched_at IS NULL LIMIT 1'):
+            access_keys = dict((user['UserName'], []) for user in users)
+            for username, data in self._query('SELECT username, data FROM access_keys ORDER BY access_key_id'):
+                access_keys.setdefault(username, []).append(_loads(data))
+
+        return Snapshot(users, groups, memberships, access_keys=access_keys)
+
+    def _merge(self, listing, now):
+        """
+        Writes the new and changed entities of the given Snapshot, deletes those which
+        are gone, and returns the counts of both along with the names of the users whose
+        access keys must be listed again.
+        """
+        known_users = dict(
+            (name, (user_id, create_date, data, keys_fetched_at))
+            for name, user_id, create_date, data, keys_fetched_at
+            in self._db.execute('SELECT name, user_id, create_date, data, keys_fetched_at FROM users')
+        )
+        known_groups = dict(self._db.execute('SELECT name, data FROM groups'))
+        changed = 0
+        stale_keys = []
+
+        for name, user in listing.users.items():
+            data = _dumps(user)
+            identity = (user.get('UserId'), to_epoch(user.get('CreateDate')))
+            known = known_users.pop(name, None)
+
+            if known is not None and known[:2] != identity:
+                # The user was deleted and created again; whatever we knew of them is void
+                self._delete_user(name)
+                known = None
+
+            if known is None or known[2] != data:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO users (name, user_id, create_date, data, keys_fetched_at)'
+                    ' VALUES (?, ?, ?, ?, ?)',
+                    (name,) + identity + (data, known[3] if known is not None else None)
+                )
+                changed += 1
+
+            if known is None or known[3] is None or now - known[3] >= self._ttl:
+                stale_keys.append(name)
+
+        for name, group in listing.groups.items():
+            data = _dumps(group)
+            if known_groups.pop(name, None) != data:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO groups (name, group_id, create_date, data) VALUES (?, ?, ?, ?)',
+                    (name, group.get('GroupId'), to_epoch(group.get('CreateDate')), data)
+                )
+                changed += 1
+
+        for name in known_users:
+            self._delete_user(name)
+        self._db.executemany('DELETE FROM groups WHERE name = ?', [(name,) for name in known_groups])
+
+        # Memberships are small; rewriting them all is cheaper than diffing them
+        self._db.execute('DELETE FROM memberships')
+        self._db.executemany(
+            'INSERT INTO memberships (username, group_name) VALUES (?, ?)',
+            [(username, group_name) for username, names in listing.user_groups.items() for group_name in names]
+        )
+
+        return changed, len(known_users) + len(known_groups), stale_keys
+
+    def _delete_user(self, username):
+        self._db.execute('DELETE FROM users WHERE name = ?', (username,))
+        self._db.execute('DELETE FROM memberships WHERE username = ?', (username,))
+        self._db.execute('DELETE FROM access_keys WHERE username = ?', (username,))
+
+    def _migrate(self):
+        """
+        Creates the tables of the store, or recreates them when they were written with
+        another schema version. The other tables of the database are left alone, but
+        a database whose tables of the same names are not those of a store is refused.
+        """
+        tables = set(row[0] for row in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+        if 'meta' in tables and self._get_meta('schema_version') == str(SCHEMA_VERSION):
+            return
+
+        taken = tables.intersection(_TABLES)
+        if taken and 'meta' not in tables:
+            raise ValueError('Not a state store database, it has tables named {0}'.format(', '.join(sorted(taken))))
+
+        for table in _TABLES:
+            self._db.execute('DROP TABLE IF EXISTS {0}'.format(table))
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._set_meta('schema_version', str(SCHEMA_VERSION))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _get_meta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+
+def _dumps(entity):
+    return json.dumps(
+        dict((key, value.isoformat() if key in _DATE_KEYS and value is not None else value)
+             for key, value in entity.items()),
+        sort_keys=True,
+    )
+
+
+def _loads(data):
+    entity = json.loads(data)
+    for key in _DATE_KEYS:
+        if entity.get(key) is not None:
+            entity[key] = parse_date(entity[key])
+    return entity
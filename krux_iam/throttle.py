@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import random
+import threading
+import time
+
+#
+# Third party libraries
+#
+
+from botocore.exceptions import ClientError, ConnectionClosedError, ReadTimeoutError
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+
+# Error codes AWS uses to signal that the request rate is too high
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+])
+
+# Error codes of failures which are expected to go away on their own
+TRANSIENT_ERROR_CODES = frozenset([
+    'ServiceUnavailable',
+    'ServiceFailure',
+    'InternalFailure',
+    'InternalError',
+    'RequestTimeout',
+    'RequestTimeoutException',
+])
+
+# Network failures on the way to or from AWS, also expected to go away on their own:
+# failing to connect (EndpointConnectionError, ConnectTimeoutError), the response
+# timing out and the connection being dropped mid response
+TRANSIENT_EXCEPTIONS = (BotoConnectionError, ReadTimeoutError, ConnectionClosedError)
+
+# Error code of a request for an entity that does not exist
+NOT_FOUND_ERROR_CODE = 'NoSuchEntity'
+
+# IAM allows a few requests per second per account; these keep a single
+# process comfortably under that while still allowing short bursts.
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+
+def get_error_code(error):
+    """
+    Returns the AWS error code of the given botocore ClientError, or None.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+    return None
+
+
+def is_not_found_error(error):
+    """
+    Returns whether the given exception is AWS reporting that the requested entity does not exist.
+    """
+    return get_error_code(error) == NOT_FOUND_ERROR_CODE
+
+
+def is_throttling_error(error):
+    """
+    Returns whether the given exception is AWS refusing a request because of its rate.
+    """
+    return get_error_code(error) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error):
+    """
+    Returns whether the given exception is a throttling or transient failure that
+    is worth retrying.
+    """
+    if isinstance(error, TRANSIENT_EXCEPTIONS):
+        return True
+
+    if not isinstance(error, ClientError):
+        return False
+
+    if is_throttling_error(error) or get_error_code(error) in TRANSIENT_ERROR_CODES:
+        return True
+
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return status is not None and status >= 500
+
+
+class TokenBucket(object):
+    """
+    A thread safe token bucket limiting the rate of requests. Callers reserve a
+    token with acquire(), which blocks until the token is due, so concurrent
+    callers share one budget and are served in turn.
+
+    The rate adapts to the service: every throttling response reported through
+    on_throttle() halves it (down to min_rate), and every success reported through
+    on_success() raises it back by a small step, up to the configured rate.
+    A rate of None disables limiting altogether.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, min_rate=1.0, recovery=0.1):
+        self._max_rate = rate
+        self._rate = rate
+        self._burst = burst
+        self._min_rate = min(min_rate, rate) if rate else min_rate
+        self._recovery = recovery
+        self._tokens = float(burst)
+        self._last = _monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self):
+        """
+        Takes a token, sleeping until one is available. Returns the number of
+        seconds slept.
+        """
+        if self._rate is None:
+            return 0.0
+
+        with self._lock:
+            now = _monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= 1
+            # A negative balance is a reservation; the caller waits for it outside the lock
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def on_throttle(self):
+        """
+        Reports a throttling response, halving the rate.
+        """
+        if self._rate is None:
+            return
+
+        with self._lock:
+            self._rate = max(self._min_rate, self._rate / 2.0)
+
+    def on_success(self):
+        """
+        Reports a successful request, raising the rate back towards its maximum.
+        """
+        if self._rate is None or self._rate >= self._max_rate:
+            return
+
+        with self._lock:
+            self._rate = min(self._max_rate, self._rate + self._recovery)
+
+
+class DecorrelatedJitter(object):
+    """
+    Backoff delays with "decorrelated jitter": each delay is drawn uniformly
+    between base and three times the previous delay, capped at cap. Retrying
+    clients spread out instead of coming back in lockstep.
+    """
+
+    def __init__(self, base=0.1, cap=20.0):
+        self._base = base
+        self._cap = cap
+
+    def delays(self):
+        """
+        Yields an endless sequence of delays in seconds for one retried call.
+        """
+        delay = self._base
+        while True:
+            delay = min(self._cap, random.uniform(self._base, delay * 3))
+            yield delay
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Returns the process wide TokenBucket shared by every IAM object which is not
+    given a rate limiter of its own.
+    """
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = TokenBucket()
+        return _rate_limiter
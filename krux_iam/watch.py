@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from collections import namedtuple
+import hashlib
+import json
+import zlib
+
+
+USER_ADDED = 'user_added'
+USER_REMOVED = 'user_removed'
+GROUP_ADDED = 'group_added'
+GROUP_REMOVED = 'group_removed'
+MEMBERSHIP_ADDED = 'membership_added'
+MEMBERSHIP_REMOVED = 'membership_removed'
+KEY_CREATED = 'key_created'
+KEY_DELETED = 'key_deleted'
+KEY_STATUS_CHANGED = 'key_status_changed'
+
+# A change to the state of an account seen by a Watcher. type is one of the constants
+# above; username, group_name and key_id are set as they apply to it, and detail holds
+# the attributes of the added user or group or of the created or changed access key.
+Change = namedtuple('Change', ['type', 'username', 'group_name', 'key_id', 'detail'])
+Change.__new__.__defaults__ = (None, None, None, None)
+
+# Average number of users or groups per chunk of the listing, see Watcher
+DEFAULT_CHUNK_SIZE = 100
+
+# The lists of a get_account_authorization_details page a Watcher reads, with the
+# attribute naming their entities
+_DETAIL_LISTS = (('UserDetailList', 'UserName'), ('GroupDetailList', 'GroupName'))
+
+
+class Watcher(object):
+    """
+    Keeps the last known users, groups, group memberships and, with
+    include_access_keys, access keys of an account in memory and reports what changed
+    since the previous poll() as Changes.
+
+    Each poll lists the account with get_account_authorization_details. The listed
+    users and groups are cut into chunks at the entities whose name hashes to a
+    multiple of chunk_size, so where a chunk ends depends on its content and not on
+    its position in the listing: a user added or removed changes the chunk it falls
+    in and leaves the others as they were. A chunk whose content digest was already
+    seen in the previous poll is not looked into, so the work beyond the listing
+    itself grows with the number of changes rather than the size of the account.
+    Access keys are not part of the authorization details; they cost one
+    list_access_keys call per user and poll.
+
+    The first poll records the state of the account, reporting it as added with
+    initial. A removed user's memberships and access keys go without saying and are
+    not reported separately. A poll which fails leaves the known state as it was.
+    """
+
+    def __init__(self, iam, include_access_keys=False, page_size=None, initial=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._iam = iam
+        self._include_access_keys = include_access_keys
+        self._page_size = page_size
+        self._initial = initial
+        self._chunk_size = chunk_size
+        self._polled = False
+        # Digests of the chunks of the previous poll
+        self._chunks = frozenset()
+        # username -> (UserId, frozenset of group names), group name -> GroupId,
+        # username -> dict of access key id to status
+        self._users = {}
+        self._groups = {}
+        self._keys = {}
+
+    def poll(self):
+        """
+        Lists the account and returns a list of the Changes since the previous poll.
+        """
+        saved = dict(self._users), dict(self._groups), dict(self._keys)
+        try:
+            changes = self._poll()
+        except Exception:
+            self._users, self._groups, self._keys = saved
+            raise
+
+        if not self._polled:
+            self._polled = True
+            if not self._initial:
+                changes = []
+
+        self._iam._stats.incr('watch.changes', len(changes))
+        return changes
+
+    def _poll(self):
+        changes = []
+        chunks = set()
+        seen_users = set()
+        seen_groups = set()
+
+        for users, groups, digest in self._iter_chunks():
+            if digest in self._chunks:
+                self._iam._stats.incr('watch.chunks.unchanged')
+            else:
+                self._iam._stats.incr('watch.chunks.changed')
+                for group in groups:
+                    self._diff_group(group, changes)
+                for user in users:
+                    self._diff_user(user, changes)
+
+            seen_users.update(user['UserName'] for user in users)
+            seen_groups.update(group['GroupName'] for group in groups)
+            chunks.add(digest)
+
+        for username in set(self._users) - seen_users:
+            del self._users[username]
+            self._keys.pop(username, None)
+            changes.append(Change(USER_REMOVED, username=username))
+        for group_name in set(self._groups) - seen_groups:
+            del self._groups[group_name]
+            changes.append(Change(GROUP_REMOVED, group_name=group_name))
+
+        if self._include_access_keys:
+            self._diff_access_keys(changes)
+
+        self._chunks = frozenset(chunks)
+        return changes
+
+    def _iter_chunks(self):
+        """
+        Yields the (users, groups, digest) chunks of a listing of the account.
+        """
+        responses = self._iam._iter_pages(
+            'get_account_authorization_details',
+            page_size=self._page_size,
+            Filter=['User', 'Group']
+        )
+
+        users = []
+        groups = []
+        digest = hashlib.sha1()
+        for response in responses:
+            for kind, name_key in _DETAIL_LISTS:
+                for entity in response.get(kind, []):
+                    (users if kind == 'UserDetailList' else groups).append(entity)
+                    digest.update(json.dumps([kind, entity], sort_keys=True, default=str).encode('utf-8'))
+
+                    if zlib.crc32(entity[name_key].encode('utf-8')) % self._chunk_size == 0:
+                        yield users, groups, digest.digest()
+                        users, groups, digest = [], [], hashlib.sha1()
+
+        if users or groups:
+            yield users, groups, digest.digest()
+
+    def _diff_group(self, group, changes):
+        group_name = group['GroupName']
+        group_id = self._groups.get(group_name)
+        if group_id == group['GroupId']:
+            return
+
+        if group_id is not None:
+            # Deleted and created again under the same name
+            changes.append(Change(GROUP_REMOVED, group_name=group_name))
+        self._groups[group_name] = group['GroupId']
+        changes.append(Change(GROUP_ADDED, group_name=group_name, detail=group))
+
+    def _diff_user(self, user, changes):
+        username = user['UserName']
+        group_names = frozenset(user.get('GroupList', []))
+        known = self._users.get(username)
+
+        if known is not None and known[0] != user['UserId']:
+            # Deleted and created again under the same name
+            changes.append(Change(USER_REMOVED, username=username))
+            self._keys.pop(username, None)
+            known = None
+
+        if known is None:
+            changes.append(Change(USER_ADDED, username=username, detail=user))
+            known_groups = frozenset()
+        elif known[1] == group_names:
+            return
+        else:
+            known_groups = known[1]
+
+        self._users[username] = (user['UserId'], group_names)
+        changes.extend(
+            Change(MEMBERSHIP_ADDED, username=username, group_name=group_name)
+            for group_name in sorted(group_names - known_groups)
+        )
+        changes.extend(
+            Change(MEMBERSHIP_REMOVED, username=username, group_name=group_name)
+            for group_name in sorted(known_groups - group_names)
+        )
+
+    def _diff_access_keys(self, changes):
+        """
+        Lists the access keys of every user, max_workers at a time, and reports those
+        created, deleted or activated / deactivated. A user deleted since the listing
+        is left to the next poll.
+        """
+        def list_keys(username):
+            return list(self._iam.iter_access_keys(username, page_size=self._page_size))
+
+        for username, future in self._iam._imap_unordered(list_keys, sorted(self._users)):
+            if future.exception() is not None:
+                self._iam._logger.warning('Failed to list the access keys of %s: %s', username, future.exception())
+                continue
+
+            keys = dict((key['AccessKeyId'], key) for key in future.result())
+            known = self._keys.get(username, {})
+
+            for key_id, key in sorted(keys.items()):
+                status = known.get(key_id)
+                if status is None:
+                    changes.append(Change(KEY_CREATED, username=username, key_id=key_id, detail=key))
+                elif status != key['Status']:
+                    changes.append(Change(KEY_STATUS_CHANGED, username=username, key_id=key_id, detail=key))
+            changes.extend(
+                Change(KEY_DELETED, username=username, key_id=key_id)
+                for key_id in sorted(set(known) - set(keys))
+            )
+
+            self._keys[username] = dict((key_id, key['Status']) for key_id, key in keys.items())
+
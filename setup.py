@@ -34,6 +34,7 @@ setup(
     install_requires = [],
     entry_points     = {
         'console_scripts': [
+            'krux-iam = krux_iam.cli:main',
             'krux-iam-test = krux_iam.cli:main',
         ],
     },
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+# GOTCHA: These tests are written with async syntax, which Python 2 cannot compile, and
+# are therefore loaded by aio_test.py on Python 3.7 or later only.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import asyncio
+import threading
+import time
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_iam.aio import AsyncIAM, get_async_iam, DEFAULT_CONCURRENCY
+
+
+class AsyncIAMTest(unittest.TestCase):
+    TEST_USER = 'jdoe'
+    USER = {'UserName': TEST_USER}
+
+    def setUp(self):
+        self.iam = MagicMock()
+        self.async_iam = AsyncIAM(self.iam, concurrency=2)
+
+    def tearDown(self):
+        self.async_iam.close()
+
+    def collect(self, async_iterator):
+        async def collect():
+            return [item async for item in async_iterator]
+
+        return asyncio.run(collect())
+
+    def test_methods(self):
+        """
+        AsyncIAM coroutines call the matching IAM methods and return their results
+        """
+        self.iam.get_user.return_value = self.USER
+
+        self.assertEqual(self.USER, asyncio.run(self.async_iam.get_user(self.TEST_USER)))
+        asyncio.run(self.async_iam.add_user_to_group(self.TEST_USER, 'group1'))
+        asyncio.run(self.async_iam.delete_user(self.TEST_USER))
+
+        self.iam.get_user.assert_called_once_with(self.TEST_USER, snapshot=None)
+        self.iam.add_user_to_group.assert_called_once_with(self.TEST_USER, 'group1')
+        self.iam.delete_user.assert_called_once_with(self.TEST_USER)
+
+    def test_errors(self):
+        """
+        Exceptions raised by IAM methods propagate out of the coroutines
+        """
+        self.iam.create_user.side_effect = ValueError('exists')
+
+        with self.assertRaises(ValueError):
+            asyncio.run(self.async_iam.create_user(self.TEST_USER))
+
+    def test_iter_groups(self):
+        """
+        AsyncIAM.iter_groups asynchronously iterates over IAM.iter_groups
+        """
+        groups = [{'GroupName': 'group1'}, {'GroupName': 'group2'}]
+        self.iam.iter_groups.return_value = iter(groups)
+
+        self.assertEqual(groups, self.collect(self.async_iam.iter_groups(self.TEST_USER, page_size=1)))
+        self.iam.iter_groups.assert_called_once_with(self.TEST_USER, page_size=1, compact=False)
+
+    def test_concurrency_bound(self):
+        """
+        No more than concurrency calls are in flight at once
+        """
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def get_user(username, snapshot=None):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        self.iam.get_user.side_effect = get_user
+
+        async def run():
+            await asyncio.gather(*[self.async_iam.get_user('user{0}'.format(i)) for i in range(10)])
+
+        asyncio.run(run())
+
+        self.assertEqual(10, self.iam.get_user.call_count)
+        self.assertEqual(2, state['peak'])
+
+    def test_several_event_loops(self):
+        """
+        An AsyncIAM built outside of any event loop serves contended calls from several loops
+        """
+        self.iam.get_user.side_effect = lambda username, snapshot=None: time.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*[self.async_iam.get_user('user{0}'.format(i)) for i in range(5)])
+
+        asyncio.run(run())
+        asyncio.run(run())
+
+        self.assertEqual(10, self.iam.get_user.call_count)
+
+    def test_context_manager(self):
+        """
+        Leaving an async with block shuts the thread pool down
+        """
+        async def run():
+            async with self.async_iam as async_iam:
+                await async_iam.get_user(self.TEST_USER)
+
+        asyncio.run(run())
+
+        with self.assertRaises(RuntimeError):
+            self.async_iam._executor.submit(time.time)
+
+    def test_create_users(self):
+        """
+        AsyncIAM.create_users yields a result per user, failures included
+        """
+        def create(spec):
+            if spec.username == 'user2':
+                raise ValueError('exists')
+            return {'User': {'UserName': spec.username}}
+
+        self.iam._create_user_from_spec.side_effect = create
+
+        results = dict((result.username, result) for result in self.collect(self.async_iam.create_users(['user1', 'user2'])))
+
+        self.assertEqual({'User': {'UserName': 'user1'}}, results['user1'].result)
+        self.assertIsInstance(results['user2'].error, ValueError)
+
+    def test_delete_users(self):
+        """
+        AsyncIAM.delete_users deletes every user
+        """
+        results = self.collect(self.async_iam.delete_users(['user1', 'user2']))
+
+        self.assertEqual(set(['user1', 'user2']), set(result.username for result in results))
+        self.assertEqual(2, self.iam._delete_user_sequentially.call_count)
+
+    def test_add_and_remove_users_to_group(self):
+        """
+        AsyncIAM.add_users_to_group and remove_users_from_group act on every user
+        """
+        added = self.collect(self.async_iam.add_users_to_group('group1', ['user1', 'user2']))
+        removed = self.collect(self.async_iam.remove_users_from_group('group1', ['user1']))
+
+        self.assertEqual(set(['user1', 'user2']), set(result.username for result in added))
+        self.assertEqual(['user1'], [result.username for result in removed])
+        self.iam.add_user_to_group.assert_any_call('user2', 'group1')
+        self.iam.delete_user_from_group.assert_called_once_with('user1', 'group1')
+
+    @patch('krux_iam.aio.get_iam')
+    def test_get_async_iam(self, mock_get_iam):
+        """
+        get_async_iam wraps the IAM object built by get_iam
+        """
+        args = MagicMock()
+        logger = MagicMock()
+        stats = MagicMock()
+
+        async_iam = get_async_iam(args=args, logger=logger, stats=stats)
+
+        mock_get_iam.assert_called_once_with(args=args, logger=logger, stats=stats)
+        self.assertEqual(mock_get_iam.return_value, async_iam._iam)
+        self.assertEqual(DEFAULT_CONCURRENCY, async_iam._concurrency)
+        async_iam.close()
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import sys
+
+#
+# Internal libraries
+#
+
+# krux_iam.aio, and its tests, require Python 3.7 or later
+if sys.version_info >= (3, 7):
+    from .aio_cases import AsyncIAMTest  # noqa: F401
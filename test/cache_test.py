@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import patch
+
+#
+# Internal libraries
+#
+
+from krux_iam.cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = TTLCache(maxsize=2, ttl=10)
+
+    def test_get_set(self):
+        """
+        TTLCache returns stored values and the default for missing keys
+        """
+        self.cache.set('a', 1)
+
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual('default', self.cache.get('b', 'default'))
+
+    @patch('krux_iam.cache._monotonic')
+    def test_expiry(self, mock_monotonic):
+        """
+        TTLCache entries expire ttl seconds after being set
+        """
+        mock_monotonic.return_value = 100
+        self.cache.set('a', 1)
+
+        mock_monotonic.return_value = 109
+        self.assertEqual(1, self.cache.get('a'))
+
+        mock_monotonic.return_value = 110
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_lru_eviction(self):
+        """
+        TTLCache evicts the least recently used entry when full
+        """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(3, self.cache.get('c'))
+
+    def test_invalidate_clear(self):
+        """
+        TTLCache.invalidate removes one entry and TTLCache.clear removes them all
+        """
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+
+        self.cache.invalidate('a')
+        self.cache.invalidate('missing')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(2, self.cache.get('b'))
+
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
@@ -8,6 +8,9 @@
 #
 
 from __future__ import absolute_import
+from argparse import Namespace
+import datetime
+import json
 import unittest
 import sys
 
@@ -15,20 +18,20 @@ import sys
 # Third party libraries
 #
 
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 
 #
 # Internal libraries
 #
 
 from krux_iam.cli import Application, NAME, main
+from krux_iam.iam import UserResult, DEFAULT_MAX_WORKERS
 from krux.stats import DummyStatsClient
 
 
 class CLItest(unittest.TestCase):
 
     USERNAME = 'phan'
-    USER_DATA = 'test_user_data'
 
     def setUp(self):
         self.app = Application()
@@ -49,18 +52,208 @@ class CLItest(unittest.TestCase):
         self.assertIsInstance(app.stats, DummyStatsClient)
         self.assertEqual(NAME, app.logger.name)
 
-        mock_get_iam.assert_called_once_with(app.args, app.logger, app.stats)
+        mock_get_iam.assert_called_once_with(app.args, app.logger, app.stats, max_workers=DEFAULT_MAX_WORKERS)
 
-    @patch('krux_iam.cli.pprint')
-    @patch('krux_iam.cli.IAM.get_user', return_value=USER_DATA)
-    def test_run(self, mock_get_user, mock_pprint):
+    def run_command(self, command, users_command=None, names=(), **kwargs):
         """
-        Test IAM CLI Application run
+        Runs the app with the given arguments and returns the records it writes
         """
+        self.app.args = Namespace(
+            command=command,
+            users_command=users_command,
+            names=list(names),
+            file=None,
+            **kwargs
+        )
+
+        with patch('krux_iam.cli.sys.stdout') as mock_stdout:
+            self.app.run()
+
+        output = ''.join(c[0][0] for c in mock_stdout.write.call_args_list)
+        return [json.loads(line) for line in output.splitlines()]
+
+    def mock_imap(self):
+        """
+        Makes the app's IAM run map_users sequentially
+        """
+        def map_users(func, usernames):
+            for username in usernames:
+                try:
+                    yield UserResult(username, func(username), None)
+                except Exception as error:
+                    yield UserResult(username, None, error)
+
+        self.app.iam = MagicMock()
+        self.app.iam.map_users.side_effect = map_users
+
+    @patch('krux_iam.cli.sys.stdout')
+    def test_run_no_command(self, mock_stdout):
+        """
+        Test that the app prints its help when no command is given
+        """
+        self.app.args = Namespace(command=None)
+        self.app.parser = MagicMock()
+
         self.app.run()
 
-        mock_get_user.assert_called_once_with(self.USERNAME)
-        mock_pprint.assert_called_once_with(self.USER_DATA)
+        self.app.parser.print_help.assert_called_once_with()
+
+    def test_users_list(self):
+        """
+        Test that users list streams every user as a JSON line
+        """
+        self.app.iam = MagicMock()
+        created = datetime.datetime(2016, 1, 2, 3, 4, 5)
+        self.app.iam.iter_users.return_value = iter([
+            {'UserName': 'user1', 'CreateDate': created},
+            {'UserName': 'user2', 'CreateDate': created},
+        ])
+
+        records = self.run_command('users', 'list', page_size=100)
+
+        self.app.iam.iter_users.assert_called_once_with(page_size=100)
+        self.assertEqual(
+            [{'UserName': 'user1', 'CreateDate': created.isoformat()}, {'UserName': 'user2', 'CreateDate': created.isoformat()}],
+            records,
+        )
+
+    def test_users_get(self):
+        """
+        Test that users get writes a record per user, errors included
+        """
+        self.mock_imap()
+        self.app.iam.get_user.side_effect = lambda username: {'UserName': username} if username == 'user1' else self._raise()
+
+        records = self.run_command('users', 'get', names=['user1', 'user2'])
+
+        self.assertEqual([
+            {'UserName': 'user1', 'User': {'UserName': 'user1'}},
+            {'UserName': 'user2', 'Error': 'failed'},
+        ], records)
+
+    @staticmethod
+    def _raise():
+        raise ValueError('failed')
+
+    def test_users_create(self):
+        """
+        Test that users create provisions the users with the given groups and keys
+        """
+        self.app.iam = MagicMock()
+        self.app.iam.create_users.side_effect = lambda specs: [
+            UserResult(spec['username'], {'User': {}, 'Groups': spec['groups'], 'AccessKey': ('123', 'ABC')}, None)
+            for spec in specs
+        ]
+
+        records = self.run_command('users', 'create', names=[self.USERNAME], groups=['group1'], create_access_key=True)
+
+        self.assertEqual([{
+            'UserName': self.USERNAME,
+            'User': {},
+            'Groups': ['group1'],
+            'AccessKeyId': '123',
+            'SecretAccessKey': 'ABC',
+        }], records)
+
+    @patch('krux_iam.cli.sys.stdin', ['user1\n', '\n', '  user2  \n'])
+    def test_users_delete_stdin(self):
+        """
+        Test that users delete reads the usernames from stdin when none are given
+        """
+        self.app.iam = MagicMock()
+        self.app.iam.delete_users.side_effect = lambda names, journal: [
+            UserResult('user1', None, None),
+            UserResult('user2', None, ValueError('failed')),
+        ] if list(names) == ['user1', 'user2'] else []
+
+        records = self.run_command('users', 'delete')
+
+        self.assertEqual([
+            {'UserName': 'user1', 'Deleted': True},
+            {'UserName': 'user2', 'Error': 'failed'},
+        ], records)
+
+    @patch('krux_iam.cli.Journal')
+    def test_users_delete_journal(self, mock_journal):
+        """
+        Test that users delete records its progress in the given journal
+        """
+        self.app.iam = MagicMock()
+        self.app.iam.delete_users.return_value = [UserResult(self.USERNAME, None, None)]
+
+        records = self.run_command('users', 'delete', names=[self.USERNAME], journal='journal.log')
+
+        self.assertEqual([{'UserName': self.USERNAME, 'Deleted': True}], records)
+        mock_journal.assert_called_once_with('journal.log')
+        self.app.iam.delete_users.assert_called_once_with(ANY, journal=mock_journal.return_value.__enter__.return_value)
+        self.assertTrue(mock_journal.return_value.__exit__.called)
+
+    def test_groups(self):
+        """
+        Test that groups writes the group names of each user
+        """
+        self.mock_imap()
+        self.app.iam.get_groups.return_value = [{'GroupName': 'group1'}, {'GroupName': 'group2'}]
+
+        records = self.run_command('groups', names=[self.USERNAME])
+
+        self.assertEqual([{'UserName': self.USERNAME, 'Groups': ['group1', 'group2']}], records)
+
+    def test_keys(self):
+        """
+        Test that keys writes the access keys of each user
+        """
+        self.mock_imap()
+        self.app.iam.get_access_keys.return_value = [{'AccessKeyId': '123'}]
+
+        records = self.run_command('keys', names=[self.USERNAME])
+
+        self.assertEqual([{'UserName': self.USERNAME, 'AccessKeys': [{'AccessKeyId': '123'}]}], records)
+
+    def test_rotate(self):
+        """
+        Test that rotate issues a new key before deleting the old one
+        """
+        self.mock_imap()
+        self.app.iam.get_access_keys.return_value = [{'AccessKeyId': 'old'}]
+        self.app.iam.create_access_keys.return_value = ('new', 'secret')
+
+        records = self.run_command('rotate', names=[self.USERNAME])
+
+        self.app.iam.delete_access_key.assert_called_once_with(self.USERNAME, 'old')
+        self.assertEqual([{
+            'UserName': self.USERNAME,
+            'AccessKeyId': 'new',
+            'SecretAccessKey': 'secret',
+            'DeletedAccessKeyIds': ['old'],
+        }], records)
+
+    def test_rotate_delete_error(self):
+        """
+        Test that rotate still writes out the new key when an old one fails to be deleted
+        """
+        self.mock_imap()
+        self.app.iam.get_access_keys.return_value = [{'AccessKeyId': 'old'}]
+        self.app.iam.create_access_keys.return_value = ('new', 'secret')
+        self.app.iam.delete_access_key.side_effect = RuntimeError('throttled')
+
+        records = self.run_command('rotate', names=[self.USERNAME])
+
+        self.assertEqual('secret', records[0]['SecretAccessKey'])
+        self.assertEqual([], records[0]['DeletedAccessKeyIds'])
+        self.assertIn('old', records[0]['Error'])
+
+    def test_rotate_two_keys(self):
+        """
+        Test that rotate leaves users with two keys alone
+        """
+        self.mock_imap()
+        self.app.iam.get_access_keys.return_value = [{'AccessKeyId': '1'}, {'AccessKeyId': '2'}]
+
+        records = self.run_command('rotate', names=[self.USERNAME])
+
+        self.assertIn('Error', records[0])
+        self.assertFalse(self.app.iam.create_access_keys.called)
 
     def test_main(self):
         """
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import threading
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_iam.client import ClientRegistry, get_client_registry
+
+
+class ClientRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = ClientRegistry()
+
+    def test_get(self):
+        """
+        ClientRegistry creates a client once per key and then reuses it
+        """
+        factory = MagicMock(side_effect=lambda: object())
+
+        first = self.registry.get('key', factory)
+        self.assertIs(first, self.registry.get('key', factory))
+        self.assertIsNot(first, self.registry.get('other', factory))
+        self.assertEqual(2, factory.call_count)
+
+    def test_clear(self):
+        """
+        ClientRegistry.clear forgets every client
+        """
+        factory = MagicMock(side_effect=lambda: object())
+
+        first = self.registry.get('key', factory)
+        self.registry.clear()
+
+        self.assertIsNot(first, self.registry.get('key', factory))
+
+    def test_fork(self):
+        """
+        ClientRegistry does not hand the clients of the parent process to a forked child
+        """
+        factory = MagicMock(side_effect=lambda: object())
+        first = self.registry.get('key', factory)
+
+        with patch('krux_iam.client.os.getpid', return_value=self.registry._pid + 1):
+            self.assertIsNot(first, self.registry.get('key', factory))
+
+    def test_threads(self):
+        """
+        Concurrent callers get the same client
+        """
+        factory = MagicMock(side_effect=lambda: object())
+        clients = []
+
+        threads = [
+            threading.Thread(target=lambda: clients.append(self.registry.get('key', factory)))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(1, factory.call_count)
+        self.assertEqual(1, len(set(id(client) for client in clients)))
+
+    def test_get_client_registry(self):
+        """
+        get_client_registry returns the process wide registry
+        """
+        self.assertIs(get_client_registry(), get_client_registry())
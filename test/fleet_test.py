@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_iam.fleet import Account, Fleet, FleetResult
+from krux_iam.iam import IAM
+from krux_iam.memory import MemoryBackend
+from krux_iam.throttle import TokenBucket
+
+
+class FleetTest(unittest.TestCase):
+    ACCOUNTS = [Account('prod', None, None, None), Account('dev', None, None, None), Account('qa', None, None, None)]
+
+    def setUp(self):
+        self.backends = {}
+        self.fleet = Fleet()
+
+        for i, account in enumerate(self.ACCOUNTS):
+            backend = self.backends[account.name] = MemoryBackend(seed=i)
+            backend.populate(users=i + 1, keys_per_user=1)
+            self.fleet.add(account, iam=IAM(
+                boto=None,
+                logger=MagicMock(),
+                stats=MagicMock(),
+                rate_limiter=TokenBucket(rate=None),
+                client=backend,
+            ))
+
+    @patch('krux_iam.fleet.get_iam')
+    def test_add(self, mock_get_iam):
+        """
+        Fleet builds an IAM per account with its own rate limiter
+        """
+        logger = MagicMock()
+        stats = MagicMock()
+
+        fleet = Fleet(
+            [Account('prod', 'key1', 'secret1', 'us-east-1'), Account('dev', 'key2', 'secret2', 'us-west-2')],
+            logger=logger,
+            stats=stats,
+            rate=5,
+            max_workers=3,
+        )
+
+        self.assertEqual(['prod', 'dev'], fleet.names())
+        self.assertEqual(2, mock_get_iam.call_count)
+        kwargs = mock_get_iam.call_args_list[1][1]
+        self.assertEqual('key2', kwargs['args'].boto_access_key)
+        self.assertEqual('secret2', kwargs['args'].boto_secret_key)
+        self.assertEqual('us-west-2', kwargs['args'].boto_region)
+        self.assertEqual(logger, kwargs['logger'])
+        self.assertEqual(stats, kwargs['stats'])
+        self.assertEqual(3, kwargs['max_workers'])
+        self.assertEqual(5, kwargs['rate_limiter'].rate)
+        self.assertIsNot(mock_get_iam.call_args_list[0][1]['rate_limiter'], kwargs['rate_limiter'])
+        self.assertEqual(mock_get_iam.return_value, fleet['prod'])
+
+    def test_stream(self):
+        """
+        Fleet.stream merges the items of every account
+        """
+        results = list(self.fleet.stream(lambda iam: iam.iter_users()))
+
+        self.assertEqual(6, len(results))
+        self.assertEqual(
+            [('dev', 'user0000000'), ('dev', 'user0000001'), ('prod', 'user0000000'),
+             ('qa', 'user0000000'), ('qa', 'user0000001'), ('qa', 'user0000002')],
+            sorted((result.account, result.result['UserName']) for result in results),
+        )
+
+    def test_stream_errors(self):
+        """
+        Fleet.stream yields the error of an account after its items
+        """
+        error = ValueError('denied')
+
+        def query(iam):
+            yield 'item'
+            if iam is self.fleet['dev']:
+                raise error
+
+        results = list(self.fleet.stream(query, accounts=['prod', 'dev']))
+
+        self.assertEqual(3, len(results))
+        self.assertIn(FleetResult('dev', None, error), results)
+
+    def test_stream_stopped(self):
+        """
+        Stopping a stream early stops the queries
+        """
+        fleet = Fleet(buffer_size=1)
+        for account in self.ACCOUNTS:
+            fleet.add(account, iam=MagicMock())
+
+        def endless(iam):
+            while True:
+                yield 'item'
+
+        stream = fleet.stream(endless)
+        self.assertEqual('item', next(stream).result)
+        stream.close()
+
+    def test_find_user(self):
+        """
+        Fleet.find_user yields the accounts the user exists in
+        """
+        results = list(self.fleet.find_user('user0000001'))
+
+        self.assertEqual(['dev', 'qa'], sorted(result.account for result in results))
+        self.assertTrue(all(result.result['UserName'] == 'user0000001' for result in results))
+
+    def test_stale_keys(self):
+        """
+        Fleet.stale_keys yields the old keys of every account
+        """
+        results = list(self.fleet.stale_keys(0, now=2 ** 32))
+
+        self.assertEqual(6, len(results))
+        self.assertEqual(set(['prod', 'dev', 'qa']), set(result.account for result in results))
+        self.assertEqual([], list(self.fleet.stale_keys(3600)))
+
+    def test_stale_keys_stopped(self):
+        """
+        Stopping Fleet.stale_keys early stops the key listings and leaves the accounts not started alone
+        """
+        backend = MemoryBackend(seed=0)
+        backend.populate(users=200, keys_per_user=1)
+        fleet = Fleet(max_accounts=1, buffer_size=1)
+        for account in self.ACCOUNTS[:2]:
+            fleet.add(account, iam=IAM(
+                boto=None,
+                logger=MagicMock(),
+                stats=MagicMock(),
+                rate_limiter=TokenBucket(rate=None),
+                client=backend,
+                max_workers=2,
+            ))
+
+        stream = fleet.stale_keys(0, now=2 ** 32)
+        self.assertEqual('prod', next(stream).account)
+        stream.close()
+
+        self.assertLess(backend.calls['list_access_keys'], 20)
+        self.assertEqual(1, backend.calls['list_users'])
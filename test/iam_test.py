@@ -8,13 +8,15 @@
 #
 
 from __future__ import absolute_import
+import datetime
+import os
 import unittest
 
 #
 # Third party libraries
 #
 
-from mock import MagicMock, patch, call
+from mock import MagicMock, patch, call, ANY
 import botocore
 
 #
@@ -22,7 +24,15 @@ import botocore
 #
 
 import krux_boto.boto
-from krux_iam.iam import IAM, get_iam, NAME, add_iam_cli_arguments
+from krux_iam.iam import IAM, BatchError, UserResult, UserSpec, get_iam, NAME, add_iam_cli_arguments, DEFAULT_MAX_WORKERS, \
+    NO_BOTOCORE_RETRIES
+from krux_iam.cache import TTLCache
+from krux_iam.client import get_client_registry, DEFAULT_MAX_POOL_CONNECTIONS
+from krux_iam.keys import KeyIndex, KeyInfo, ACTIVE, INACTIVE
+from krux_iam.records import AccessKey, Group, User
+from krux_iam.report import CredentialReportTimeout
+from krux_iam.snapshot import Snapshot
+from krux_iam.throttle import TokenBucket, get_rate_limiter
 
 
 class IAMtest(unittest.TestCase):
@@ -38,20 +48,30 @@ class IAMtest(unittest.TestCase):
     GROUPS_RESPONSE = {'Groups': [{'GroupName': 'group1'}, {'GroupName': 'group2'}, {'GroupName': 'group3'}]}
     KEY_LIST = [{'AccessKeyId': '123'}, {'AccessKeyId': '456'}, {'AccessKeyId': '789'}]
     ERROR_DICT = {'Error': {}}
+    NOT_FOUND_ERROR_DICT = {'Error': {'Code': 'NoSuchEntity'}}
+    THROTTLING_ERROR_DICT = {'Error': {'Code': 'Throttling'}}
+    NOW = 1000000000
 
-    @patch('krux_iam.iam.get_stats')
-    @patch('krux_iam.iam.get_logger')
+    @patch('krux.stats.get_stats')
+    @patch('krux.logging.get_logger')
     def setUp(self, mock_logger, mock_stats):
+        get_client_registry().clear()
         self.logger = mock_logger()
         self.stats = mock_stats()
         self.boto = krux_boto.boto.Boto3(region=self.TEST_REGION)
         self.boto.client = MagicMock()
+        self.rate_limiter = TokenBucket(rate=None)
         self.iam = IAM(
             boto=self.boto,
             logger=self.logger,
-            stats=self.stats
+            stats=self.stats,
+            rate_limiter=self.rate_limiter,
         )
 
+    @staticmethod
+    def _raise(error):
+        raise error
+
     def test_init(self):
         """
         Tests IAM init with logger and stats passed in
@@ -59,10 +79,12 @@ class IAMtest(unittest.TestCase):
         self.assertIn(NAME, self.iam._name)
         self.assertEqual(self.logger, self.iam._logger)
         self.assertEqual(self.stats, self.iam._stats)
+        self.assertEqual(DEFAULT_MAX_WORKERS, self.iam._max_workers)
+        self.assertEqual(self.rate_limiter, self.iam._rate_limiter)
         self.assertEqual(self.boto.client.return_value, self.iam._client)
 
-    @patch('krux_iam.iam.get_stats')
-    @patch('krux_iam.iam.get_logger')
+    @patch('krux.stats.get_stats')
+    @patch('krux.logging.get_logger')
     def test_empty_init(self, mock_logger, mock_stats):
         """
         Test IAM init with no logger or stats passed in
@@ -71,22 +93,25 @@ class IAMtest(unittest.TestCase):
         boto.client = MagicMock()
         iam = IAM(boto=boto)
 
+        self.assertFalse(boto.client.called)
         self.assertIn(NAME, iam._name)
 
         mock_logger.assert_called_once_with(NAME)
         mock_stats.assert_called_once_with(prefix=NAME)
         self.assertEqual(mock_logger.return_value, iam._logger)
         self.assertEqual(mock_stats.return_value, iam._stats)
+        self.assertEqual(get_rate_limiter(), iam._rate_limiter)
 
-        boto.client.assert_called_once_with(IAM._IAM_STR)
         self.assertEqual(boto.client.return_value, iam._client)
+        boto.client.assert_called_once_with(IAM._IAM_STR, config=ANY)
+        self.assertEquals(NO_BOTOCORE_RETRIES, boto.client.call_args[1]['config'].retries)
 
-    @patch('krux_iam.iam.Boto3')
+    @patch('krux_boto.boto.Boto3')
     @patch('krux_iam.iam.IAM')
     @patch('krux_iam.iam.add_iam_cli_arguments')
-    @patch('krux_iam.iam.get_parser')
-    @patch('krux_iam.iam.get_stats')
-    @patch('krux_iam.iam.get_logger')
+    @patch('krux.cli.get_parser')
+    @patch('krux.stats.get_stats')
+    @patch('krux.logging.get_logger')
     def test_get_iam_none(self, mock_logger, mock_stats, mock_parser, mock_add_args, mock_iam, mock_boto):
         """
         Test get_iam when no arguments are passed in
@@ -105,6 +130,17 @@ class IAMtest(unittest.TestCase):
         mock_logger.assert_called_once_with(name=NAME)
         mock_stats.assert_called_once_with(prefix=NAME)
 
+        mock_iam.assert_called_once_with(
+            boto=None,
+            logger=mock_logger.return_value,
+            stats=mock_stats.return_value,
+            client_factory=ANY,
+        )
+        self.assertEquals(mock_iam.return_value, iam)
+        self.assertFalse(mock_boto.called)
+
+        client = mock_iam.call_args[1]['client_factory']()
+
         mock_boto.assert_called_once_with(
             log_level=args.boto_log_level,
             access_key=args.boto_access_key,
@@ -114,19 +150,18 @@ class IAMtest(unittest.TestCase):
             stats=mock_stats.return_value,
         )
 
-        mock_iam.assert_called_once_with(
-            boto=mock_boto.return_value,
-            logger=mock_logger.return_value,
-            stats=mock_stats.return_value
-        )
-        self.assertEquals(mock_iam.return_value, iam)
+        mock_boto.return_value.client.assert_called_once_with(mock_iam._IAM_STR, config=ANY)
+        config = mock_boto.return_value.client.call_args[1]['config']
+        self.assertEquals(args.iam_max_pool_connections, config.max_pool_connections)
+        self.assertEquals(NO_BOTOCORE_RETRIES, config.retries)
+        self.assertEquals(mock_boto.return_value.client.return_value, client)
 
-    @patch('krux_iam.iam.Boto3')
+    @patch('krux_boto.boto.Boto3')
     @patch('krux_iam.iam.IAM')
     @patch('krux_iam.iam.add_iam_cli_arguments')
-    @patch('krux_iam.iam.get_parser')
-    @patch('krux_iam.iam.get_stats')
-    @patch('krux_iam.iam.get_logger')
+    @patch('krux.cli.get_parser')
+    @patch('krux.stats.get_stats')
+    @patch('krux.logging.get_logger')
     def test_get_iam_all(self, mock_logger, mock_stats, mock_parser, mock_add_args, mock_iam, mock_boto):
         """
         Test get_iam when all arguments are passed in
@@ -146,6 +181,15 @@ class IAMtest(unittest.TestCase):
         self.assertFalse(mock_logger.called)
         self.assertFalse(mock_stats.called)
 
+        mock_iam.assert_called_once_with(
+            boto=None,
+            logger=logger,
+            stats=stats,
+            client_factory=ANY,
+        )
+
+        mock_iam.call_args[1]['client_factory']()
+
         mock_boto.assert_called_once_with(
             log_level=args.boto_log_level,
             access_key=args.boto_access_key,
@@ -155,14 +199,111 @@ class IAMtest(unittest.TestCase):
             stats=stats,
         )
 
-        mock_iam.assert_called_once_with(
-            boto=mock_boto.return_value,
-            logger=logger,
-            stats=stats
-        )
+    @patch('krux_boto.boto.Boto3')
+    @patch('krux_iam.iam.IAM')
+    def test_get_iam_kwargs(self, mock_iam, mock_boto):
+        """
+        Test that get_iam passes extra keyword arguments on to IAM
+        """
+        args = MagicMock()
+        logger = MagicMock()
+        stats = MagicMock()
+
+        get_iam(args=args, logger=logger, stats=stats, max_workers=3)
+
+        self.assertEquals(3, mock_iam.call_args[1]['max_workers'])
+
+    @patch('krux_boto.boto.Boto3')
+    def test_get_iam_fork(self, mock_boto):
+        """
+        Test that an IAM object of get_iam gets a new client from the registry in a forked child
+        """
+        mock_boto.return_value.client.side_effect = lambda *args, **kwargs: MagicMock()
+        args = MagicMock(boto_access_key='key', boto_secret_key='secret', boto_region=self.TEST_REGION)
+
+        iam = get_iam(args=args, logger=MagicMock(), stats=MagicMock())
+        parent_client = iam._client
+
+        with patch('os.getpid', return_value=os.getpid() + 1):
+            child_client = iam._client
+            self.assertIs(child_client, get_iam(args=args, logger=MagicMock(), stats=MagicMock())._client)
+
+        self.assertIsNot(parent_client, child_client)
+
+    @patch('krux_boto.boto.Boto3')
+    @patch('krux_iam.iam.IAM')
+    def test_get_iam_shared_client(self, mock_iam, mock_boto):
+        """
+        Test that get_iam reuses the Boto3 object and client of earlier calls with the same credentials and region
+        """
+        args = MagicMock(boto_access_key='key', boto_secret_key='secret', boto_region=self.TEST_REGION)
+        other_args = MagicMock(boto_access_key='key', boto_secret_key='secret', boto_region='us-east-1')
+        logger = MagicMock()
+        stats = MagicMock()
+
+        def client(get_args):
+            get_iam(args=get_args, logger=logger, stats=stats)
+            return mock_iam.call_args[1]['client_factory']()
+
+        self.assertEquals(client(args), client(args))
+        self.assertEquals(1, mock_boto.call_count)
+
+        client(other_args)
+        self.assertEquals(2, mock_boto.call_count)
 
-    @patch('krux_iam.iam.get_group')
-    @patch('krux_iam.iam.add_boto_cli_arguments')
+    def test_lazy_client(self):
+        """
+        Test that IAM creates its client with client_factory on the first API call only
+        """
+        factory = MagicMock()
+        factory.return_value.get_user.return_value = self.USER_RESPONSE
+
+        iam = IAM(boto=None, logger=self.logger, stats=self.stats, rate_limiter=self.rate_limiter, client_factory=factory)
+
+        self.assertFalse(factory.called)
+
+        iam.get_user(self.TEST_USER)
+        iam.get_user(self.TEST_USER)
+
+        factory.assert_called_once_with()
+        self.assertEquals(2, factory.return_value.get_user.call_count)
+
+    def test_lazy_client_fork(self):
+        """
+        Test that IAM creates its client again with client_factory in a forked child, and keeps a given client
+        """
+        factory = MagicMock(side_effect=lambda: MagicMock())
+        iam = IAM(boto=None, logger=self.logger, stats=self.stats, rate_limiter=self.rate_limiter, client_factory=factory)
+
+        parent_client = iam._client
+        self.assertIs(parent_client, iam._client)
+
+        with patch('krux_iam.iam.os.getpid', return_value=iam._client_pid + 1):
+            child_client = iam._client
+            self.assertIs(child_client, iam._client)
+
+        self.assertIsNot(parent_client, child_client)
+        self.assertEquals(2, factory.call_count)
+
+        given = MagicMock()
+        iam = IAM(boto=None, logger=self.logger, stats=self.stats, rate_limiter=self.rate_limiter, client=given)
+        with patch('krux_iam.iam.os.getpid', return_value=os.getpid() + 1):
+            self.assertIs(given, iam._client)
+
+    def test_init_with_client(self):
+        """
+        Test that IAM uses a given client instead of creating one
+        """
+        boto = MagicMock()
+        client = MagicMock()
+
+        iam = IAM(boto=boto, logger=self.logger, stats=self.stats, client=client)
+
+        self.assertEqual(client, iam._client)
+        self.assertFalse(boto.client.called)
+
+    @patch('krux.cli.get_group')
+    @patch('krux_boto.boto.add_boto_cli_arguments')
     def test_get_cli_arguments(self, mock_add_boto, mock_get_group):
         """
         Test add_iam_cli_arguments
@@ -173,9 +314,15 @@ class IAMtest(unittest.TestCase):
 
         mock_add_boto.assert_called_once_with(parser)
         mock_get_group.assert_called_once_with(parser, NAME)
+        mock_get_group.return_value.add_argument.assert_called_once_with(
+            '--iam-max-pool-connections',
+            type=int,
+            default=DEFAULT_MAX_POOL_CONNECTIONS,
+            help=ANY,
+        )
 
-    @patch('krux_iam.iam.get_group')
-    @patch('krux_iam.iam.add_boto_cli_arguments')
+    @patch('krux.cli.get_group')
+    @patch('krux_boto.boto.add_boto_cli_arguments')
     def test_get_cli_arguments_no_boto(self, mock_add_boto, mock_get_group):
         """
         Test add_iam_cli_arguments with include_boto_arguments = False
@@ -209,6 +356,91 @@ class IAMtest(unittest.TestCase):
         self.iam._client.list_access_keys.assert_called_once_with(UserName=self.TEST_USER)
         self.assertEquals(self.GET_KEY_RESPONSE['AccessKeyMetadata'], keys)
 
+    @patch('krux_iam.iam.time.sleep')
+    def test_call_retries_throttling(self, mock_sleep):
+        """
+        Test that a throttled call is retried, slows down the rate limiter and is reported to stats
+        """
+        self.iam._rate_limiter = MagicMock()
+        self.iam._client.create_user = MagicMock(side_effect=[
+            botocore.exceptions.ClientError(self.THROTTLING_ERROR_DICT, 'create_user'),
+            botocore.exceptions.ClientError(self.THROTTLING_ERROR_DICT, 'create_user'),
+            self.USER_RESPONSE,
+        ])
+
+        user = self.iam.create_user(self.TEST_USER)
+
+        self.assertEquals(self.USER_RESPONSE['User'], user)
+        self.assertEquals(3, self.iam._client.create_user.call_count)
+        self.assertEquals(3, self.iam._rate_limiter.acquire.call_count)
+        self.assertEquals(2, self.iam._rate_limiter.on_throttle.call_count)
+        self.iam._rate_limiter.on_success.assert_called_once_with()
+        self.assertEquals(2, mock_sleep.call_count)
+        self.assertEquals(2, self.stats.incr.call_args_list.count(call('retry.create_user')))
+        self.assertEquals(2, len([c for c in self.stats.timing.call_args_list if c[0][0] == 'retry_sleep.create_user']))
+
+    @patch('krux_iam.iam.time.sleep')
+    def test_call_gives_up(self, mock_sleep):
+        """
+        Test that a call which keeps being throttled raises after max_retries retries
+        """
+        self.iam._max_retries = 2
+        error = botocore.exceptions.ClientError(self.THROTTLING_ERROR_DICT, 'create_user')
+        self.iam._client.create_user = MagicMock(side_effect=error)
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.iam.create_user(self.TEST_USER)
+
+        self.assertEquals(3, self.iam._client.create_user.call_count)
+        self.assertEquals(2, mock_sleep.call_count)
+
+    @patch('krux_iam.iam.time.sleep')
+    def test_call_does_not_retry_client_errors(self, mock_sleep):
+        """
+        Test that errors which are not throttling or transient are raised straight away
+        """
+        error = botocore.exceptions.ClientError({'Error': {'Code': 'EntityAlreadyExists'}}, 'create_user')
+        self.iam._client.create_user = MagicMock(side_effect=error)
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.iam.create_user(self.TEST_USER)
+
+        self.iam._client.create_user.assert_called_once_with(UserName=self.TEST_USER)
+        self.assertFalse(mock_sleep.called)
+
+    def test_iter_access_keys_paginated(self):
+        """
+        Test that iter_access_keys follows the Marker until the listing is no longer truncated
+        """
+        self.iam._client.list_access_keys = MagicMock(side_effect=[
+            {'AccessKeyMetadata': self.KEY_LIST[:2], 'IsTruncated': True, 'Marker': 'page2'},
+            {'AccessKeyMetadata': self.KEY_LIST[2:], 'IsTruncated': False},
+        ])
+
+        keys = list(self.iam.iter_access_keys(self.TEST_USER, page_size=2))
+
+        self.assertEquals(self.KEY_LIST, keys)
+        self.iam._client.list_access_keys.assert_has_calls([
+            call(UserName=self.TEST_USER, MaxItems=2),
+            call(UserName=self.TEST_USER, MaxItems=2, Marker='page2'),
+        ])
+
+    def test_iter_access_keys_lazy(self):
+        """
+        Test that iter_access_keys does not request the next page until the current one is consumed
+        """
+        self.iam._client.list_access_keys = MagicMock(side_effect=[
+            {'AccessKeyMetadata': self.KEY_LIST[:2], 'IsTruncated': True, 'Marker': 'page2'},
+            {'AccessKeyMetadata': self.KEY_LIST[2:], 'IsTruncated': False},
+        ])
+
+        keys = self.iam.iter_access_keys(self.TEST_USER)
+        self.assertFalse(self.iam._client.list_access_keys.called)
+
+        self.assertEquals(self.KEY_LIST[0], next(keys))
+        self.assertEquals(self.KEY_LIST[1], next(keys))
+        self.assertEquals(1, self.iam._client.list_access_keys.call_count)
+
     def test_delete_access_key(self):
         """
         Test that checks if client.delete_access_key is called correctly
@@ -220,6 +452,129 @@ class IAMtest(unittest.TestCase):
             AccessKeyId=self.ACCESS_KEY
         )
 
+    def test_update_access_key_status(self):
+        """
+        Test that update_access_key_status calls client.update_access_key
+        """
+        self.iam.update_access_key_status(self.TEST_USER, self.ACCESS_KEY, 'Inactive')
+
+        self.iam._client.update_access_key.assert_called_once_with(
+            UserName=self.TEST_USER,
+            AccessKeyId=self.ACCESS_KEY,
+            Status='Inactive'
+        )
+
+    def test_get_access_key_last_used(self):
+        """
+        Test that get_access_key_last_used returns the AccessKeyLastUsed of the response
+        """
+        self.iam._client.get_access_key_last_used = MagicMock(
+            return_value={'UserName': self.TEST_USER, 'AccessKeyLastUsed': {'Region': 'N/A'}}
+        )
+
+        self.assertEquals({'Region': 'N/A'}, self.iam.get_access_key_last_used(self.ACCESS_KEY))
+        self.iam._client.get_access_key_last_used.assert_called_once_with(AccessKeyId=self.ACCESS_KEY)
+
+    def rotation_index(self):
+        day = 86400
+        return KeyIndex([
+            # Rotated
+            KeyInfo('user1', 'old1', ACTIVE, self.NOW - 100 * day, None),
+            # Rotated after deleting the inactive key to make room
+            KeyInfo('user2', 'old2', ACTIVE, self.NOW - 100 * day, None),
+            KeyInfo('user2', 'inactive2', INACTIVE, self.NOW - 200 * day, None),
+            # Skipped, both keys are active
+            KeyInfo('user3', 'old3', ACTIVE, self.NOW - 100 * day, None),
+            KeyInfo('user3', 'new3', ACTIVE, self.NOW - day, None),
+            # Not old enough
+            KeyInfo('user4', 'new4', ACTIVE, self.NOW - day, None),
+        ])
+
+    def test_rotate_keys(self):
+        """
+        Test that rotate_keys replaces the old keys, hands the secrets to the sink and deactivates the old keys
+        """
+        index = self.rotation_index()
+        sink = MagicMock()
+        self.iam._client.create_access_key = MagicMock(side_effect=lambda UserName: {
+            'AccessKey': {'AccessKeyId': UserName + '-new', 'SecretAccessKey': UserName + '-secret'},
+        })
+
+        results = dict((result.username, result) for result in self.iam.rotate_keys(
+            30 * 86400, sink, index=index, now=self.NOW,
+        ))
+
+        self.assertEquals(set(['user1', 'user2', 'user3']), set(results))
+        self.assertEquals('user1-new', results['user1'].new_access_key_id)
+        self.assertEquals(['old1'], results['user1'].old_access_key_ids)
+        self.assertIsNone(results['user2'].error)
+        self.assertIsInstance(results['user3'].error, ValueError)
+        self.assertIsNone(results['user3'].new_access_key_id)
+
+        sink.assert_has_calls([
+            call('user1', 'user1-new', 'user1-secret'),
+            call('user2', 'user2-new', 'user2-secret'),
+        ], any_order=True)
+        self.assertEquals(2, sink.call_count)
+
+        self.iam._client.delete_access_key.assert_called_once_with(UserName='user2', AccessKeyId='inactive2')
+        self.iam._client.update_access_key.assert_has_calls([
+            call(UserName='user1', AccessKeyId='old1', Status=INACTIVE),
+            call(UserName='user2', AccessKeyId='old2', Status=INACTIVE),
+        ], any_order=True)
+        self.assertEquals(2, self.iam._client.update_access_key.call_count)
+
+        self.assertEquals(INACTIVE, index.get('old1').status)
+        self.assertEquals(ACTIVE, index.get('user1-new').status)
+        self.assertIsNone(index.get('inactive2'))
+
+    def test_rotate_keys_delete(self):
+        """
+        Test that rotate_keys with delete_old_keys deletes the deactivated keys
+        """
+        index = self.rotation_index()
+        self.iam._client.create_access_key = MagicMock(return_value=self.CREATE_KEY_RESPONSE)
+
+        self.iam.rotate_keys(30 * 86400, MagicMock(), usernames=['user1'], index=index, delete_old_keys=True, now=self.NOW)
+
+        self.iam._client.update_access_key.assert_called_once_with(UserName='user1', AccessKeyId='old1', Status=INACTIVE)
+        self.iam._client.delete_access_key.assert_called_once_with(UserName='user1', AccessKeyId='old1')
+        self.assertIsNone(index.get('old1'))
+
+    def test_rotate_keys_usernames_generator(self):
+        """
+        Test that rotate_keys lists and rotates the keys of users given by a generator
+        """
+        self.iam._client.list_access_keys = MagicMock(side_effect=lambda UserName: {'AccessKeyMetadata': [{
+            'UserName': UserName,
+            'AccessKeyId': UserName + '-old',
+            'Status': ACTIVE,
+            'CreateDate': datetime.datetime(2000, 1, 1),
+        }]})
+        self.iam._client.create_access_key = MagicMock(side_effect=lambda UserName: {
+            'AccessKey': {'AccessKeyId': UserName + '-new', 'SecretAccessKey': UserName + '-secret'},
+        })
+
+        results = self.iam.rotate_keys(
+            30 * 86400, MagicMock(), usernames=(name for name in ['user1', 'user2']), now=self.NOW,
+        )
+
+        self.assertEquals(['user1', 'user2'], sorted(result.username for result in results))
+        self.assertEquals(2, self.iam._client.list_access_keys.call_count)
+
+    def test_rotate_keys_sink_error(self):
+        """
+        Test that a failing sink leaves the old keys active and deletes the new key
+        """
+        self.iam._client.create_access_key = MagicMock(return_value=self.CREATE_KEY_RESPONSE)
+        sink = MagicMock(side_effect=IOError('vault down'))
+
+        results = self.iam.rotate_keys(30 * 86400, sink, usernames=['user1'], index=self.rotation_index(), now=self.NOW)
+
+        self.assertIsInstance(results[0].error, IOError)
+        self.iam._client.delete_access_key.assert_called_once_with(UserName='user1', AccessKeyId=self.ACCESS_KEY)
+        self.assertFalse(self.iam._client.update_access_key.called)
+
     def test_create_user(self):
         """
         Test that checks if client.create_user is called correctly and create_user returns a user dict
@@ -248,7 +603,7 @@ class IAMtest(unittest.TestCase):
         for group in groups:
             calls.append(call(self.TEST_USER, group['GroupName']))
 
-        mock_delete_from_group.assert_has_calls(calls)
+        mock_delete_from_group.assert_has_calls(calls, any_order=True)
         self.assertEquals(len(groups), mock_delete_from_group.call_count)
 
         mock_get_keys.assert_called_once_with(self.TEST_USER)
@@ -257,11 +612,125 @@ class IAMtest(unittest.TestCase):
         for key in keys:
             calls.append(call(self.TEST_USER, key['AccessKeyId']))
 
-        mock_delete_keys.assert_has_calls(calls)
+        mock_delete_keys.assert_has_calls(calls, any_order=True)
         self.assertEquals(len(keys), mock_delete_keys.call_count)
 
         self.iam._client.delete_user.assert_called_once_with(UserName=self.TEST_USER)
 
+    @patch('krux_iam.iam.IAM.delete_access_key', side_effect=[None, ValueError('key'), None])
+    @patch('krux_iam.iam.IAM.get_access_keys', return_value=KEY_LIST)
+    @patch('krux_iam.iam.IAM.delete_user_from_group', side_effect=[ValueError('group'), None, None])
+    @patch('krux_iam.iam.IAM.get_groups', return_value=GROUPS_RESPONSE['Groups'])
+    def test_delete_user_errors(self, mock_get_groups, mock_delete_from_group, mock_get_keys, mock_delete_keys):
+        """
+        Test that delete_user attempts every removal, reports all failures together and keeps the user
+        """
+        with self.assertRaises(BatchError) as context:
+            self.iam.delete_user(self.TEST_USER)
+
+        self.assertEquals(2, len(context.exception.errors))
+        self.assertEquals(len(mock_get_groups.return_value), mock_delete_from_group.call_count)
+        self.assertEquals(len(mock_get_keys.return_value), mock_delete_keys.call_count)
+        self.assertFalse(self.iam._client.delete_user.called)
+
+    @patch('krux_iam.iam.IAM.get_access_keys', return_value=[])
+    @patch('krux_iam.iam.IAM.get_groups', return_value=[])
+    def test_delete_user_no_dependents(self, mock_get_groups, mock_get_keys):
+        """
+        Test that delete_user deletes a user without groups or keys straight away
+        """
+        self.iam.delete_user(self.TEST_USER)
+
+        self.iam._client.delete_user.assert_called_once_with(UserName=self.TEST_USER)
+
+    @patch('krux_iam.iam.IAM.create_access_keys', return_value=(ACCESS_KEY, SECRET_KEY))
+    @patch('krux_iam.iam.IAM.add_user_to_group')
+    @patch('krux_iam.iam.IAM.create_user', side_effect=lambda username: {'UserName': username})
+    def test_create_users(self, mock_create_user, mock_add_to_group, mock_create_keys):
+        """
+        Test that create_users provisions every spec and yields a result per user
+        """
+        specs = [
+            UserSpec('user1', groups=['group1', 'group2'], create_access_key=True),
+            {'username': 'user2', 'groups': ['group1']},
+            'user3',
+        ]
+
+        results = dict((result.username, result) for result in self.iam.create_users(specs))
+
+        self.assertEquals(set(['user1', 'user2', 'user3']), set(results))
+        self.assertEquals(
+            {'User': {'UserName': 'user1'}, 'Groups': ['group1', 'group2'], 'AccessKey': (self.ACCESS_KEY, self.SECRET_KEY)},
+            results['user1'].result,
+        )
+        self.assertEquals({'User': {'UserName': 'user3'}, 'Groups': [], 'AccessKey': None}, results['user3'].result)
+        self.assertTrue(all(result.error is None for result in results.values()))
+
+        mock_add_to_group.assert_has_calls([
+            call('user1', 'group1'),
+            call('user1', 'group2'),
+            call('user2', 'group1'),
+        ], any_order=True)
+        mock_create_keys.assert_called_once_with('user1')
+
+    @patch('krux_iam.iam.IAM.create_user')
+    def test_create_users_error(self, mock_create_user):
+        """
+        Test that a failed user is reported in its result without stopping the others
+        """
+        error = ValueError('exists')
+        mock_create_user.side_effect = lambda username: self._raise(error) if username == 'user1' else {}
+
+        results = dict((result.username, result) for result in self.iam.create_users(['user1', 'user2']))
+
+        self.assertEquals(error, results['user1'].error)
+        self.assertIsNone(results['user1'].result)
+        self.assertIsNone(results['user2'].error)
+
+    @patch('krux_iam.iam.IAM.get_access_keys', return_value=[])
+    @patch('krux_iam.iam.IAM.get_groups', return_value=[])
+    def test_delete_users(self, mock_get_groups, mock_get_keys):
+        """
+        Test that delete_users deletes every user and yields a result per user
+        """
+        usernames = ['user{0}'.format(i) for i in range(DEFAULT_MAX_WORKERS * 3)]
+
+        results = list(self.iam.delete_users(usernames))
+
+        self.assertEquals(set(usernames), set(result.username for result in results))
+        self.assertTrue(all(result.error is None for result in results))
+        self.iam._client.delete_user.assert_has_calls([call(UserName=name) for name in usernames], any_order=True)
+
+    def test_delete_users_stop_early(self):
+        """
+        Test that delete_users only takes usernames as workers free up, so stopping early leaves the rest alone
+        """
+        self.iam._max_workers = 1
+        self.iam._delete_user_sequentially = MagicMock()
+
+        results = self.iam.delete_users(['user1', 'user2', 'user3'])
+        self.assertEquals('user1', next(results).username)
+        results.close()
+
+        self.assertNotIn(call('user3'), self.iam._delete_user_sequentially.call_args_list)
+
+    def test_iter_users(self):
+        """
+        Test that iter_users pages through client.list_users
+        """
+        self.iam._client.list_users = MagicMock(side_effect=[
+            {'Users': [{'UserName': 'user1'}], 'IsTruncated': True, 'Marker': 'page2'},
+            {'Users': [{'UserName': 'user2'}], 'IsTruncated': False},
+        ])
+
+        users = list(self.iam.iter_users(page_size=1))
+
+        self.assertEquals([{'UserName': 'user1'}, {'UserName': 'user2'}], users)
+        self.iam._client.list_users.assert_has_calls([
+            call(MaxItems=1),
+            call(MaxItems=1, Marker='page2'),
+        ])
+
     def test_get_user(self):
         """
         Test that checks if client.get_user is called correctly and get_user returns a user dict
@@ -275,15 +744,83 @@ class IAMtest(unittest.TestCase):
 
     def test_get_user_error(self):
         """
-        Test that checks when client.get_user throws an error, if it's handled properly
+        Test that checks when client.get_user reports the user doesn't exist, None is returned
         """
-        self.iam._client.get_user = MagicMock(side_effect=botocore.exceptions.ClientError(self.ERROR_DICT, 'error'))
+        self.iam._client.get_user = MagicMock(
+            side_effect=botocore.exceptions.ClientError(self.NOT_FOUND_ERROR_DICT, 'error')
+        )
 
         user = self.iam.get_user(self.TEST_USER)
 
         self.assertTrue(self.iam._client.get_user.called)
         self.assertEquals(None, user)
 
+    def test_get_user_other_error(self):
+        """
+        Test that errors other than NoSuchEntity are raised by get_user rather than reported as a missing user
+        """
+        self.iam._client.get_user = MagicMock(side_effect=botocore.exceptions.ClientError(self.ERROR_DICT, 'error'))
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.iam.get_user(self.TEST_USER)
+
+    @patch('krux_iam.iam.time.sleep')
+    def test_get_user_retries_throttling(self, mock_sleep):
+        """
+        Test that a throttled get_user is retried instead of being reported as a missing user
+        """
+        self.iam._client.get_user = MagicMock(side_effect=[
+            botocore.exceptions.ClientError(self.THROTTLING_ERROR_DICT, 'error'),
+            self.USER_RESPONSE,
+        ])
+
+        self.assertEquals(self.USER_RESPONSE['User'], self.iam.get_user(self.TEST_USER))
+        self.assertEquals(2, self.iam._client.get_user.call_count)
+
+    def test_get_user_negative_cache(self):
+        """
+        Test that a missing user is remembered until it is created
+        """
+        self.iam._client.get_user = MagicMock(
+            side_effect=botocore.exceptions.ClientError(self.NOT_FOUND_ERROR_DICT, 'error')
+        )
+        self.iam._client.create_user = MagicMock(return_value=self.USER_RESPONSE)
+
+        self.assertIsNone(self.iam.get_user(self.TEST_USER))
+        self.assertIsNone(self.iam.get_user(self.TEST_USER))
+        self.iam._client.get_user.assert_called_once_with(UserName=self.TEST_USER)
+        self.assertEquals(1, self.stats.incr.call_args_list.count(call('cache.hit.missing_user')))
+
+        self.iam.create_user(self.TEST_USER)
+        self.iam._client.get_user = MagicMock(return_value=self.USER_RESPONSE)
+
+        self.assertEquals(self.USER_RESPONSE['User'], self.iam.get_user(self.TEST_USER))
+
+    @patch('krux_iam.iam.IAM.get_access_keys', return_value=[])
+    @patch('krux_iam.iam.IAM.get_groups', return_value=[])
+    def test_delete_user_negative_cache(self, mock_get_groups, mock_get_keys):
+        """
+        Test that a deleted user is remembered as missing
+        """
+        self.iam.delete_user(self.TEST_USER)
+
+        self.assertIsNone(self.iam.get_user(self.TEST_USER))
+        self.assertFalse(self.iam._client.get_user.called)
+
+    def test_get_user_negative_cache_disabled(self):
+        """
+        Test that a negative_cache_ttl of 0 turns off the negative cache
+        """
+        iam = IAM(boto=self.boto, logger=self.logger, stats=self.stats, negative_cache_ttl=0)
+        iam._client.get_user = MagicMock(
+            side_effect=botocore.exceptions.ClientError(self.NOT_FOUND_ERROR_DICT, 'error')
+        )
+
+        iam.get_user(self.TEST_USER)
+        iam.get_user(self.TEST_USER)
+
+        self.assertEquals(2, iam._client.get_user.call_count)
+
     def test_add_user_to_group(self):
         """
         Test that checks if client.add_user_to_group is called correctly
@@ -300,6 +837,109 @@ class IAMtest(unittest.TestCase):
 
         self.iam._client.remove_user_from_group.assert_called_once_with(GroupName=self.TEST_GROUP, UserName=self.TEST_USER)
 
+    @patch('krux_iam.iam.time.sleep')
+    def test_get_credential_report(self, mock_sleep):
+        """
+        Test that get_credential_report polls until the report is complete and parses it
+        """
+        self.iam._client.generate_credential_report = MagicMock(side_effect=[
+            {'State': 'STARTED'}, {'State': 'INPROGRESS'}, {'State': 'COMPLETE'},
+        ])
+        self.iam._client.get_credential_report = MagicMock(return_value={
+            'Content': b'user,arn,user_creation_time,password_enabled,password_last_used,password_last_changed,'
+                       b'mfa_active,access_key_1_active,access_key_1_last_rotated,access_key_1_last_used_date,'
+                       b'access_key_1_last_used_region,access_key_1_last_used_service,access_key_2_active,'
+                       b'access_key_2_last_rotated,access_key_2_last_used_date,access_key_2_last_used_region,'
+                       b'access_key_2_last_used_service\n'
+                       b'jdoe,arn,1970-01-02T00:00:00+00:00,false,N/A,N/A,false,true,1970-01-02T00:00:00+00:00,'
+                       b'N/A,N/A,N/A,false,N/A,N/A,N/A,N/A\n',
+            'GeneratedTime': datetime.datetime(1970, 1, 3),
+        })
+
+        report = self.iam.get_credential_report(poll_interval=1)
+
+        self.assertEquals(3, self.iam._client.generate_credential_report.call_count)
+        self.assertEquals(2, mock_sleep.call_count)
+        self.assertEquals(['jdoe'], report.usernames())
+        self.assertEquals(86400, report.get('jdoe').access_keys[0].last_rotated)
+        self.assertEquals(2 * 86400, report.generated_at)
+
+    @patch('krux_iam.iam.time.sleep')
+    def test_get_credential_report_timeout(self, mock_sleep):
+        """
+        Test that get_credential_report gives up once the timeout has passed
+        """
+        self.iam._client.generate_credential_report = MagicMock(return_value={'State': 'INPROGRESS'})
+
+        with self.assertRaises(CredentialReportTimeout):
+            self.iam.get_credential_report(timeout=0)
+
+        self.assertFalse(self.iam._client.get_credential_report.called)
+
+    def test_iter_group_members(self):
+        """
+        Test that iter_group_members follows the markers of get_group
+        """
+        self.iam._client.get_group = MagicMock(side_effect=[
+            {'Group': {'GroupName': self.TEST_GROUP}, 'Users': [{'UserName': 'a'}], 'IsTruncated': True, 'Marker': 'm'},
+            {'Group': {'GroupName': self.TEST_GROUP}, 'Users': [{'UserName': 'b'}], 'IsTruncated': False},
+        ])
+
+        users = list(self.iam.iter_group_members(self.TEST_GROUP, page_size=1))
+
+        self.assertEquals([{'UserName': 'a'}, {'UserName': 'b'}], users)
+        self.iam._client.get_group.assert_has_calls([
+            call(GroupName=self.TEST_GROUP, MaxItems=1),
+            call(GroupName=self.TEST_GROUP, MaxItems=1, Marker='m'),
+        ])
+
+    def test_group_members_index(self):
+        """
+        Test that the cached members of a group follow the membership changes
+        """
+        self.iam._cache = TTLCache()
+        self.iam._client.get_group = MagicMock(return_value={'Users': [{'UserName': 'a'}, {'UserName': 'b'}]})
+
+        self.assertEquals(['a', 'b'], self.iam.get_group_members(self.TEST_GROUP))
+
+        self.iam.add_user_to_group('c', self.TEST_GROUP)
+        self.iam.delete_user_from_group('a', self.TEST_GROUP)
+        self.iam.add_user_to_group('c', 'other-group')
+
+        self.assertEquals(['b', 'c'], self.iam.get_group_members(self.TEST_GROUP))
+        self.assertEquals(1, self.iam._client.get_group.call_count)
+        self.assertIsNone(self.iam._cache.get(('group_members', 'other-group')))
+
+    def test_map_users(self):
+        """
+        Test that map_users yields a UserResult per user with what the function returned or raised
+        """
+        def func(username):
+            if username == 'bad':
+                raise ValueError(username)
+            return username.upper()
+
+        results = dict((result.username, result) for result in self.iam.map_users(func, ['jdoe', 'bad']))
+
+        self.assertEqual(UserResult('jdoe', 'JDOE', None), results['jdoe'])
+        self.assertIsInstance(results['bad'].error, ValueError)
+
+    def test_add_and_remove_users_to_group(self):
+        """
+        Test that add_users_to_group and remove_users_from_group yield a result per user
+        """
+        self.iam._client.add_user_to_group = MagicMock(side_effect=[
+            None, botocore.exceptions.ClientError(self.NOT_FOUND_ERROR_DICT, 'error'),
+        ])
+
+        added = sorted(self.iam.add_users_to_group(self.TEST_GROUP, ['a', 'b']))
+        removed = list(self.iam.remove_users_from_group(self.TEST_GROUP, ['a']))
+
+        self.assertEquals(2, self.iam._client.add_user_to_group.call_count)
+        self.assertEquals(1, len([result for result in added if result.error is not None]))
+        self.assertEquals([UserResult('a', None, None)], removed)
+        self.iam._client.remove_user_from_group.assert_called_once_with(GroupName=self.TEST_GROUP, UserName='a')
+
     def test_get_groups(self):
         """
         Test that checks if client.list_groups_for_user is called correctly and a list of dictionaries is returned
@@ -310,3 +950,347 @@ class IAMtest(unittest.TestCase):
 
         self.iam._client.list_groups_for_user.assert_called_once_with(UserName=self.TEST_USER)
         self.assertEquals(self.GROUPS_RESPONSE['Groups'], groups)
+
+    def test_get_groups_paginated(self):
+        """
+        Test that get_groups collects the groups from every page of list_groups_for_user
+        """
+        groups = self.GROUPS_RESPONSE['Groups']
+        self.iam._client.list_groups_for_user = MagicMock(side_effect=[
+            {'Groups': groups[:1], 'IsTruncated': True, 'Marker': 'page2'},
+            {'Groups': groups[1:2], 'IsTruncated': True, 'Marker': 'page3'},
+            {'Groups': groups[2:], 'IsTruncated': False},
+        ])
+
+        self.assertEquals(groups, self.iam.get_groups(self.TEST_USER))
+        self.iam._client.list_groups_for_user.assert_has_calls([
+            call(UserName=self.TEST_USER),
+            call(UserName=self.TEST_USER, Marker='page2'),
+            call(UserName=self.TEST_USER, Marker='page3'),
+        ])
+
+    def test_snapshot(self):
+        """
+        Test that snapshot pages through get_account_authorization_details and indexes the memberships
+        """
+        self.iam._client.get_account_authorization_details = MagicMock(side_effect=[
+            {
+                'UserDetailList': [{'UserName': self.TEST_USER, 'GroupList': ['group1', 'group2']}],
+                'GroupDetailList': [{'GroupName': 'group1'}],
+                'IsTruncated': True,
+                'Marker': 'page2',
+            },
+            {
+                'UserDetailList': [],
+                'GroupDetailList': [{'GroupName': 'group2'}],
+                'IsTruncated': False,
+            },
+        ])
+
+        snapshot = self.iam.snapshot()
+
+        self.iam._client.get_account_authorization_details.assert_has_calls([
+            call(Filter=['User', 'Group']),
+            call(Filter=['User', 'Group'], Marker='page2'),
+        ])
+        self.assertEquals({'UserName': self.TEST_USER}, snapshot.get_user(self.TEST_USER))
+        self.assertEquals([self.TEST_USER], snapshot.get_group_members('group2'))
+        self.assertIsNone(snapshot.access_keys)
+
+    def test_snapshot_with_access_keys(self):
+        """
+        Test that snapshot loads each user's access keys when asked to
+        """
+        self.iam._client.get_account_authorization_details = MagicMock(return_value={
+            'UserDetailList': [{'UserName': self.TEST_USER, 'GroupList': []}],
+            'GroupDetailList': [],
+        })
+        self.iam._client.list_access_keys = MagicMock(return_value=self.GET_KEY_RESPONSE)
+
+        snapshot = self.iam.snapshot(include_access_keys=True)
+
+        self.iam._client.list_access_keys.assert_called_once_with(UserName=self.TEST_USER)
+        self.assertEquals(self.GET_KEY_RESPONSE['AccessKeyMetadata'], snapshot.get_access_keys(self.TEST_USER))
+
+    def test_snapshot_with_access_keys_concurrently(self):
+        """
+        Test that snapshot lists the access keys of every user on the worker pool and raises a failed listing
+        """
+        self.iam._client.get_account_authorization_details = MagicMock(return_value={
+            'UserDetailList': [{'UserName': 'user{0}'.format(i), 'GroupList': []} for i in range(5)],
+            'GroupDetailList': [],
+        })
+        self.iam._client.list_access_keys = MagicMock(
+            side_effect=lambda UserName: {'AccessKeyMetadata': [{'AccessKeyId': UserName.upper()}]}
+        )
+
+        with patch.object(self.iam, '_imap_unordered', wraps=self.iam._imap_unordered) as mock_imap:
+            snapshot = self.iam.snapshot(include_access_keys=True)
+
+        self.assertTrue(mock_imap.called)
+        self.assertEquals([{'AccessKeyId': 'USER3'}], snapshot.get_access_keys('user3'))
+        self.assertEquals(5, self.iam._client.list_access_keys.call_count)
+
+        self.iam._client.list_access_keys = MagicMock(
+            side_effect=botocore.exceptions.ClientError({'Error': {'Code': 'NoSuchEntity'}}, 'list_access_keys')
+        )
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.iam.snapshot(include_access_keys=True)
+
+    def test_lookups_from_snapshot(self):
+        """
+        Test that get_user, get_groups and get_access_keys read from a given snapshot without calling the client
+        """
+        snapshot = Snapshot(
+            users=[{'UserName': self.TEST_USER}],
+            groups=[{'GroupName': 'group1'}],
+            memberships=[(self.TEST_USER, 'group1')],
+            access_keys={self.TEST_USER: [self.KEY_DICT]},
+        )
+
+        self.assertEquals({'UserName': self.TEST_USER}, self.iam.get_user(self.TEST_USER, snapshot=snapshot))
+        self.assertEquals([{'GroupName': 'group1'}], self.iam.get_groups(self.TEST_USER, snapshot=snapshot))
+        self.assertEquals([self.KEY_DICT], self.iam.get_access_keys(self.TEST_USER, snapshot=snapshot))
+
+        self.assertFalse(self.iam._client.get_user.called)
+        self.assertFalse(self.iam._client.list_groups_for_user.called)
+        self.assertFalse(self.iam._client.list_access_keys.called)
+
+    def test_cached_lookups(self):
+        """
+        Test that get_user, get_groups and get_access_keys only call the client on a cache miss
+        """
+        self.iam._cache = TTLCache()
+        self.iam._client.get_user = MagicMock(return_value=self.USER_RESPONSE)
+        self.iam._client.list_groups_for_user = MagicMock(return_value=self.GROUPS_RESPONSE)
+        self.iam._client.list_access_keys = MagicMock(return_value=self.GET_KEY_RESPONSE)
+
+        for _ in range(3):
+            self.assertEquals(self.USER_RESPONSE['User'], self.iam.get_user(self.TEST_USER))
+            self.assertEquals(self.GROUPS_RESPONSE['Groups'], self.iam.get_groups(self.TEST_USER))
+            self.assertEquals(self.GET_KEY_RESPONSE['AccessKeyMetadata'], self.iam.get_access_keys(self.TEST_USER))
+
+        self.assertEquals(1, self.iam._client.get_user.call_count)
+        self.assertEquals(1, self.iam._client.list_groups_for_user.call_count)
+        self.assertEquals(1, self.iam._client.list_access_keys.call_count)
+        self.stats.incr.assert_has_calls([call('cache.miss.user'), call('cache.hit.user')], any_order=True)
+
+    def test_shared_lookup(self):
+        """
+        Test that a lookup served by another thread's call is counted and not cached again
+        """
+        self.iam._cache = MagicMock()
+        self.iam._cache.get.side_effect = lambda key, default: default
+        self.iam._flights.do = MagicMock(return_value=(self.USER_RESPONSE['User'], True))
+
+        self.assertEquals(self.USER_RESPONSE['User'], self.iam.get_user(self.TEST_USER))
+
+        self.stats.incr.assert_any_call('singleflight.shared.user')
+        self.assertFalse(self.iam._cache.set.called)
+        self.assertFalse(self.iam._client.get_user.called)
+
+    def test_cache_returns_copies(self):
+        """
+        Test that changing a returned list does not change the cached one
+        """
+        self.iam._cache = TTLCache()
+        self.iam._client.list_groups_for_user = MagicMock(return_value=self.GROUPS_RESPONSE)
+
+        self.iam.get_groups(self.TEST_USER).append({'GroupName': 'other'})
+
+        self.assertEquals(self.GROUPS_RESPONSE['Groups'], self.iam.get_groups(self.TEST_USER))
+
+    def test_cache_skips_missing_users(self):
+        """
+        Test that a user which is not found is not cached
+        """
+        self.iam._cache = TTLCache()
+        self.iam._negative_cache = None
+        self.iam._client.get_user = MagicMock(side_effect=[
+            botocore.exceptions.ClientError(self.NOT_FOUND_ERROR_DICT, 'error'),
+            self.USER_RESPONSE,
+        ])
+
+        self.assertIsNone(self.iam.get_user(self.TEST_USER))
+        self.assertEquals(self.USER_RESPONSE['User'], self.iam.get_user(self.TEST_USER))
+
+    def test_writes_invalidate_cache(self):
+        """
+        Test that every write invalidates the cached lookups of the affected user
+        """
+        self.iam._cache = TTLCache()
+        self.iam._client.create_user = MagicMock(return_value=self.USER_RESPONSE)
+        self.iam._client.create_access_key = MagicMock(return_value=self.CREATE_KEY_RESPONSE)
+        self.iam._client.list_groups_for_user = MagicMock(return_value={'Groups': []})
+        self.iam._client.list_access_keys = MagicMock(return_value={'AccessKeyMetadata': []})
+
+        writes = [
+            (lambda: self.iam.add_user_to_group(self.TEST_USER, self.TEST_GROUP), ['groups']),
+            (lambda: self.iam.delete_user_from_group(self.TEST_USER, self.TEST_GROUP), ['groups']),
+            (lambda: self.iam.create_access_keys(self.TEST_USER), ['access_keys']),
+            (lambda: self.iam.delete_access_key(self.TEST_USER, self.ACCESS_KEY), ['access_keys']),
+            (lambda: self.iam.create_user(self.TEST_USER), ['user', 'groups', 'access_keys']),
+            (lambda: self.iam.delete_user(self.TEST_USER), ['user', 'groups', 'access_keys']),
+        ]
+
+        for write, kinds in writes:
+            for kind in ('user', 'groups', 'access_keys'):
+                self.iam._cache.set((kind, self.TEST_USER), 'cached')
+            self.iam._cache.set(('user', 'someone-else'), 'cached')
+
+            write()
+
+            for kind in ('user', 'groups', 'access_keys'):
+                expected = None if kind in kinds else 'cached'
+                self.assertEquals(expected, self.iam._cache.get((kind, self.TEST_USER)))
+            self.assertEquals('cached', self.iam._cache.get(('user', 'someone-else')))
+
+    def test_get_policy_document(self):
+        """
+        Test that a policy version is fetched once and its default version looked up once per cache lifetime
+        """
+        document = {'Statement': [{'Effect': 'Allow', 'Action': '*', 'Resource': '*'}]}
+        self.iam._cache = TTLCache()
+        self.iam._client.get_policy = MagicMock(return_value={'Policy': {'DefaultVersionId': 'v2'}})
+        self.iam._client.get_policy_version = MagicMock(return_value={'PolicyVersion': {'Document': document}})
+
+        for _ in range(3):
+            self.assertEquals(document, self.iam.get_policy_document('arn:policy'))
+        self.assertEquals(document, self.iam.get_policy_document('arn:policy', version_id='v2'))
+
+        self.iam._client.get_policy.assert_called_once_with(PolicyArn='arn:policy')
+        self.iam._client.get_policy_version.assert_called_once_with(PolicyArn='arn:policy', VersionId='v2')
+        self.stats.incr.assert_any_call('cache.hit.policy_version')
+
+    def test_put_user_policy(self):
+        """
+        Test that a policy document given as a dict is sent as JSON
+        """
+        self.iam.put_user_policy(self.TEST_USER, 'inline', {'Statement': []})
+        self.iam.put_group_policy(self.TEST_GROUP, 'inline', '{"Statement": []}')
+
+        self.iam._client.put_user_policy.assert_called_once_with(
+            UserName=self.TEST_USER, PolicyName='inline', PolicyDocument='{"Statement": []}'
+        )
+        self.iam._client.put_group_policy.assert_called_once_with(
+            GroupName=self.TEST_GROUP, PolicyName='inline', PolicyDocument='{"Statement": []}'
+        )
+
+    def test_policy_writes_invalidate_cache(self):
+        """
+        Test that the policy writes invalidate the cached policies of the user or group
+        """
+        self.iam._cache = TTLCache()
+
+        writes = [
+            (lambda: self.iam.attach_user_policy(self.TEST_USER, 'arn:policy'), ('attached_user_policies', self.TEST_USER)),
+            (lambda: self.iam.detach_user_policy(self.TEST_USER, 'arn:policy'), ('attached_user_policies', self.TEST_USER)),
+            (lambda: self.iam.put_user_policy(self.TEST_USER, 'inline', {}), ('user_policies', self.TEST_USER)),
+            (lambda: self.iam.delete_user_policy(self.TEST_USER, 'inline'), ('user_policies', self.TEST_USER)),
+            (lambda: self.iam.attach_group_policy(self.TEST_GROUP, 'arn:policy'), ('attached_group_policies', self.TEST_GROUP)),
+            (lambda: self.iam.detach_group_policy(self.TEST_GROUP, 'arn:policy'), ('attached_group_policies', self.TEST_GROUP)),
+            (lambda: self.iam.put_group_policy(self.TEST_GROUP, 'inline', {}), ('group_policies', self.TEST_GROUP)),
+        ]
+
+        for write, key in writes:
+            self.iam._cache.set(key, 'cached')
+
+            write()
+
+            self.assertIsNone(self.iam._cache.get(key))
+
+    def test_instrumentation(self):
+        """
+        Test that public methods and client calls are timed and counted through stats
+        """
+        self.iam._client.create_user = MagicMock(return_value=self.USER_RESPONSE)
+
+        self.iam.create_user(self.TEST_USER)
+
+        self.stats.incr.assert_any_call('method.create_user.calls')
+        self.stats.incr.assert_any_call('client.create_user.calls')
+        timed = [c[0][0] for c in self.stats.timing.call_args_list]
+        self.assertIn('method.create_user', timed)
+        self.assertIn('client.create_user', timed)
+        self.assertFalse(self.logger.debug.called)
+
+    def test_instrumentation_errors(self):
+        """
+        Test that failures are counted under their AWS error code
+        """
+        self.iam._client.create_user = MagicMock(
+            side_effect=botocore.exceptions.ClientError({'Error': {'Code': 'EntityAlreadyExists'}}, 'create_user')
+        )
+
+        with self.assertRaises(botocore.exceptions.ClientError):
+            self.iam.create_user(self.TEST_USER)
+
+        self.stats.incr.assert_any_call('method.create_user.error.EntityAlreadyExists')
+        self.stats.incr.assert_any_call('client.create_user.error.EntityAlreadyExists')
+        self.stats.incr.assert_any_call('client.create_user.calls')
+
+    def test_instrumentation_iterators(self):
+        """
+        Test that the generator methods are timed and counted with the number of items they yielded
+        """
+        self.iam._client.list_users = MagicMock(return_value={'Users': [{'UserName': 'user1'}, {'UserName': 'user2'}]})
+        self.iam._client.list_groups_for_user = MagicMock(side_effect=botocore.exceptions.ClientError(
+            {'Error': {'Code': 'NoSuchEntity'}}, 'list_groups_for_user'
+        ))
+
+        users = self.iam.iter_users()
+        self.assertFalse(self.stats.incr.called)
+        next(users)
+        users.close()
+        list(self.iam.iter_users())
+        with self.assertRaises(botocore.exceptions.ClientError):
+            list(self.iam.iter_groups(self.TEST_USER))
+
+        self.assertEquals(2, self.stats.incr.call_args_list.count(call('method.iter_users.calls')))
+        self.stats.incr.assert_any_call('method.iter_users.results', 1)
+        self.stats.incr.assert_any_call('method.iter_users.results', 2)
+        self.stats.incr.assert_any_call('method.iter_groups.error.NoSuchEntity')
+        self.stats.incr.assert_any_call('method.iter_groups.results', 0)
+        timed = [c[0][0] for c in self.stats.timing.call_args_list]
+        self.assertIn('method.iter_users', timed)
+
+    def test_instrumentation_pages(self):
+        """
+        Test that every page of a paginated call is counted
+        """
+        self.iam._client.list_groups_for_user = MagicMock(side_effect=[
+            {'Groups': [], 'IsTruncated': True, 'Marker': 'page2'},
+            {'Groups': [], 'IsTruncated': False},
+        ])
+
+        self.iam.get_groups(self.TEST_USER)
+
+        self.assertEquals(2, self.stats.incr.call_args_list.count(call('pages.list_groups_for_user')))
+
+    def test_log_latency(self):
+        """
+        Test that log_latency logs the latency of methods and client calls at debug level
+        """
+        self.iam._log_latency = True
+
+        self.iam.delete_access_key(self.TEST_USER, self.ACCESS_KEY)
+
+        logged = [c[0][1] for c in self.logger.debug.call_args_list]
+        self.assertEquals(['client.delete_access_key', 'method.delete_access_key'], logged)
+
+    def test_compact_listings(self):
+        """
+        Test that the listing methods return compact records when asked to
+        """
+        self.iam._client.list_users = MagicMock(return_value={'Users': [{'UserName': self.TEST_USER}]})
+        self.iam._client.list_groups_for_user = MagicMock(return_value=self.GROUPS_RESPONSE)
+        self.iam._client.list_access_keys = MagicMock(return_value=self.GET_KEY_RESPONSE)
+
+        users = list(self.iam.iter_users(compact=True))
+        groups = self.iam.get_groups(self.TEST_USER, compact=True)
+        keys = self.iam.get_access_keys(self.TEST_USER, compact=True)
+
+        self.assertEquals([User(self.TEST_USER, None, None, None, None)], users)
+        self.assertEquals(['group1', 'group2', 'group3'], [group.name for group in groups])
+        self.assertTrue(all(isinstance(group, Group) for group in groups))
+        self.assertEquals([AccessKey(None, self.ACCESS_KEY, None, None)], keys)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from krux_iam.journal import Journal
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        """
+        Recorded steps are done, with their results
+        """
+        with Journal(self.path) as journal:
+            journal.record(('plan', 'jdoe'), {'groups': ['group1']})
+            journal.record(['delete_user', 'jdoe'])
+
+            self.assertIn(('plan', 'jdoe'), journal)
+            self.assertIn(('delete_user', 'jdoe'), journal)
+            self.assertNotIn(('delete_user', 'asmith'), journal)
+            self.assertEqual({'groups': ['group1']}, journal.get(('plan', 'jdoe')))
+            self.assertEqual('default', journal.get(('plan', 'asmith'), 'default'))
+            self.assertEqual(2, len(journal))
+
+    def test_resume(self):
+        """
+        A reopened journal holds the steps recorded before, a torn last line aside
+        """
+        with Journal(self.path) as journal:
+            journal.record(('delete_access_key', 'jdoe', 'AKIA1'))
+        with open(self.path, 'a') as log:
+            log.write('{"step": ["delete_us')
+
+        with Journal(self.path) as journal:
+            self.assertEqual(1, len(journal))
+            self.assertIn(('delete_access_key', 'jdoe', 'AKIA1'), journal)
+
+    def test_flush_every(self):
+        """
+        Records are written out in batches of flush_every
+        """
+        journal = Journal(self.path, flush_every=2)
+
+        journal.record(('step', '1'))
+        self.assertEqual(0, os.path.getsize(self.path))
+
+        journal.record(('step', '2'))
+        with open(self.path) as log:
+            self.assertEqual(2, len(log.readlines()))
+
+        journal.record(('step', '3'))
+        journal.close()
+        with open(self.path) as log:
+            self.assertEqual(3, len(log.readlines()))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from concurrent.futures import Future
+import datetime
+import unittest
+
+#
+# Third party libraries
+#
+
+from dateutil.tz import tzutc
+from mock import MagicMock
+
+#
+# Internal libraries
+#
+
+from krux_iam.keys import KeyIndex, KeyInfo, to_epoch, ACTIVE, INACTIVE
+from krux_iam.report import CredentialEntry, CredentialReport, ReportKey
+
+
+def imap_unordered(func, items):
+    for item in items:
+        future = Future()
+        future.set_result(func(item))
+        yield item, future
+
+
+class KeyIndexTest(unittest.TestCase):
+    NOW = 1000000
+    DAY = 86400
+
+    def setUp(self):
+        self.index = KeyIndex([
+            KeyInfo('jdoe', 'old', ACTIVE, self.NOW - 100 * self.DAY, self.NOW - self.DAY),
+            KeyInfo('jdoe', 'new', ACTIVE, self.NOW - self.DAY, None),
+            KeyInfo('asmith', 'older', ACTIVE, self.NOW - 200 * self.DAY, None),
+            KeyInfo('asmith', 'disabled', INACTIVE, self.NOW - 300 * self.DAY, None),
+        ])
+
+    def test_to_epoch(self):
+        """
+        to_epoch converts aware and naive UTC datetimes to epoch seconds
+        """
+        self.assertEqual(86400, to_epoch(datetime.datetime(1970, 1, 2, tzinfo=tzutc())))
+        self.assertEqual(86400, to_epoch(datetime.datetime(1970, 1, 2)))
+        self.assertIsNone(to_epoch(None))
+
+    def test_keys_for(self):
+        """
+        KeyIndex.keys_for returns the keys of a user, oldest first
+        """
+        self.assertEqual(['old', 'new'], [key.access_key_id for key in self.index.keys_for('jdoe')])
+        self.assertEqual([], self.index.keys_for('nobody'))
+
+    def test_older_than(self):
+        """
+        KeyIndex.older_than selects the active keys older than the given age, oldest first
+        """
+        keys = self.index.older_than(30 * self.DAY, now=self.NOW)
+
+        self.assertEqual(['older', 'old'], [key.access_key_id for key in keys])
+        self.assertEqual(
+            ['disabled', 'older', 'old'],
+            [key.access_key_id for key in self.index.older_than(30 * self.DAY, now=self.NOW, status=None)],
+        )
+
+    def test_unused_since(self):
+        """
+        KeyIndex.unused_since selects active keys idle for longer than the given time
+        """
+        keys = self.index.unused_since(30 * self.DAY, now=self.NOW)
+
+        self.assertEqual(['older'], [key.access_key_id for key in keys])
+
+    def test_add_remove(self):
+        """
+        KeyIndex.add replaces keys in place and KeyIndex.remove drops them
+        """
+        self.index.add(self.index.get('old')._replace(status=INACTIVE))
+        self.assertEqual(INACTIVE, self.index.get('old').status)
+        self.assertEqual(4, len(self.index))
+
+        self.index.remove('old')
+        self.index.remove('missing')
+        self.assertIsNone(self.index.get('old'))
+        self.assertEqual(['new'], [key.access_key_id for key in self.index.keys_for('jdoe')])
+        self.assertEqual(set(['jdoe', 'asmith']), set(self.index.usernames()))
+
+    def test_from_listings(self):
+        """
+        KeyIndex.from_listings lists the keys of every user of the account
+        """
+        created = datetime.datetime(1970, 1, 2, tzinfo=tzutc())
+        iam = MagicMock()
+        iam._imap_unordered.side_effect = imap_unordered
+        iam.iter_users.return_value = iter([{'UserName': 'jdoe'}, {'UserName': 'asmith'}])
+        iam.get_access_keys.side_effect = lambda username: [
+            {'AccessKeyId': username + '-key', 'Status': INACTIVE, 'CreateDate': created},
+        ]
+        iam.get_access_key_last_used.side_effect = lambda key_id: {'LastUsedDate': created} if key_id == 'jdoe-key' else {}
+
+        index = KeyIndex.from_listings(iam, include_last_used=True)
+
+        self.assertEqual(KeyInfo('jdoe', 'jdoe-key', INACTIVE, 86400, 86400), index.get('jdoe-key'))
+        self.assertEqual(KeyInfo('asmith', 'asmith-key', INACTIVE, 86400, None), index.get('asmith-key'))
+
+    def test_from_listings_usernames(self):
+        """
+        KeyIndex.from_listings only lists the keys of the given users
+        """
+        iam = MagicMock()
+        iam._imap_unordered.side_effect = imap_unordered
+        iam.get_access_keys.return_value = []
+
+        KeyIndex.from_listings(iam, usernames=['jdoe'])
+
+        self.assertFalse(iam.iter_users.called)
+        iam.get_access_keys.assert_called_once_with('jdoe')
+        self.assertFalse(iam.get_access_key_last_used.called)
+
+    def test_from_listings_report(self):
+        """
+        KeyIndex.from_listings reads the last use of the keys from a credential report
+        """
+        created = datetime.datetime(1970, 1, 2, tzinfo=tzutc())
+        iam = MagicMock()
+        iam._imap_unordered.side_effect = imap_unordered
+        iam.get_access_keys.return_value = [
+            {'AccessKeyId': 'first', 'Status': ACTIVE, 'CreateDate': created},
+            {'AccessKeyId': 'second', 'Status': ACTIVE, 'CreateDate': created + datetime.timedelta(days=1)},
+        ]
+        report = CredentialReport([CredentialEntry(
+            'jdoe', 'arn', 0, False, None, None, False,
+            (ReportKey(1, True, 86400, 90000, 'iam', 'us-east-1'), ReportKey(2, True, 172800, None, None, None)),
+        )])
+
+        index = KeyIndex.from_listings(iam, usernames=['jdoe'], include_last_used=True, report=report)
+
+        self.assertEqual(90000, index.get('first').last_used)
+        self.assertIsNone(index.get('second').last_used)
+        self.assertFalse(iam.get_access_key_last_used.called)
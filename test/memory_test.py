@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+from botocore.exceptions import ClientError
+
+#
+# Internal libraries
+#
+
+from krux_iam.cache import TTLCache
+from krux_iam.iam import IAM
+from krux_iam.journal import Journal
+from krux_iam.keys import KeyIndex
+from krux_iam.memory import MemoryBackend
+from krux_iam.throttle import TokenBucket
+
+
+class MemoryBackendTest(unittest.TestCase):
+    TEST_USER = 'jdoe'
+    TEST_GROUP = 'krux-test'
+
+    def setUp(self):
+        self.backend = MemoryBackend(seed=0)
+
+    def assertError(self, code, func, *args, **kwargs):
+        with self.assertRaises(ClientError) as context:
+            func(*args, **kwargs)
+        self.assertEqual(code, context.exception.response['Error']['Code'])
+
+    def test_users(self):
+        """
+        MemoryBackend creates, gets and deletes users with IAM's error codes
+        """
+        user = self.backend.create_user(UserName=self.TEST_USER)['User']
+
+        self.assertEqual(self.TEST_USER, user['UserName'])
+        self.assertEqual(user, self.backend.get_user(UserName=self.TEST_USER)['User'])
+        self.assertError('EntityAlreadyExists', self.backend.create_user, UserName=self.TEST_USER)
+
+        self.backend.delete_user(UserName=self.TEST_USER)
+
+        self.assertError('NoSuchEntity', self.backend.get_user, UserName=self.TEST_USER)
+        self.assertError('NoSuchEntity', self.backend.delete_user, UserName=self.TEST_USER)
+
+    def test_delete_user_conflict(self):
+        """
+        MemoryBackend refuses to delete a user with memberships or keys
+        """
+        self.backend.create_user(UserName=self.TEST_USER)
+        self.backend.create_group(GroupName=self.TEST_GROUP)
+        self.backend.add_user_to_group(GroupName=self.TEST_GROUP, UserName=self.TEST_USER)
+
+        self.assertError('DeleteConflict', self.backend.delete_user, UserName=self.TEST_USER)
+
+        self.backend.remove_user_from_group(GroupName=self.TEST_GROUP, UserName=self.TEST_USER)
+        self.backend.create_access_key(UserName=self.TEST_USER)
+
+        self.assertError('DeleteConflict', self.backend.delete_user, UserName=self.TEST_USER)
+
+    def test_memberships(self):
+        """
+        MemoryBackend keeps both sides of group memberships consistent
+        """
+        self.backend.populate(users=3, groups=2)
+
+        self.backend.add_user_to_group(GroupName='group00001', UserName='user0000002')
+        self.backend.add_user_to_group(GroupName='group00001', UserName='user0000000')
+
+        self.assertEqual(
+            ['group00001'],
+            [group['GroupName'] for group in self.backend.list_groups_for_user(UserName='user0000002')['Groups']],
+        )
+        self.assertEqual(
+            ['user0000000', 'user0000002'],
+            [user['UserName'] for user in self.backend.get_group(GroupName='group00001')['Users']],
+        )
+        self.assertError('NoSuchEntity', self.backend.add_user_to_group, GroupName='missing', UserName='user0000000')
+        self.assertError(
+            'NoSuchEntity', self.backend.remove_user_from_group, GroupName='group00000', UserName='user0000000'
+        )
+
+    def test_access_keys(self):
+        """
+        MemoryBackend issues at most two keys per user and tracks their status and last use
+        """
+        self.backend.create_user(UserName=self.TEST_USER)
+        key = self.backend.create_access_key(UserName=self.TEST_USER)['AccessKey']
+        self.backend.create_access_key(UserName=self.TEST_USER)
+
+        self.assertIn('SecretAccessKey', key)
+        self.assertError('LimitExceeded', self.backend.create_access_key, UserName=self.TEST_USER)
+
+        self.backend.update_access_key(UserName=self.TEST_USER, AccessKeyId=key['AccessKeyId'], Status='Inactive')
+        self.backend.record_key_use(key['AccessKeyId'])
+        listed = self.backend.list_access_keys(UserName=self.TEST_USER)['AccessKeyMetadata']
+        last_used = self.backend.get_access_key_last_used(AccessKeyId=key['AccessKeyId'])
+
+        self.assertEqual('Inactive', listed[0]['Status'])
+        self.assertNotIn('SecretAccessKey', listed[0])
+        self.assertEqual(self.TEST_USER, last_used['UserName'])
+        self.assertIn('LastUsedDate', last_used['AccessKeyLastUsed'])
+
+        self.backend.delete_access_key(UserName=self.TEST_USER, AccessKeyId=key['AccessKeyId'])
+        self.assertEqual(1, len(self.backend.list_access_keys(UserName=self.TEST_USER)['AccessKeyMetadata']))
+        self.assertError(
+            'NoSuchEntity', self.backend.delete_access_key, UserName=self.TEST_USER, AccessKeyId=key['AccessKeyId']
+        )
+
+    def test_pagination(self):
+        """
+        MemoryBackend paginates listings with markers
+        """
+        usernames = self.backend.populate(users=25)
+        listed = []
+        kwargs = {'MaxItems': 10}
+
+        pages = 0
+        while True:
+            response = self.backend.list_users(**kwargs)
+            listed.extend(user['UserName'] for user in response['Users'])
+            pages += 1
+            if not response['IsTruncated']:
+                break
+            kwargs['Marker'] = response['Marker']
+
+        self.assertEqual(usernames, listed)
+        self.assertEqual(3, pages)
+        self.assertEqual(3, self.backend.calls['list_users'])
+
+    def test_authorization_details(self):
+        """
+        MemoryBackend pages through users and then groups in get_account_authorization_details
+        """
+        self.backend.populate(users=3, groups=3, groups_per_user=2)
+
+        first = self.backend.get_account_authorization_details(Filter=['User', 'Group'], MaxItems=4)
+        second = self.backend.get_account_authorization_details(
+            Filter=['User', 'Group'], MaxItems=4, Marker=first['Marker'],
+        )
+
+        self.assertEqual(3, len(first['UserDetailList']))
+        self.assertEqual(1, len(first['GroupDetailList']))
+        self.assertEqual(['group00000', 'group00001'], first['UserDetailList'][0]['GroupList'])
+        self.assertEqual(2, len(second['GroupDetailList']))
+        self.assertFalse(second['IsTruncated'])
+
+    @patch('krux_iam.memory.time.sleep')
+    def test_latency_and_throttling(self, mock_sleep):
+        """
+        MemoryBackend applies the configured latency and throttles the configured share of calls
+        """
+        backend = MemoryBackend(latency=0.05, throttle_rate=1.0)
+
+        self.assertError('Throttling', backend.list_users)
+        mock_sleep.assert_called_once_with(0.05)
+
+    def test_populate_large(self):
+        """
+        MemoryBackend.populate builds large accounts
+        """
+        self.backend.populate(users=20000, groups=50, groups_per_user=3, keys_per_user=1)
+
+        self.assertEqual(20000, len(self.backend.list_users(MaxItems=100000)['Users']))
+        self.assertEqual(
+            3, len(self.backend.list_groups_for_user(UserName='user0012345')['Groups'])
+        )
+
+    def test_credential_report(self):
+        """
+        MemoryBackend generates a credential report after being asked twice
+        """
+        self.assertError('ReportNotPresent', self.backend.get_credential_report)
+        self.backend.populate(users=1, keys_per_user=1)
+        key_id = self.backend.list_access_keys(UserName='user0000000')['AccessKeyMetadata'][0]['AccessKeyId']
+        self.backend.record_key_use(key_id)
+
+        self.assertEqual('STARTED', self.backend.generate_credential_report()['State'])
+        self.assertEqual('COMPLETE', self.backend.generate_credential_report()['State'])
+
+        lines = self.backend.get_credential_report()['Content'].decode('utf-8').splitlines()
+
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith('<root_account>,'))
+        self.assertTrue(lines[2].startswith('user0000000,'))
+        self.assertEqual(len(lines[0].split(',')), len(lines[2].split(',')))
+
+    def test_policies(self):
+        """
+        MemoryBackend keeps managed policy versions, attachments and inline policies
+        """
+        self.backend.populate(users=1, groups=1, groups_per_user=1)
+        arn = self.backend.create_policy(PolicyName='read', PolicyDocument='{"Statement": []}')['Policy']['Arn']
+        self.backend.create_policy_version(PolicyArn=arn, PolicyDocument='{"Statement": [{}]}', SetAsDefault=True)
+        self.backend.attach_user_policy(UserName='user0000000', PolicyArn=arn)
+        self.backend.put_group_policy(GroupName='group00000', PolicyName='inline', PolicyDocument='{"Version": "1"}')
+
+        self.assertEqual('v2', self.backend.get_policy(PolicyArn=arn)['Policy']['DefaultVersionId'])
+        self.assertEqual({'Statement': []}, self.backend.get_policy_version(PolicyArn=arn, VersionId='v1')['PolicyVersion']['Document'])
+        self.assertEqual(
+            [{'PolicyName': 'read', 'PolicyArn': arn}],
+            self.backend.list_attached_user_policies(UserName='user0000000')['AttachedPolicies']
+        )
+        self.assertEqual(['inline'], self.backend.list_group_policies(GroupName='group00000')['PolicyNames'])
+        self.assertEqual({'Version': '1'}, self.backend.get_group_policy(GroupName='group00000', PolicyName='inline')['PolicyDocument'])
+        self.assertError('NoSuchEntity', self.backend.get_policy_version, PolicyArn=arn, VersionId='v3')
+        self.assertError('NoSuchEntity', self.backend.detach_group_policy, GroupName='group00000', PolicyArn=arn)
+        self.assertError('EntityAlreadyExists', self.backend.create_policy, PolicyName='read', PolicyDocument='{}')
+
+
+class IAMWithMemoryBackendTest(unittest.TestCase):
+    """
+    Runs IAM against MemoryBackend end to end
+    """
+
+    def setUp(self):
+        self.backend = MemoryBackend(seed=0)
+        self.backend.populate(users=5, groups=10, groups_per_user=7, keys_per_user=2)
+        self.iam = IAM(
+            boto=None,
+            logger=MagicMock(),
+            stats=MagicMock(),
+            rate_limiter=TokenBucket(rate=None),
+            client=self.backend,
+        )
+
+    def _slow_first_call(self, operation):
+        """
+        Patches the given backend operation so that its first call, once it has read
+        the backend, waits for the returned event before returning.
+        """
+        release = threading.Event()
+        self.read = threading.Event()
+        real = getattr(self.backend, operation)
+
+        def slow(**kwargs):
+            try:
+                return real(**kwargs)
+            finally:
+                if not self.read.is_set():
+                    self.read.set()
+                    release.wait(5)
+
+        return patch.object(self.backend, operation, side_effect=slow), release
+
+    def _group_names(self, username):
+        return [group['GroupName'] for group in self.iam.get_groups(username)]
+
+    def test_write_during_cached_read(self):
+        """
+        A read in flight when a write invalidates its key returns what it read but does not cache it
+        """
+        self.iam._cache = TTLCache(ttl=300)
+        group_name = self.backend.list_groups_for_user(UserName='user0000000')['Groups'][0]['GroupName']
+        slow, release = self._slow_first_call('list_groups_for_user')
+
+        with slow, ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._group_names, 'user0000000')
+            self.read.wait()
+            self.iam.delete_user_from_group('user0000000', group_name)
+            release.set()
+            self.assertIn(group_name, future.result())
+
+        self.assertNotIn(group_name, self._group_names('user0000000'))
+
+    def test_read_after_write_during_read(self):
+        """
+        A read made after a write does not share a read of the same key started before it
+        """
+        group_name = self.backend.list_groups_for_user(UserName='user0000000')['Groups'][0]['GroupName']
+        slow, release = self._slow_first_call('list_groups_for_user')
+
+        with slow, ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._group_names, 'user0000000')
+            self.read.wait()
+            self.iam.delete_user_from_group('user0000000', group_name)
+            self.assertNotIn(group_name, self._group_names('user0000000'))
+            release.set()
+            self.assertIn(group_name, future.result())
+
+    def test_create_during_missing_user_read(self):
+        """
+        A lookup in flight when the user is created does not remember them as missing
+        """
+        slow, release = self._slow_first_call('get_user')
+
+        with slow, ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.iam.get_user, 'new')
+            self.read.wait()
+            self.iam.create_user('new')
+            release.set()
+            self.assertIsNone(future.result())
+
+        self.assertEqual('new', self.iam.get_user('new')['UserName'])
+
+    def test_get_groups_paginated(self):
+        """
+        IAM.get_groups collects every page
+        """
+        self.assertEqual(7, len(self.iam.get_groups('user0000000', page_size=3)))
+        self.assertEqual(3, self.backend.calls['list_groups_for_user'])
+
+    def test_get_user_missing(self):
+        """
+        IAM.get_user reports a missing user as None
+        """
+        self.assertIsNone(self.iam.get_user('nobody'))
+
+    def test_delete_user(self):
+        """
+        IAM.delete_user removes every membership and key before deleting the user
+        """
+        self.iam.delete_user('user0000000')
+
+        self.assertIsNone(self.iam.get_user('user0000000'))
+        self.assertNotIn('user0000000', self.iam.snapshot().users)
+
+    def test_delete_user_missing(self):
+        """
+        IAM.delete_user of a missing user raises NoSuchEntity
+        """
+        with self.assertRaises(ClientError):
+            self.iam.delete_user('nobody')
+
+    def test_create_users(self):
+        """
+        IAM.create_users provisions users against the backend
+        """
+        results = list(self.iam.create_users([
+            {'username': 'new1', 'groups': ['group00000'], 'create_access_key': True},
+            {'username': 'new2', 'groups': ['missing']},
+        ]))
+        results = dict((result.username, result) for result in results)
+
+        self.assertIsNone(results['new1'].error)
+        self.assertIsNotNone(results['new2'].error)
+        self.assertIn('new1', self.iam.snapshot().get_group_members('group00000'))
+
+    @patch('krux_iam.iam.time.sleep')
+    def test_credential_report(self, mock_sleep):
+        """
+        IAM.get_credential_report indexes the usage of every user's keys in two calls
+        """
+        key = self.iam.get_access_keys('user0000001')[0]
+        self.backend.record_key_use(key['AccessKeyId'])
+
+        report = self.iam.get_credential_report()
+        index = KeyIndex.from_listings(self.iam, report=report)
+
+        self.assertEqual(5, len(report))
+        self.assertEqual(1, self.backend.calls['get_credential_report'])
+        self.assertEqual(0, self.backend.calls['get_access_key_last_used'])
+        self.assertIsNotNone(report.get('user0000001').access_keys[0].last_used)
+        self.assertIsNotNone(index.get(key['AccessKeyId']).last_used)
+        self.assertEqual(1, len([info for info in index if info.last_used is not None]))
+
+    def test_delete_users_journal(self):
+        """
+        IAM.delete_users with a journal resumes a crashed run without redoing its steps
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'journal.log')
+        usernames = ['user0000000', 'user0000001', 'user0000002']
+        real_delete_user = self.backend.delete_user
+
+        def crash(UserName):
+            if UserName == 'user0000001':
+                raise RuntimeError('crash')
+            return real_delete_user(UserName=UserName)
+
+        with patch.object(self.backend, 'delete_user', side_effect=crash):
+            with Journal(path) as journal:
+                results = list(self.iam.delete_users(usernames, journal=journal))
+        self.assertEqual(1, len([result for result in results if result.error is not None]))
+        self.backend.calls.clear()
+
+        with Journal(path) as journal:
+            results = list(self.iam.delete_users(usernames, journal=journal))
+
+        self.assertTrue(all(result.error is None for result in results))
+        # Only the user left to delete is deleted; nothing is listed again
+        self.assertEqual({'delete_user': 1}, dict(self.backend.calls))
+        self.assertEqual(['user0000003', 'user0000004'], sorted(self.iam.snapshot().users))
+        self.iam._stats.gauge.assert_any_call('journal.done', 3)
+        self.iam._stats.incr.assert_any_call('journal.skipped.delete_user')
+
+    def test_delete_users_journal_lost_batch(self):
+        """
+        IAM.delete_users counts users already gone as done when the records of their deletion were lost
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'journal.log')
+        usernames = ['user0000000', 'user0000001', 'user0000002']
+
+        # A run which crashed before writing out its batch of records
+        with patch.object(Journal, '_flush'):
+            with Journal(path) as journal:
+                list(self.iam.delete_users(usernames[:2], journal=journal))
+
+        with Journal(path) as journal:
+            results = list(self.iam.delete_users(usernames, journal=journal))
+
+            self.assertEqual([], [result for result in results if result.error is not None])
+            self.assertTrue(all(('delete_user', username) in journal for username in usernames))
+        self.assertEqual(['user0000003', 'user0000004'], sorted(self.iam.snapshot().users))
+
+    def test_evaluate_permissions(self):
+        """
+        IAM.evaluate_permissions reads the authorization details and fetches each managed policy document once
+        """
+        read = self.backend.create_policy(
+            PolicyName='read',
+            PolicyDocument='{"Statement": [{"Effect": "Allow", "Action": "s3:Get*", "Resource": "*"}]}',
+        )['Policy']['Arn']
+        deny = self.backend.create_policy(
+            PolicyName='deny',
+            PolicyDocument='{"Statement": [{"Effect": "Deny", "Action": "s3:GetObject", "Resource": "*"}]}',
+        )['Policy']['Arn']
+        for group in self.backend.list_groups()['Groups']:
+            self.iam.attach_group_policy(group['GroupName'], read)
+        self.iam.attach_user_policy('user0000000', deny)
+        self.iam.put_user_policy('user0000001', 'admin', {'Statement': {'Effect': 'Allow', 'Action': 'iam:*', 'Resource': '*'}})
+        self.backend.calls.clear()
+
+        results = dict((result.username, result) for result in self.iam.evaluate_permissions())
+
+        self.assertEqual(5, len(results))
+        self.assertTrue(all(result.error is None for result in results.values()))
+        self.assertFalse(results['user0000000'].result.allows('s3:GetObject'))
+        self.assertTrue(results['user0000000'].result.allows('s3:GetBucketPolicy'))
+        self.assertEqual(['iam:*', 's3:get*'], results['user0000001'].result.allowed_actions)
+        self.assertEqual(['s3:get*'], results['user0000002'].result.allowed_actions)
+        self.assertEqual(1, self.backend.calls['get_account_authorization_details'])
+        self.assertEqual(2, self.backend.calls['get_policy_version'])
+        self.assertEqual(2, self.backend.calls['get_policy'])
+        for operation in ('list_attached_user_policies', 'list_user_policies', 'get_user_policy', 'list_groups_for_user',
+                          'list_attached_group_policies', 'list_group_policies'):
+            self.assertEqual(0, self.backend.calls[operation])
+        self.assertEqual(3, len(self.iam._policy_cache))
+
+    def test_evaluate_permissions_of_given_users(self):
+        """
+        IAM.evaluate_permissions of given users reports those missing and those whose policies could not be fetched
+        """
+        read = self.backend.create_policy(
+            PolicyName='read',
+            PolicyDocument='{"Statement": [{"Effect": "Allow", "Action": "s3:Get*", "Resource": "*"}]}',
+        )['Policy']['Arn']
+        self.iam.attach_user_policy('user0000001', read)
+        self.iam.put_user_policy('user0000002', 'admin', {'Statement': {'Effect': 'Allow', 'Action': 'iam:*', 'Resource': '*'}})
+
+        with patch.object(self.backend, 'get_policy', side_effect=RuntimeError('throttled')):
+            results = list(self.iam.evaluate_permissions(iter(['user0000002', 'missing', 'user0000001'])))
+
+        self.assertEqual(['user0000002', 'missing', 'user0000001'], [result.username for result in results])
+        self.assertEqual(['iam:*'], results[0].result.allowed_actions)
+        self.assertEqual('NoSuchEntity', results[1].error.response['Error']['Code'])
+        self.assertIsInstance(results[2].error, RuntimeError)
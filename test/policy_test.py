@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Internal libraries
+#
+
+from krux_iam.policy import PolicyCache, Permissions, Statement, digest, parse_statements
+
+
+class PolicyTest(unittest.TestCase):
+    DOCUMENT = {
+        'Version': '2012-10-17',
+        'Statement': [
+            {'Effect': 'Allow', 'Action': ['s3:Get*', 'S3:ListBucket'], 'Resource': '*'},
+            {'Effect': 'Deny', 'Action': 's3:GetObject', 'Resource': 'arn:aws:s3:::secret/*'},
+            {'Effect': 'Deny', 'NotAction': 'iam:*', 'Resource': '*', 'Condition': {'Bool': {'aws:MultiFactorAuthPresent': 'false'}}},
+        ],
+    }
+
+    def test_digest_is_canonical(self):
+        """
+        Test that documents differing only in key order and whitespace share a digest
+        """
+        reordered = {'Statement': self.DOCUMENT['Statement'], 'Version': '2012-10-17'}
+
+        self.assertEqual(digest(self.DOCUMENT), digest(reordered))
+        self.assertNotEqual(digest(self.DOCUMENT), digest({'Version': '2012-10-17', 'Statement': []}))
+
+    def test_parse_statements(self):
+        """
+        Test that statements are normalized to lower case action tuples
+        """
+        self.assertEqual((
+            Statement('Allow', ('s3:get*', 's3:listbucket'), False, True),
+            Statement('Deny', ('s3:getobject',), False, False),
+            Statement('Deny', ('iam:*',), True, False),
+        ), parse_statements(self.DOCUMENT))
+
+    def test_parse_single_statement(self):
+        """
+        Test that a Statement given as a single dict is parsed
+        """
+        document = {'Statement': {'Effect': 'Allow', 'Action': '*', 'Resource': '*'}}
+
+        self.assertEqual((Statement('Allow', ('*',), False, True),), parse_statements(document))
+
+    def test_cache_stores_content_once(self):
+        """
+        Test that identical documents are stored and parsed once, whatever version they belong to
+        """
+        cache = PolicyCache()
+
+        key = cache.set_version('arn:aws:iam::aws:policy/A', 'v1', self.DOCUMENT)
+        other_key = cache.set_version('arn:aws:iam::123:policy/B', 'v3', dict(self.DOCUMENT))
+
+        self.assertEqual(key, other_key)
+        self.assertEqual(1, len(cache))
+        self.assertEqual(self.DOCUMENT, cache.get(key))
+        self.assertEqual(parse_statements(self.DOCUMENT), cache.get_statements(key))
+        self.assertEqual(key, cache.get_version('arn:aws:iam::123:policy/B', 'v3'))
+        self.assertIsNone(cache.get_version('arn:aws:iam::123:policy/B', 'v1'))
+
+    def test_permissions(self):
+        """
+        Test that only unconditional denials on every resource take allowed actions back
+        """
+        permissions = Permissions(parse_statements(self.DOCUMENT) + (
+            Statement('Deny', ('s3:getbucketpolicy',), False, True),
+        ))
+
+        self.assertTrue(permissions.allows('s3:GetObject'))
+        self.assertTrue(permissions.allows('S3:listbucket'))
+        self.assertFalse(permissions.allows('s3:GetBucketPolicy'))
+        self.assertFalse(permissions.allows('s3:PutObject'))
+        self.assertEqual(['s3:get*', 's3:listbucket'], permissions.allowed_actions)
+
+    def test_permissions_not_action(self):
+        """
+        Test that NotAction statements cover every action but those listed
+        """
+        permissions = Permissions([
+            Statement('Allow', ('iam:*',), True, True),
+            Statement('Deny', ('ec2:terminateinstances',), False, True),
+        ])
+
+        self.assertTrue(permissions.allows('s3:GetObject'))
+        self.assertFalse(permissions.allows('iam:CreateUser'))
+        self.assertFalse(permissions.allows('ec2:TerminateInstances'))
+        self.assertEqual(['*'], permissions.allowed_actions)
+        self.assertEqual([], Permissions([Statement('Deny', ('*',), False, True)] + [
+            Statement('Allow', ('s3:*',), False, True),
+        ]).allowed_actions)
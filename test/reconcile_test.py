@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import MagicMock, patch
+
+#
+# Internal libraries
+#
+
+from krux_iam.reconcile import Action, Plan, Reconciler, load_manifest
+from krux_iam.snapshot import Snapshot
+
+
+class ReconcilerTest(unittest.TestCase):
+    SNAPSHOT = Snapshot(
+        users=[{'UserName': 'jdoe'}, {'UserName': 'asmith'}, {'UserName': 'leaver'}],
+        groups=[{'GroupName': 'group1'}, {'GroupName': 'group2'}],
+        memberships=[('jdoe', 'group1'), ('asmith', 'group1'), ('asmith', 'group2')],
+    )
+    KEYS = {
+        'jdoe': [],
+        'asmith': [
+            {'AccessKeyId': 'new', 'CreateDate': 2},
+            {'AccessKeyId': 'old', 'CreateDate': 1},
+        ],
+    }
+    MANIFEST = {
+        'users': {
+            'jdoe': {'groups': ['group1', 'group2'], 'access_keys': 1},
+            'asmith': {'groups': ['group2'], 'access_keys': 1},
+            'newbie': {'groups': ['group1']},
+        },
+    }
+
+    def setUp(self):
+        self.iam = MagicMock()
+        self.iam.snapshot.return_value = self.SNAPSHOT
+        self.iam.get_access_keys.side_effect = lambda username: self.KEYS[username]
+        self.iam._run_concurrently.side_effect = lambda calls, message: [func(*args) for func, args in calls]
+        self.reconciler = Reconciler(self.iam)
+
+    def test_plan(self):
+        """
+        Reconciler.plan only contains the mutations needed to reach the manifest
+        """
+        plan = self.reconciler.plan(self.MANIFEST)
+
+        self.assertEqual([
+            [Action('create_user', 'newbie', None)],
+            [
+                Action('delete_user_from_group', 'asmith', 'group1'),
+                Action('delete_access_key', 'asmith', 'old'),
+                Action('add_user_to_group', 'jdoe', 'group2'),
+                Action('create_access_keys', 'jdoe', None),
+                Action('add_user_to_group', 'newbie', 'group1'),
+            ],
+            [],
+        ], plan.phases)
+        self.assertEqual(6, len(plan))
+        self.iam.snapshot.assert_called_once_with()
+        # Only existing users with a managed key count need their keys listed
+        self.assertEqual(2, self.iam.get_access_keys.call_count)
+
+    def test_plan_prune(self):
+        """
+        Reconciler.plan deletes users missing from the manifest only with prune
+        """
+        plan = Reconciler(self.iam, prune=True).plan(self.MANIFEST)
+
+        self.assertEqual([Action('delete_user', 'leaver', None)], plan.phases[2])
+
+    def test_plan_noop(self):
+        """
+        Reconciler.plan is empty when the account already matches the manifest
+        """
+        manifest = {'users': {'jdoe': {'groups': ['group1']}, 'asmith': {'groups': ['group1', 'group2']}}}
+
+        self.assertEqual(0, len(self.reconciler.plan(manifest)))
+
+    def test_apply(self):
+        """
+        Reconciler.apply runs each phase in order and returns the results of the actions
+        """
+        plan = Plan(
+            creates=[Action('create_user', 'newbie', None)],
+            changes=[Action('add_user_to_group', 'newbie', 'group1'), Action('create_access_keys', 'newbie', None)],
+            deletes=[Action('delete_user', 'leaver', None)],
+        )
+        self.iam.create_access_keys.return_value = ('123', 'ABC')
+
+        results = self.reconciler.apply(plan)
+
+        self.iam.create_user.assert_called_once_with('newbie')
+        self.iam.add_user_to_group.assert_called_once_with('newbie', 'group1')
+        self.iam.delete_user.assert_called_once_with('leaver')
+        self.assertEqual((plan.phases[1][1], ('123', 'ABC')), results[2])
+        self.assertEqual(3, self.iam._run_concurrently.call_count)
+
+    def test_reconcile_dry_run(self):
+        """
+        Reconciler.reconcile with dry_run writes the plan without applying it
+        """
+        out = MagicMock()
+
+        plan = self.reconciler.reconcile(self.MANIFEST, dry_run=True, out=out)
+
+        out.write.assert_called_once_with(plan.format() + '\n')
+        self.assertIn('create_user newbie', plan.format())
+        self.assertIn('delete_access_key asmith old', plan.format())
+        self.assertFalse(self.iam.create_user.called)
+
+    def test_reconcile_dry_run_stdout(self):
+        """
+        Reconciler.reconcile with dry_run writes to sys.stdout as it is when called
+        """
+        with patch('sys.stdout') as mock_stdout:
+            plan = self.reconciler.reconcile(self.MANIFEST, dry_run=True)
+
+        mock_stdout.write.assert_called_once_with(plan.format() + '\n')
+
+    def test_reconcile(self):
+        """
+        Reconciler.reconcile applies the plan, handing the new keys to the sink
+        """
+        sink = MagicMock()
+        self.iam.create_access_keys.return_value = ('123', 'ABC')
+
+        self.reconciler.reconcile(self.MANIFEST, sink=sink)
+
+        self.iam.create_user.assert_called_once_with('newbie')
+        self.iam.delete_access_key.assert_called_once_with('asmith', 'old')
+        sink.assert_called_once_with('jdoe', '123', 'ABC')
+
+    def test_reconcile_without_sink(self):
+        """
+        Reconciler.reconcile refuses to create keys whose secrets would be lost
+        """
+        with self.assertRaises(ValueError):
+            self.reconciler.reconcile(self.MANIFEST)
+
+        self.assertFalse(self.iam.create_user.called)
+        self.assertFalse(self.iam.create_access_keys.called)
+
+    def test_reconcile_sink_error(self):
+        """
+        Reconciler.reconcile deletes a new key the sink failed to take
+        """
+        self.iam.create_access_keys.return_value = ('123', 'ABC')
+
+        with self.assertRaises(IOError):
+            self.reconciler.reconcile(self.MANIFEST, sink=MagicMock(side_effect=IOError('disk full')))
+
+        self.iam.delete_access_key.assert_any_call('jdoe', '123')
+
+    def test_plan_too_many_keys(self):
+        """
+        Reconciler.plan rejects a manifest asking for more keys than a user can have
+        """
+        with self.assertRaises(ValueError):
+            self.reconciler.plan({'users': {'jdoe': {'access_keys': 3}}})
+
+        self.assertFalse(self.iam.snapshot.called)
+
+
+class LoadManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_json(self):
+        """
+        load_manifest reads JSON manifests
+        """
+        path = os.path.join(self.directory, 'manifest.json')
+        with open(path, 'w') as manifest:
+            json.dump(ReconcilerTest.MANIFEST, manifest)
+
+        self.assertEqual(ReconcilerTest.MANIFEST, load_manifest(path))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import datetime
+import unittest
+
+#
+# Third party libraries
+#
+
+from dateutil.tz import tzutc
+
+#
+# Internal libraries
+#
+
+from krux_iam.records import User, Group, AccessKey, to_columns
+
+
+class RecordsTest(unittest.TestCase):
+    CREATED = datetime.datetime(1970, 1, 2, tzinfo=tzutc())
+    USER = {
+        'Path': '/staff/',
+        'UserName': 'jdoe',
+        'UserId': 'AIDA1',
+        'Arn': 'arn:aws:iam::123456789012:user/staff/jdoe',
+        'CreateDate': CREATED,
+    }
+    GROUP = {
+        'Path': '/',
+        'GroupName': 'group1',
+        'GroupId': 'AGPA1',
+        'Arn': 'arn:aws:iam::123456789012:group/group1',
+        'CreateDate': CREATED,
+    }
+    KEY = {'UserName': 'jdoe', 'AccessKeyId': 'AKIA1', 'Status': 'Active', 'CreateDate': CREATED}
+
+    def test_user(self):
+        """
+        User keeps the attributes of a user dict with an epoch timestamp and rebuilds the ARN
+        """
+        user = User.from_dict(self.USER)
+
+        self.assertEqual('jdoe', user.name)
+        self.assertEqual('AIDA1', user.user_id)
+        self.assertEqual(86400, user.create_date)
+        self.assertIsNone(user.password_last_used)
+        self.assertEqual(self.USER['Arn'], user.arn)
+        self.assertFalse(hasattr(user, '__dict__'))
+
+    def test_group(self):
+        """
+        Group keeps the attributes of a group dict
+        """
+        group = Group.from_dict(self.GROUP)
+
+        self.assertEqual('group1', group.name)
+        self.assertEqual(self.GROUP['Arn'], group.arn)
+        self.assertEqual(86400, group.create_date)
+
+    def test_access_key(self):
+        """
+        AccessKey keeps the attributes of an access key dict
+        """
+        key = AccessKey.from_dict(self.KEY)
+
+        self.assertEqual(AccessKey('jdoe', 'AKIA1', 'Active', 86400), key)
+        self.assertEqual({'username': 'jdoe', 'access_key_id': 'AKIA1', 'status': 'Active', 'create_date': 86400}, key.to_dict())
+
+    def test_hashable(self):
+        """
+        Equal records hash alike, so records can be kept in sets and used as dict keys
+        """
+        keys = set([AccessKey.from_dict(self.KEY), AccessKey.from_dict(self.KEY), AccessKey('jdoe', 'AKIA2', 'Active', 0)])
+
+        self.assertEqual(2, len(keys))
+        self.assertIn(AccessKey('jdoe', 'AKIA1', 'Active', 86400), keys)
+        self.assertEqual({User.from_dict(self.USER): 1}, {User.from_dict(self.USER): 1})
+
+    def test_interned(self):
+        """
+        Repeated names are shared between records
+        """
+        name = ''.join(['jd', 'oe'])
+        first = AccessKey(name, 'AKIA1', 'Active', 0)
+        second = AccessKey(''.join(['j', 'doe']), 'AKIA2', 'Active', 0)
+
+        self.assertIs(first.username, second.username)
+
+    def test_non_native_strings(self):
+        """
+        Strings which cannot be interned, such as unicode on Python 2, are kept as they are
+        """
+        name = u'j\xf6rg'
+        user = User.from_dict({'UserName': name, 'Path': name, 'Arn': u'arn:aws:iam::123:user/j\xf6rg'})
+
+        self.assertEqual(name, user.name)
+        self.assertEqual(name, user.path)
+        self.assertIsNone(AccessKey(name, 'AKIA1', None, 0).status)
+
+    def test_to_columns(self):
+        """
+        to_columns turns records into a dict of attribute columns
+        """
+        keys = [AccessKey('jdoe', 'AKIA1', 'Active', 1), AccessKey('asmith', 'AKIA2', 'Inactive', 2)]
+
+        columns = to_columns(keys)
+
+        self.assertEqual(['username', 'access_key_id', 'status', 'create_date'], list(columns))
+        self.assertEqual(['jdoe', 'asmith'], columns['username'])
+        self.assertEqual([1, 2], columns['create_date'])
+        self.assertEqual({}, to_columns([]))
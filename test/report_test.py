@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Internal libraries
+#
+
+from krux_iam.report import CredentialReport, ReportKey
+
+
+HEADER = (
+    'user,arn,user_creation_time,password_enabled,password_last_used,password_last_changed,password_next_rotation,'
+    'mfa_active,access_key_1_active,access_key_1_last_rotated,access_key_1_last_used_date,'
+    'access_key_1_last_used_region,access_key_1_last_used_service,access_key_2_active,access_key_2_last_rotated,'
+    'access_key_2_last_used_date,access_key_2_last_used_region,access_key_2_last_used_service,cert_1_active,'
+    'cert_1_last_rotated,cert_2_active,cert_2_last_rotated'
+)
+
+REPORT = [
+    HEADER,
+    '<root_account>,arn:aws:iam::123456789012:root,1970-01-01T00:00:00+00:00,not_supported,no_information,'
+    'not_supported,not_supported,true,false,N/A,N/A,N/A,N/A,false,N/A,N/A,N/A,N/A,false,N/A,false,N/A',
+    # Uses their password, has a key used a day after creation and an unused inactive one
+    'jdoe,arn:aws:iam::123456789012:user/jdoe,1970-01-02T00:00:00+00:00,true,1970-01-11T00:00:00+00:00,'
+    '1970-01-02T00:00:00+00:00,N/A,true,true,1970-01-02T00:00:00+00:00,1970-01-03T00:00:00+00:00,us-east-1,s3,'
+    'false,1970-01-04T00:00:00+00:00,N/A,N/A,N/A,false,N/A,false,N/A',
+    # No password and a key never used
+    'asmith,arn:aws:iam::123456789012:user/asmith,1970-01-02T00:00:00+00:00,false,N/A,N/A,N/A,false,'
+    'true,1970-01-02T00:00:00+00:00,N/A,N/A,N/A,false,N/A,N/A,N/A,N/A,false,N/A,false,N/A',
+    '',
+]
+
+DAY = 86400
+
+
+class CredentialReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.report = CredentialReport.from_csv(iter(REPORT), generated_at=20 * DAY)
+
+    def test_from_csv(self):
+        """
+        from_csv parses every user, keeping the root account apart
+        """
+        entry = self.report.get('jdoe')
+
+        self.assertEqual(2, len(self.report))
+        self.assertEqual(set(['jdoe', 'asmith']), set(self.report.usernames()))
+        self.assertEqual('<root_account>', self.report.root.username)
+        self.assertEqual(20 * DAY, self.report.generated_at)
+        self.assertEqual(DAY, entry.created)
+        self.assertTrue(entry.password_enabled)
+        self.assertEqual(10 * DAY, entry.password_last_used)
+        self.assertTrue(entry.mfa_active)
+        self.assertEqual(
+            (ReportKey(1, True, DAY, 2 * DAY, 's3', 'us-east-1'), ReportKey(2, False, 3 * DAY, None, None, None)),
+            entry.access_keys,
+        )
+        self.assertEqual((), self.report.root.access_keys)
+        self.assertIsNone(self.report.get('nobody'))
+
+    def test_find_key(self):
+        """
+        find_key matches a key of a user by its creation time
+        """
+        self.assertEqual(2, self.report.find_key('jdoe', 3 * DAY).slot)
+        self.assertIsNone(self.report.find_key('jdoe', 5 * DAY))
+        self.assertIsNone(self.report.find_key('nobody', DAY))
+
+    def test_stale_keys(self):
+        """
+        stale_keys selects the active keys not used for the given time
+        """
+        stale = self.report.stale_keys(5 * DAY, now=10 * DAY)
+
+        self.assertEqual([('asmith', 1), ('jdoe', 1)], sorted((username, key.slot) for username, key in stale))
+        self.assertEqual(['asmith'], [username for username, _ in self.report.stale_keys(8 * DAY, now=10 * DAY)])
+
+    def test_inactive_users(self):
+        """
+        inactive_users selects the users who used neither password nor keys for the given time
+        """
+        self.assertEqual(['asmith'], self.report.inactive_users(5 * DAY, now=12 * DAY))
+        self.assertEqual(['asmith', 'jdoe'], self.report.inactive_users(DAY, now=12 * DAY))
+        self.assertEqual([], self.report.inactive_users(DAY, now=DAY))
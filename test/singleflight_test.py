@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import unittest
+
+#
+# Internal libraries
+#
+
+from krux_iam.singleflight import SingleFlight
+
+
+class _WatchedEvent(object):
+    """
+    An event which counts the threads waiting on it.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.waiters = 0
+
+    def wait(self):
+        self.waiters += 1
+        return self.event.wait()
+
+    def set(self):
+        self.event.set()
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def _slow(self, value):
+        def call():
+            self.calls.append(value)
+            self.started.set()
+            self.release.wait()
+            if isinstance(value, Exception):
+                raise value
+            return value
+        return call
+
+    def _run_concurrently(self, key, values):
+        # Starts the first call, has the others join it while in flight, then lets it return
+        with ThreadPoolExecutor(max_workers=len(values)) as executor:
+            futures = [executor.submit(self.flights.do, key, self._slow(values[0]))]
+            self.started.wait()
+            watched = self.flights._calls[key].done = _WatchedEvent()
+
+            futures.extend(executor.submit(self.flights.do, key, self._slow(value)) for value in values[1:])
+            while watched.waiters < len(values) - 1:
+                time.sleep(0.001)
+            self.release.set()
+
+        return futures
+
+    def test_do(self):
+        """
+        A single call returns its result, not shared
+        """
+        self.assertEqual(('value', False), self.flights.do('key', lambda: 'value'))
+        self.assertEqual(0, len(self.flights))
+
+    def test_concurrent_calls_are_shared(self):
+        """
+        Concurrent calls for the same key are made once and share the result
+        """
+        futures = self._run_concurrently('key', [1, 2, 3])
+
+        self.assertEqual([1], self.calls)
+        self.assertEqual([(1, False), (1, True), (1, True)], [future.result() for future in futures])
+        self.assertEqual(('other', False), self.flights.do('key', lambda: 'other'))
+
+    def test_errors_are_shared(self):
+        """
+        An exception of the in flight call is raised for every caller
+        """
+        error = ValueError('boom')
+
+        futures = self._run_concurrently('key', [error, 'unused'])
+
+        self.assertEqual([error], self.calls)
+        for future in futures:
+            self.assertIs(error, future.exception())
+        self.assertEqual(0, len(self.flights))
+
+    def test_forget(self):
+        """
+        A call forgotten while in flight is not joined by later callers, nor does it detach the call replacing it
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            first = executor.submit(self.flights.do, 'key', self._slow('old'))
+            self.started.wait()
+            self.flights.forget('key')
+
+            def fresh():
+                # The forgotten call returns while this one is in flight
+                self.release.set()
+                self.assertEqual(('old', False), first.result())
+                self.assertEqual(1, len(self.flights))
+                return 'fresh'
+
+            self.assertEqual(('fresh', False), self.flights.do('key', fresh))
+
+        self.assertEqual(0, len(self.flights))
+        self.flights.forget('unknown')
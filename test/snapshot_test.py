@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Internal libraries
+#
+
+from krux_iam.snapshot import Snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+    USER_DETAILS = [
+        {'UserName': 'jdoe', 'UserId': 'U1', 'GroupList': ['group1', 'group2'], 'UserPolicyList': []},
+        {'UserName': 'asmith', 'UserId': 'U2', 'GroupList': ['group2'], 'AttachedManagedPolicies': []},
+    ]
+    GROUP_DETAILS = [
+        {'GroupName': 'group1', 'GroupId': 'G1', 'GroupPolicyList': []},
+        {'GroupName': 'group2', 'GroupId': 'G2', 'AttachedManagedPolicies': []},
+    ]
+    KEYS = {'jdoe': [{'AccessKeyId': '123'}], 'asmith': []}
+
+    def setUp(self):
+        self.snapshot = Snapshot.from_authorization_details(
+            self.USER_DETAILS + self.GROUP_DETAILS,
+            access_keys=self.KEYS,
+        )
+
+    def test_get_user(self):
+        """
+        Snapshot.get_user returns the plain user attributes without the authorization details
+        """
+        self.assertEqual({'UserName': 'jdoe', 'UserId': 'U1'}, self.snapshot.get_user('jdoe'))
+        self.assertIsNone(self.snapshot.get_user('nobody'))
+
+    def test_get_groups(self):
+        """
+        Snapshot.get_groups returns the group dicts of the user's memberships
+        """
+        self.assertEqual(
+            [{'GroupName': 'group1', 'GroupId': 'G1'}, {'GroupName': 'group2', 'GroupId': 'G2'}],
+            self.snapshot.get_groups('jdoe'),
+        )
+        self.assertEqual([], self.snapshot.get_groups('nobody'))
+
+    def test_get_group_members(self):
+        """
+        Snapshot keeps a group to users index of the memberships
+        """
+        self.assertEqual(['jdoe', 'asmith'], self.snapshot.get_group_members('group2'))
+        self.assertEqual(['jdoe'], self.snapshot.get_group_members('group1'))
+        self.assertEqual([], self.snapshot.get_group_members('group3'))
+
+    def test_get_access_keys(self):
+        """
+        Snapshot.get_access_keys returns the loaded keys of the user
+        """
+        self.assertEqual(self.KEYS['jdoe'], self.snapshot.get_access_keys('jdoe'))
+        self.assertEqual([], self.snapshot.get_access_keys('nobody'))
+
+    def test_get_access_keys_not_loaded(self):
+        """
+        Snapshot.get_access_keys raises a ValueError when the snapshot was taken without keys
+        """
+        snapshot = Snapshot.from_authorization_details(self.USER_DETAILS)
+
+        with self.assertRaises(ValueError):
+            snapshot.get_access_keys('jdoe')
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+#
+# Internal libraries
+#
+
+from krux_iam.iam import IAM
+from krux_iam.memory import MemoryBackend
+from krux_iam.store import StateStore, RefreshResult
+from krux_iam.throttle import TokenBucket
+
+
+class StateStoreTest(unittest.TestCase):
+    TTL = 100
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'iam.db')
+        self.now = 1000.0
+
+        self.backend = MemoryBackend(seed=0)
+        self.backend.populate(users=3, groups=2, groups_per_user=1, keys_per_user=1)
+        self.iam = IAM(boto=None, rate_limiter=TokenBucket(rate=None), client=self.backend)
+
+        self.store = self._open()
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def _open(self):
+        return StateStore(self.path, ttl=self.TTL, clock=lambda: self.now)
+
+    def test_refresh(self):
+        """
+        refresh loads the users, groups, memberships and keys of the account
+        """
+        result = self.store.refresh(self.iam)
+
+        self.assertEqual(RefreshResult(changed=5, removed=0, key_listings=3), result)
+        self.assertEqual(['user0000000', 'user0000001', 'user0000002'], self.store.usernames())
+        self.assertEqual(self.iam.get_user('user0000001'), self.store.get_user('user0000001'))
+        self.assertEqual(self.iam.get_groups('user0000001'), self.store.get_groups('user0000001'))
+        self.assertEqual(self.iam.get_access_keys('user0000001'), self.store.get_access_keys('user0000001'))
+        group_name = self.store.get_groups('user0000001')[0]['GroupName']
+        self.assertIn('user0000001', self.store.get_group_members(group_name))
+        self.assertIsNone(self.store.get_user('nobody'))
+        self.assertEqual(1000.0, self.store.refreshed_at)
+
+    def test_warm_start(self):
+        """
+        A reopened store still fresh is served without any API call
+        """
+        self.store.refresh(self.iam)
+        self.store.close()
+        self.backend.calls.clear()
+
+        self.store = self._open()
+        result = self.store.refresh(self.iam)
+
+        self.assertEqual(RefreshResult(0, 0, 0), result)
+        self.assertEqual(0, sum(self.backend.calls.values()))
+        self.assertEqual(self.store.snapshot().get_access_keys('user0000000'), self.iam.get_access_keys('user0000000'))
+
+    def test_incremental_refresh(self):
+        """
+        A refresh writes only the changes and lists keys only of new or recreated users
+        """
+        self.store.refresh(self.iam)
+        self.iam.create_user('jdoe')
+        for key in self.iam.get_access_keys('user0000002'):
+            self.iam.delete_access_key('user0000002', key['AccessKeyId'])
+        self.iam.delete_user('user0000002')
+        self.iam.create_user('user0000002')
+        self.backend.calls.clear()
+        self.now += 1
+
+        result = self.store.refresh(self.iam, force=True)
+
+        self.assertEqual(RefreshResult(changed=2, removed=0, key_listings=2), result)
+        self.assertEqual(2, self.backend.calls['list_access_keys'])
+        self.assertEqual([], self.store.get_access_keys('user0000002'))
+        self.assertEqual([], self.store.get_groups('user0000002'))
+
+        self.iam.delete_user('jdoe')
+        self.now += self.TTL
+
+        result = self.store.refresh(self.iam)
+
+        self.assertEqual(RefreshResult(changed=0, removed=1, key_listings=3), result)
+        self.assertIsNone(self.store.get_user('jdoe'))
+
+    def test_access_keys_not_listed(self):
+        """
+        get_access_keys raises a ValueError when the keys were not listed
+        """
+        self.store.refresh(self.iam, include_access_keys=False)
+
+        self.assertRaises(ValueError, self.store.get_access_keys, 'user0000000')
+        self.assertIsNone(self.store.snapshot().access_keys)
+
+    def test_lookup_through_iam(self):
+        """
+        The store can stand in for a Snapshot in IAM's lookups
+        """
+        self.store.refresh(self.iam)
+        self.backend.calls.clear()
+
+        self.assertEqual('user0000000', self.iam.get_user('user0000000', snapshot=self.store)['UserName'])
+        self.assertEqual(1, len(self.iam.get_groups('user0000000', snapshot=self.store)))
+        self.assertEqual(0, sum(self.backend.calls.values()))
+
+    def test_shared_database(self):
+        """
+        A migration recreates the tables of the store alone, and a database with tables of the same names is refused
+        """
+        self.store.close()
+        db = sqlite3.connect(self.path)
+        with db:
+            db.execute('CREATE TABLE important (value TEXT)')
+            db.execute("INSERT INTO important (value) VALUES ('kept')")
+            db.execute("UPDATE meta SET value = 'old' WHERE key = 'schema_version'")
+        db.close()
+
+        self.store = self._open()
+        self.store.refresh(self.iam)
+        self.assertEqual([('kept',)], self.store._query('SELECT value FROM important'))
+
+        other = os.path.join(self.directory, 'other.db')
+        db = sqlite3.connect(other)
+        with db:
+            db.execute('CREATE TABLE users (id INTEGER)')
+        db.close()
+
+        with self.assertRaises(ValueError):
+            StateStore(other)
+        db = sqlite3.connect(other)
+        self.assertEqual([], db.execute('SELECT id FROM users').fetchall())
+        db.close()
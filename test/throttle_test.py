@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import patch
+from botocore.exceptions import ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, \
+    ReadTimeoutError
+
+#
+# Internal libraries
+#
+
+from krux_iam.throttle import TokenBucket, DecorrelatedJitter, get_rate_limiter, is_retryable_error, \
+    is_throttling_error, is_not_found_error, get_error_code
+
+
+def client_error(code, status=400):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'operation')
+
+
+class ErrorClassificationTest(unittest.TestCase):
+
+    def test_get_error_code(self):
+        """
+        get_error_code returns the code of a ClientError and None for anything else
+        """
+        self.assertEqual('NoSuchEntity', get_error_code(client_error('NoSuchEntity', 404)))
+        self.assertIsNone(get_error_code(ValueError()))
+
+    def test_not_found(self):
+        """
+        NoSuchEntity is recognized as a missing entity and is not retryable
+        """
+        error = client_error('NoSuchEntity', 404)
+
+        self.assertTrue(is_not_found_error(error))
+        self.assertFalse(is_retryable_error(error))
+        self.assertFalse(is_not_found_error(client_error('Throttling')))
+
+    def test_throttling(self):
+        """
+        Throttling error codes are recognized as throttling and retryable
+        """
+        error = client_error('Throttling')
+
+        self.assertTrue(is_throttling_error(error))
+        self.assertTrue(is_retryable_error(error))
+
+    def test_transient(self):
+        """
+        Transient errors, server errors and connection errors are retryable but not throttling
+        """
+        for error in (
+            client_error('ServiceFailure', 500),
+            client_error('SomethingNew', 503),
+            EndpointConnectionError(endpoint_url='https://iam.amazonaws.com'),
+            ConnectTimeoutError(endpoint_url='https://iam.amazonaws.com'),
+            ReadTimeoutError(endpoint_url='https://iam.amazonaws.com'),
+            ConnectionClosedError(endpoint_url='https://iam.amazonaws.com'),
+        ):
+            self.assertTrue(is_retryable_error(error))
+            self.assertFalse(is_throttling_error(error))
+
+    def test_not_retryable(self):
+        """
+        Client side errors are not retryable
+        """
+        self.assertFalse(is_retryable_error(client_error('NoSuchEntity', 404)))
+        self.assertFalse(is_retryable_error(ValueError()))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    @patch('krux_iam.throttle.time.sleep')
+    def test_burst(self, mock_sleep):
+        """
+        TokenBucket lets a burst through without sleeping, then paces callers
+        """
+        bucket = TokenBucket(rate=10.0, burst=3)
+
+        for _ in range(3):
+            self.assertEqual(0.0, bucket.acquire())
+        self.assertFalse(mock_sleep.called)
+
+        delay = bucket.acquire()
+
+        self.assertAlmostEqual(0.1, delay, places=2)
+        mock_sleep.assert_called_once_with(delay)
+
+    @patch('krux_iam.throttle.time.sleep')
+    def test_reservations_queue_up(self, mock_sleep):
+        """
+        Callers arriving on an empty bucket are scheduled one after the other
+        """
+        bucket = TokenBucket(rate=10.0, burst=1)
+        bucket.acquire()
+
+        first = bucket.acquire()
+        second = bucket.acquire()
+
+        self.assertAlmostEqual(first + 0.1, second, places=2)
+
+    def test_adaptive_rate(self):
+        """
+        Throttling halves the rate down to min_rate and successes recover it up to the maximum
+        """
+        bucket = TokenBucket(rate=8.0, min_rate=3.0, recovery=1.0)
+
+        bucket.on_throttle()
+        self.assertEqual(4.0, bucket.rate)
+        bucket.on_throttle()
+        self.assertEqual(3.0, bucket.rate)
+
+        for _ in range(10):
+            bucket.on_success()
+        self.assertEqual(8.0, bucket.rate)
+
+    @patch('krux_iam.throttle.time.sleep')
+    def test_unlimited(self, mock_sleep):
+        """
+        A TokenBucket without a rate never sleeps
+        """
+        bucket = TokenBucket(rate=None)
+
+        for _ in range(100):
+            bucket.acquire()
+        bucket.on_throttle()
+
+        self.assertFalse(mock_sleep.called)
+        self.assertIsNone(bucket.rate)
+
+    def test_get_rate_limiter(self):
+        """
+        get_rate_limiter always returns the same process wide bucket
+        """
+        self.assertIs(get_rate_limiter(), get_rate_limiter())
+
+
+class DecorrelatedJitterTest(unittest.TestCase):
+
+    def test_delays(self):
+        """
+        Delays stay between base and cap and within three times the previous delay
+        """
+        delays = DecorrelatedJitter(base=0.1, cap=2.0).delays()
+
+        previous = 0.1
+        for _ in range(50):
+            delay = next(delays)
+            self.assertTrue(0.1 <= delay <= min(2.0, previous * 3))
+            previous = delay
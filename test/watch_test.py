@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# © 2016 Krux Digital, Inc.
+#
+
+#
+# Standard libraries
+#
+
+from __future__ import absolute_import
+import itertools
+import unittest
+
+#
+# Third party libraries
+#
+
+from mock import ANY, MagicMock, patch, call
+
+#
+# Internal libraries
+#
+
+from krux_iam.iam import IAM
+from krux_iam.memory import MemoryBackend
+from krux_iam.throttle import TokenBucket
+from krux_iam.watch import Watcher, Change, USER_ADDED, USER_REMOVED, GROUP_ADDED, GROUP_REMOVED, \
+    MEMBERSHIP_ADDED, MEMBERSHIP_REMOVED, KEY_CREATED, KEY_DELETED, KEY_STATUS_CHANGED
+
+
+class WatcherTest(unittest.TestCase):
+    PAGE_SIZE = 3
+    CHUNK_SIZE = 4
+
+    def setUp(self):
+        self.backend = MemoryBackend(seed=0)
+        self.backend.populate(users=20, groups=2, groups_per_user=1, keys_per_user=1)
+        self.stats = MagicMock()
+        self.iam = IAM(
+            boto=None,
+            logger=MagicMock(),
+            stats=self.stats,
+            rate_limiter=TokenBucket(rate=None),
+            client=self.backend,
+        )
+        self.watcher = Watcher(self.iam, page_size=self.PAGE_SIZE, chunk_size=self.CHUNK_SIZE)
+        self.assertEqual([], self.watcher.poll())
+        self.stats.reset_mock()
+
+    def _types(self, changes):
+        return [(change.type, change.username, change.group_name) for change in changes]
+
+    def _chunk_counts(self):
+        calls = self.stats.incr.mock_calls
+        return calls.count(call('watch.chunks.changed')), calls.count(call('watch.chunks.unchanged'))
+
+    def test_no_changes(self):
+        """
+        A poll of an unchanged account reports nothing and skips every chunk
+        """
+        self.assertEqual([], self.watcher.poll())
+        self.assertEqual((0, 6), self._chunk_counts())
+
+    def test_only_changed_chunks_are_diffed(self):
+        """
+        A membership change is reported and only its chunk is looked into
+        """
+        self.backend.add_user_to_group(GroupName='group00001', UserName='user0000002')
+
+        self.assertEqual(
+            [(MEMBERSHIP_ADDED, 'user0000002', 'group00001')],
+            self._types(self.watcher.poll()),
+        )
+        self.assertEqual((1, 5), self._chunk_counts())
+
+    def test_shifted_listing(self):
+        """
+        A user added at the start of the listing only changes its own chunk, though every page shifts
+        """
+        self.backend.create_user(UserName='aaa')
+
+        self.assertEqual([(USER_ADDED, 'aaa', None)], self._types(self.watcher.poll()))
+        self.assertEqual((1, 5), self._chunk_counts())
+
+    def test_failed_poll(self):
+        """
+        A poll which fails leaves the known state as it was, so the next one reports the changes
+        """
+        self.backend.create_user(UserName='new')
+        real_call = self.iam._call
+        calls = []
+
+        def fail_late(operation, **kwargs):
+            # Fails on the last page, once the user has been seen
+            calls.append(operation)
+            if len(calls) == 8:
+                raise RuntimeError('throttled')
+            return real_call(operation, **kwargs)
+
+        with patch.object(self.iam, '_call', side_effect=fail_late):
+            with self.assertRaises(RuntimeError):
+                self.watcher.poll()
+
+        self.assertEqual([(USER_ADDED, 'new', None)], self._types(self.watcher.poll()))
+
+    def test_users_and_groups(self):
+        """
+        Users and groups added and removed are reported, with the memberships of new users
+        """
+        self.backend.remove_user_from_group(GroupName='group00000', UserName='user0000000')
+        self.backend.delete_access_key(
+            UserName='user0000000',
+            AccessKeyId=self.backend.list_access_keys(UserName='user0000000')['AccessKeyMetadata'][0]['AccessKeyId'],
+        )
+        self.backend.delete_user(UserName='user0000000')
+        self.backend.create_group(GroupName='admins')
+        self.backend.create_user(UserName='new')
+        self.backend.add_user_to_group(GroupName='admins', UserName='new')
+
+        changes = self.watcher.poll()
+
+        self.assertEqual(sorted([
+            (GROUP_ADDED, None, 'admins'),
+            (USER_ADDED, 'new', None),
+            (MEMBERSHIP_ADDED, 'new', 'admins'),
+            (USER_REMOVED, 'user0000000', None),
+        ]), sorted(self._types(changes)))
+        self.assertEqual('new', [change for change in changes if change.type == USER_ADDED][0].detail['UserName'])
+
+        self.backend.remove_user_from_group(GroupName='admins', UserName='new')
+        self.backend.delete_group(GroupName='admins')
+
+        self.assertEqual(
+            [(MEMBERSHIP_REMOVED, 'new', 'admins'), (GROUP_REMOVED, None, 'admins')],
+            self._types(self.watcher.poll()),
+        )
+
+    def test_recreated_user(self):
+        """
+        A user deleted and created again between polls is reported as removed and added
+        """
+        self.backend.remove_user_from_group(GroupName='group00001', UserName='user0000005')
+        key_id = self.backend.list_access_keys(UserName='user0000005')['AccessKeyMetadata'][0]['AccessKeyId']
+        self.backend.delete_access_key(UserName='user0000005', AccessKeyId=key_id)
+        self.backend.delete_user(UserName='user0000005')
+        self.backend.create_user(UserName='user0000005')
+
+        self.assertEqual(
+            [(USER_REMOVED, 'user0000005', None), (USER_ADDED, 'user0000005', None)],
+            self._types(self.watcher.poll()),
+        )
+
+    def test_access_keys(self):
+        """
+        With include_access_keys, keys created, deleted and deactivated are reported
+        """
+        watcher = Watcher(self.iam, include_access_keys=True)
+        watcher.poll()
+        old_key = self.backend.list_access_keys(UserName='user0000001')['AccessKeyMetadata'][0]['AccessKeyId']
+        other_key = self.backend.list_access_keys(UserName='user0000002')['AccessKeyMetadata'][0]['AccessKeyId']
+        new_key = self.backend.create_access_key(UserName='user0000001')['AccessKey']['AccessKeyId']
+        self.backend.delete_access_key(UserName='user0000001', AccessKeyId=old_key)
+        self.backend.update_access_key(UserName='user0000002', AccessKeyId=other_key, Status='Inactive')
+
+        changes = sorted(watcher.poll(), key=lambda change: (change.username, change.type))
+
+        self.assertEqual([
+            Change(KEY_CREATED, 'user0000001', None, new_key, ANY),
+            Change(KEY_DELETED, 'user0000001', None, old_key, None),
+            Change(KEY_STATUS_CHANGED, 'user0000002', None, other_key, ANY),
+        ], changes)
+        self.assertEqual('Inactive', changes[2].detail['Status'])
+
+    def test_initial(self):
+        """
+        With initial, the first poll reports the whole account as added
+        """
+        changes = Watcher(self.iam, initial=True).poll()
+
+        self.assertEqual(2, len([change for change in changes if change.type == GROUP_ADDED]))
+        self.assertEqual(20, len([change for change in changes if change.type == USER_ADDED]))
+        self.assertEqual(20, len([change for change in changes if change.type == MEMBERSHIP_ADDED]))
+
+    @patch('krux_iam.iam.time.sleep')
+    def test_iam_watch(self, mock_sleep):
+        """
+        IAM.watch polls at the given interval and yields the changes as they are seen
+        """
+        mock_sleep.side_effect = lambda delay: self.backend.create_user(UserName='new{0}'.format(mock_sleep.call_count))
+
+        changes = list(itertools.islice(self.iam.watch(interval=30), 2))
+
+        self.assertEqual([(USER_ADDED, 'new1', None), (USER_ADDED, 'new2', None)], self._types(changes))
+        self.assertEqual(2, mock_sleep.call_count)
+        self.assertTrue(0 < mock_sleep.call_args[0][0] <= 30)
+
+    @patch('krux_iam.iam.time.sleep')
+    def test_iam_watch_error(self, mock_sleep):
+        """
+        IAM.watch logs a failed poll and keeps polling
+        """
+        real_call = self.iam._call
+        calls = []
+
+        def fail_once(operation, **kwargs):
+            calls.append(operation)
+            if len(calls) == 1:
+                raise RuntimeError('throttled')
+            return real_call(operation, **kwargs)
+
+        mock_sleep.side_effect = lambda delay: self.backend.create_user(UserName='new{0}'.format(mock_sleep.call_count))
+
+        with patch.object(self.iam, '_call', side_effect=fail_once):
+            changes = list(itertools.islice(self.iam.watch(interval=30), 1))
+
+        self.assertEqual([(USER_ADDED, 'new2', None)], self._types(changes))
+        self.assertTrue(self.iam._logger.warning.called)
+